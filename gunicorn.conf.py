@@ -0,0 +1,21 @@
+"""
+Gunicorn settings for serving the API in production.
+
+Every worker process runs GUNICORN_THREADS threads, and each thread keeps its
+own persistent database connection (DB_CONN_MAX_AGE), so the database has
+to accept GUNICORN_WORKERS * GUNICORN_THREADS connections from every host.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then, so a slow leak cannot grow without bound.
+max_requests = 1000
+max_requests_jitter = 100
+accesslog = '-'
@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import City, UserSubscriptions, Subscription
+from .models import City, Delivery, DispatchRun, Observation, ObservationAggregate, UserSubscriptions, Subscription
 
 admin.site.register(UserSubscriptions)
 admin.site.register(Subscription)
 admin.site.register(City)
+admin.site.register(Observation)
+admin.site.register(ObservationAggregate)
+admin.site.register(DispatchRun)
+admin.site.register(Delivery)
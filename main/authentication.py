@@ -0,0 +1,124 @@
+import hashlib
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+# What authentication and the views read from request.user; the rest, the password hash included, is never cached.
+CACHED_USER_FIELDS = ('id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _user_key(user_id):
+    version_key = f'auth:user:{user_id}:version'
+    if (version := cache.get(version_key)) is None:
+        cache.add(version_key, time.time(), timeout=None)
+        version = cache.get(version_key)
+    return f'auth:user:{user_id}:{version}'
+
+
+def _token_key(key):
+    # Only a digest of the token ends up in the cache, never the credential itself.
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _cached_fields(user):
+    return {field: getattr(user, field) for field in CACHED_USER_FIELDS}
+
+
+def _from_cache(fields):
+    """
+    Build a user from its cached fields, leaving every other field deferred.
+
+    Deferred fields are loaded from the database when read, and saving the
+    user only writes the cached fields, so nothing missing from the cache is
+    ever written back blank.
+    """
+    user_model = get_user_model()
+    # from_db() expects the values in the order of the model's fields.
+    names = [field.attname for field in user_model._meta.concrete_fields if field.attname in fields]
+    return user_model.from_db(user_model.objects.db, names, [fields[name] for name in names])
+
+
+def cached_user(user_id):
+    """
+    Return the user with the given id, from the shared cache if possible.
+
+    Only CACHED_USER_FIELDS are cached, for AUTH_USER_CACHE_TTL seconds,
+    keyed by user id and the user's version. Every save or delete of a user bumps the version
+    (see `forget_user`), so password changes, deactivations and permission
+    changes apply to the next request, even if a request that read the user
+    before the change caches it afterwards. Changes made with
+    QuerySet.update() send no signals and only apply once the entry expires.
+
+    Returns:
+        User: The user, or None if there is no such user.
+    """
+    key = _user_key(user_id)
+    if (fields := cache.get(key)) is not None:
+        return _from_cache(fields)
+    user_model = get_user_model()
+    try:
+        user = user_model.objects.only(*CACHED_USER_FIELDS).get(**{api_settings.USER_ID_FIELD: user_id})
+    except (user_model.DoesNotExist, ValueError):
+        return None
+    cache.set(key, _cached_fields(user), timeout=settings.AUTH_USER_CACHE_TTL)
+    return user
+
+
+def forget_user(user_id):
+    cache.set(f'auth:user:{user_id}:version', time.time(), timeout=None)
+
+
+def forget_token(key):
+    cache.delete(_token_key(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication resolving the token's user from the cache instead of a query per request.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if (user := cached_user(user_id)) is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication caching which user a token belongs to, so known tokens need no query.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _token_key(key)
+        if (user_id := cache.get(cache_key)) is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user_id = token.user_id
+            cache.set(cache_key, user_id, timeout=settings.AUTH_USER_CACHE_TTL)
+            cache.set(_user_key(user_id), _cached_fields(token.user), timeout=settings.AUTH_USER_CACHE_TTL)
+            user = token.user
+        else:
+            user = cached_user(user_id)
+            token = self.get_model()(key=key, user_id=user_id)
+
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, token
@@ -0,0 +1,66 @@
+from main.benchmarks import api, delivery, due_index, fetch, history, pipeline, planner, serving, tick
+
+BENCHMARKS = {
+    'planner': planner.run,
+    'fetch': fetch.run,
+    'delivery': delivery.run,
+    'due_index': due_index.run,
+    'pipeline': pipeline.run,
+    'tick': tick.run,
+    'api': api.run,
+    'serving': serving.run,
+    'history': history.run,
+}
+
+LOWER_IS_BETTER = ('seconds', '_ms', 'queries', 'upstream_requests', '_kib')
+HIGHER_IS_BETTER = ('per_second', 'speedup')
+
+
+def result_key(result):
+    """
+    Identify a result across runs by its benchmark, its size and its string-valued fields.
+
+    Every benchmark reports its data set size right after the benchmark name.
+    """
+    size = list(result.items())[1]
+    return (size,) + tuple((key, value) for key, value in result.items() if isinstance(value, str) and key != 'benchmark')
+
+
+def compare(baseline, results):
+    """
+    Compare the metrics of two benchmark runs.
+
+    Args:
+        baseline (list): Results of the earlier run.
+        results (list): Results of the run to check.
+
+    Yields:
+        dict: One entry per metric present in both runs, with the relative
+              change in percent and whether it is a regression, i.e. worse
+              for a metric with a known better direction.
+    """
+    previous = {(result['benchmark'], result_key(result)): result for result in baseline}
+    for result in results:
+        key = result_key(result)
+        if (old := previous.get((result['benchmark'], key))) is None:
+            continue
+        for metric, value in result.items():
+            old_value = old.get(metric)
+            if metric in dict(key) or isinstance(value, str) or not isinstance(old_value, (int, float)) or not old_value:
+                continue
+            change = (value - old_value) / old_value * 100
+            if metric.endswith(HIGHER_IS_BETTER):
+                worse = -change
+            elif metric.endswith(LOWER_IS_BETTER):
+                worse = change
+            else:
+                worse = None
+            yield {
+                'benchmark': result['benchmark'],
+                'key': key,
+                'metric': metric,
+                'baseline': old_value,
+                'value': value,
+                'change_percent': round(change, 1),
+                'regression_percent': None if worse is None else round(worse, 1),
+            }
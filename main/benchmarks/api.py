@@ -0,0 +1,71 @@
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+from main.benchmarks.data import generate
+from main.models import UserSubscriptions
+
+
+def _latencies(client, url, requests, **extra):
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(url, **extra)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url, **extra)
+    return timings, len(queries)
+
+
+def run(sizes=(1000, 10000, 100000), requests=200):
+    """
+    Measure the latency of the read endpoints at a growing number of users.
+
+    Each endpoint is requested `requests` times in a row by one logged-in
+    user through the Django test client, so the numbers cover the whole
+    request cycle except the network. The subscription endpoints should
+    stay flat however many rows other users own. The subscription list is
+    also requested with a JWT instead of the session, as mobile clients do.
+    """
+    setup_test_environment()
+    try:
+        results = []
+        created = 0
+        for size in sorted(sizes):
+            generate(size - created)
+            created = size
+            cache.clear()
+
+            user = User.objects.get(username='bench0')
+            subscription = UserSubscriptions.objects.get(user=user).subscriptions.first()
+            client = Client()
+            client.force_login(user)
+            jwt = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+            endpoints = {
+                'cities': (client, reverse('cities'), {}),
+                'my_subscriptions': (client, reverse('my_subscriptions'), {}),
+                'my_subscriptions_jwt': (Client(), reverse('my_subscriptions'), jwt),
+                'subscription_detail': (client, reverse('subscription-detail', args=[subscription.id]), {}),
+            }
+
+            for endpoint, (endpoint_client, url, extra) in endpoints.items():
+                timings, queries = _latencies(endpoint_client, url, requests, **extra)
+                percentiles = statistics.quantiles(timings, n=100)
+                results.append({
+                    'benchmark': 'api',
+                    'users': size,
+                    'endpoint': endpoint,
+                    'requests': requests,
+                    'queries': queries,
+                    'p50_ms': round(percentiles[49] * 1000, 3),
+                    'p99_ms': round(percentiles[98] * 1000, 3),
+                })
+        return results
+    finally:
+        teardown_test_environment()
@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from main.models import City, Subscription, UserSubscriptions
+
+PERIODS = (1, 2, 3, 4, 6, 12, 24)
+
+
+def generate(users, cities=50, subscriptions_per_user=2):
+    """
+    Fill the database with synthetic users, cities and subscriptions.
+
+    Everything is written with bulk_create, so generating hundreds of
+    thousands of rows takes seconds rather than hours.
+
+    Args:
+        users (int): Number of users to create, each with an email address.
+        cities (int): Number of distinct cities subscriptions are spread over.
+        subscriptions_per_user (int): Number of subscriptions linked to every user.
+
+    Users subscribe to the shared subscription of each (city, period)
+    schedule, which are due within an hour either side of now, so about
+    half of them are due when a tick runs right after generating.
+    """
+    now = timezone.now()
+    start = User.objects.count()
+    city_objects = list(City.objects.order_by('id')[:cities])
+    city_objects += City.objects.bulk_create(
+        City(name=f'City {i}', key=City.normalize(f'City {i}')) for i in range(len(city_objects), cities)
+    )
+    user_objects = User.objects.bulk_create(
+        User(username=f'bench{start + i}', email=f'bench{start + i}@example.com', password='!')
+        for i in range(users)
+    )
+
+    chosen = [
+        [
+            (city_objects[(i * subscriptions_per_user + j) % cities].id, PERIODS[(i + j) % len(PERIODS)])
+            for j in range(subscriptions_per_user)
+        ]
+        for i in range(users)
+    ]
+    schedules = list(dict.fromkeys(schedule for user_schedules in chosen for schedule in user_schedules))
+    Subscription.objects.bulk_create(
+        [
+            Subscription(
+                city_id=city_id,
+                notification_period=notification_period,
+                next_due_at=now + timedelta(minutes=index * 7 % 120 - 60),
+            )
+            for index, (city_id, notification_period) in enumerate(schedules)
+        ],
+        ignore_conflicts=True,
+    )
+    subscriptions = Subscription.for_schedules(schedules)
+    user_subscriptions = UserSubscriptions.objects.bulk_create(UserSubscriptions(user=user) for user in user_objects)
+
+    through = UserSubscriptions.subscriptions.through
+    through.objects.bulk_create(
+        (
+            through(usersubscriptions=user_subs, subscription=subscriptions[schedule])
+            for user_subs, user_schedules in zip(user_subscriptions, chosen)
+            for schedule in user_schedules
+        ),
+        ignore_conflicts=True,
+    )
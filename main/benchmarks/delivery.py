@@ -0,0 +1,39 @@
+import time
+from django.core.mail import send_mail
+from django.test import override_settings
+from main.delivery import Mailer, weather_message
+from main.testing import SMTPSink
+
+
+def run(sizes=(100, 1000)):
+    """
+    Compare one send_mail call per email against the pooled, batched Mailer.
+
+    Both paths deliver into a local SMTP sink, so the difference is the cost
+    of opening a new SMTP session for every message.
+    """
+    results = []
+    for size in sorted(sizes):
+        with SMTPSink() as sink, override_settings(**sink.settings()):
+            started = time.perf_counter()
+            for i in range(size):
+                send_mail("Погода в Kyiv", "Сонячно", None, [f'user{i}@example.com'])
+            per_message = time.perf_counter() - started
+            per_message_connections = sink.connections
+
+            mailer = Mailer()
+            started = time.perf_counter()
+            mailer.send(weather_message('Kyiv', 'Сонячно', [f'user{i}@example.com']) for i in range(size))
+            pooled = time.perf_counter() - started
+            mailer.close()
+
+        results.append({
+            'benchmark': 'delivery',
+            'emails': size,
+            'send_mail_per_second': round(size / per_message, 1),
+            'send_mail_connections': per_message_connections,
+            'pooled_per_second': round(size / pooled, 1),
+            'pooled_connections': sink.connections - per_message_connections,
+            'batches': len(mailer.batch_timings),
+        })
+    return results
@@ -0,0 +1,64 @@
+import math
+import time
+from datetime import timedelta
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Mod
+from django.utils import timezone
+from main.benchmarks.data import PERIODS
+from main.models import City, Subscription
+
+
+def _add_cities(first, last, now):
+    """
+    Create cities `first` to `last` (excluded) with a subscription for every period in PERIODS.
+
+    Subscriptions are shared per (city, period), so the table only grows
+    with the number of cities; users are left out, as neither query reads them.
+    """
+    cities = City.objects.bulk_create(
+        City(name=f'Due index {i}', key=City.normalize(f'Due index {i}')) for i in range(first, last)
+    )
+    Subscription.objects.bulk_create(
+        Subscription(city=city, notification_period=period, next_due_at=now + timedelta(minutes=index * 7 % 120 - 60))
+        for index, (city, period) in enumerate((city, period) for city in cities for period in PERIODS)
+    )
+
+
+def _measure(queryset, repeat=5):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        count = queryset.count()
+    return count, (time.perf_counter() - started) / repeat
+
+
+def run(sizes=(100000, 1000000)):
+    """
+    Compare the old `hour % notification_period` scan with the indexed next_due_at range query.
+
+    The scan has to evaluate the modulo for every subscription, while the
+    range query only visits index entries that are actually due.
+    """
+    results = []
+    cities = 0
+    for size in sorted(sizes):
+        now = timezone.now()
+        target = math.ceil(size / len(PERIODS))
+        _add_cities(cities, target, now)
+        cities = target
+
+        scan = Subscription.objects.annotate(
+            remainder=Mod(Value(timezone.localtime(now).hour, output_field=FloatField()), F('notification_period'))
+        ).filter(remainder=0)
+        indexed = Subscription.objects.filter(next_due_at__lte=now)
+
+        scan_due, scan_seconds = _measure(scan)
+        indexed_due, indexed_seconds = _measure(indexed)
+        results.append({
+            'benchmark': 'due_index',
+            'subscriptions': Subscription.objects.count(),
+            'scan_due': scan_due,
+            'scan_seconds': round(scan_seconds, 4),
+            'indexed_due': indexed_due,
+            'indexed_seconds': round(indexed_seconds, 4),
+        })
+    return results
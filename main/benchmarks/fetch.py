@@ -0,0 +1,59 @@
+import time
+from django.test import override_settings
+from main.models import City
+from main.testing import WeatherbitStub
+from django.core.cache import cache
+from main.weather import Location, fetch_bulletins, fetch_weather, observations
+
+
+def run(sizes=(10, 50, 200), latency=0.1):
+    """
+    Compare fetching city weather one by one against the parallel and bulk fetch stages.
+
+    A local Weatherbit stub answers every request after `latency` seconds.
+    The first fetch_bulletins call finds the cities by name in parallel and
+    resolves their coordinates, the second one, with the caches cleared,
+    fetches the now located cities in bulk.
+    """
+    results = []
+    for size in sorted(sizes):
+        City.objects.all().delete()
+        cache.clear()
+        observations.clear()
+        cities = {
+            city.id: Location(city.name)
+            for city in City.objects.bulk_create(
+                City(name=f'City {i}', key=City.normalize(f'City {i}')) for i in range(size)
+            )
+        }
+
+        with WeatherbitStub(latency=latency) as stub, override_settings(WEATHER_API_URL=stub.url):
+            started = time.perf_counter()
+            for city in cities.values():
+                fetch_weather(city.name)
+            sequential = time.perf_counter() - started
+
+            started = time.perf_counter()
+            fetch_bulletins(cities)
+            parallel = time.perf_counter() - started
+
+            cities = {city.id: Location(city.name, city.lat, city.lon) for city in City.objects.all()}
+            cache.clear()
+            observations.clear()
+            stub.requests.clear()
+            started = time.perf_counter()
+            fetch_bulletins(cities)
+            bulk = time.perf_counter() - started
+            bulk_requests = len(stub.requests)
+
+        results.append({
+            'benchmark': 'fetch',
+            'cities': size,
+            'sequential_seconds': round(sequential, 4),
+            'parallel_seconds': round(parallel, 4),
+            'bulk_seconds': round(bulk, 4),
+            'bulk_requests': bulk_requests,
+            'speedup': round(sequential / parallel, 2),
+            'bulk_speedup': round(sequential / bulk, 2),
+        })
+    return results
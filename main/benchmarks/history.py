@@ -0,0 +1,77 @@
+import statistics
+import time
+from datetime import timedelta
+from django.utils import timezone
+from main.benchmarks.data import generate
+from main.history import downsample, history
+from main.models import City, Observation, ObservationAggregate
+
+# Resolution: how far back a request reads.
+SPANS = {'raw': timedelta(days=1), 'hour': timedelta(days=7), 'day': timedelta(days=365)}
+
+
+def _fill(cities, days, now):
+    Observation.objects.all().delete()
+    ObservationAggregate.objects.all().delete()
+    start = now.replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+    for day in range(days):
+        Observation.objects.bulk_create(
+            Observation(
+                city_id=city_id, ob_time=start + timedelta(days=day, hours=hour), temp=hour % 12 + city_id % 10,
+                app_temp=hour % 12, pres=1000 + day % 20, wind_spd=hour % 7, wind_cdir_full='north',
+                rh=50 + hour, vis=10, uv=hour % 9,
+            )
+            for city_id in cities for hour in range(24)
+        )
+
+
+def _latencies(city_id, now, requests):
+    latencies = {}
+    for resolution, span in SPANS.items():
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            history(city_id, resolution, now - span, now)
+            timings.append(time.perf_counter() - started)
+        latencies[f'{resolution}_p50_ms'] = round(statistics.median(timings) * 1000, 3)
+    return latencies
+
+
+def run(sizes=(30, 365), cities=50, requests=20):
+    """
+    Measure history reads and the retention job against a growing amount of stored history.
+
+    Every city gets an hourly observation for each of the last `size` days.
+    Reading the last day of raw, the last week of hourly and the last year
+    of daily history is timed before and after downsample() rolls the old
+    observations up, along with the job itself. Reads should stay flat
+    whatever the size, as they are range scans over (city, time) indexes.
+    """
+    generate(0, cities=cities)
+    city_ids = list(City.objects.order_by('id').values_list('id', flat=True)[:cities])
+    results = []
+    for size in sorted(sizes):
+        now = timezone.now()
+        _fill(city_ids, size, now)
+        observations = Observation.objects.count()
+
+        results.append({'benchmark': 'history', 'days': size, 'phase': 'before', 'observations': observations,
+                        **_latencies(city_ids[0], now, requests)})
+
+        started = time.perf_counter()
+        hourly, daily = downsample(now)
+        seconds = time.perf_counter() - started
+        results.append({
+            'benchmark': 'history',
+            'days': size,
+            'phase': 'downsample',
+            'observations': observations,
+            'seconds': round(seconds, 4),
+            'hourly_aggregates': hourly,
+            'daily_aggregates': daily,
+            'rows_left': Observation.objects.count() + ObservationAggregate.objects.count(),
+        })
+
+        results.append({'benchmark': 'history', 'days': size, 'phase': 'after', 'observations': observations,
+                        **_latencies(city_ids[0], now, requests)})
+    return results
@@ -0,0 +1,86 @@
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import islice
+from django.core.cache import cache
+from django.test import override_settings
+from main.delivery import Mailer, MailerPool, bulletin_messages
+from main.pipeline import Pipeline
+from main.testing import SMTPSink, WeatherbitStub
+from main.weather import Location, collect_bulletins, observations
+
+Notification = namedtuple(
+    'Notification',
+    'subscription_id user_id email city_id city_name city_lat city_lon next_due_at notification_period digest',
+    defaults=(False,),
+)
+
+
+def notifications(size, per_city):
+    for i in range(size):
+        yield Notification(i, i, f'user{i}@example.com', i // per_city, f'City {i // per_city}', None, None, None, 1)
+
+
+def blocks(size, per_city, block_size):
+    rows = notifications(size, per_city)
+    while block := list(islice(rows, block_size)):
+        yield block
+
+
+def measure(deliver):
+    cache.clear()
+    observations.clear()
+    tracemalloc.start()
+    started = time.perf_counter()
+    deliver()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(sizes=(1000, 5000), per_city=20, block_size=100, senders=4, latency=0.05):
+    """
+    Compare fetching, rendering and sending block by block against the streaming Pipeline.
+
+    Notifications are synthetic, one recipient per message, with `per_city`
+    subscribers per city. The Weatherbit stub answers after `latency`
+    seconds and mail goes into a local SMTP sink. The inline path runs the
+    three stages one after another for every block over one connection,
+    the pipeline overlaps them and sends over `senders` connections.
+    """
+    results = []
+    for size in sorted(sizes):
+        with WeatherbitStub(latency=latency) as stub, SMTPSink(keep_messages=False) as sink, \
+                override_settings(WEATHER_API_URL=stub.url, EMAIL_BCC_SIZE=1, **sink.settings()):
+            mailer = Mailer()
+
+            def inline():
+                for block in blocks(size, per_city, block_size):
+                    bulletins = collect_bulletins({
+                        row.city_id: Location(row.city_name) for row in block
+                    })
+                    mailer.send(bulletin_messages(block, bulletins))
+                mailer.close()
+
+            pool = MailerPool(senders)
+
+            def pipelined():
+                Pipeline(pool, lambda notifications, status: None, queue_size=20).run(
+                    blocks(size, per_city, block_size)
+                )
+                pool.close()
+
+            inline_seconds, inline_peak = measure(inline)
+            pipeline_seconds, pipeline_peak = measure(pipelined)
+
+        results.append({
+            'benchmark': 'pipeline',
+            'notifications': size,
+            'inline_seconds': round(inline_seconds, 4),
+            'pipeline_seconds': round(pipeline_seconds, 4),
+            'speedup': round(inline_seconds / pipeline_seconds, 2),
+            'inline_peak_kib': round(inline_peak / 1024),
+            'pipeline_peak_kib': round(pipeline_peak / 1024),
+        })
+    return results
@@ -0,0 +1,35 @@
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from main.benchmarks.data import generate
+from main.planner import due_notifications
+
+
+def run(sizes=(1000, 10000, 100000)):
+    """
+    Measure the dispatch planner at a growing number of users.
+
+    For every size the database is topped up to that many users and a full
+    plan for the current time is consumed. The query count is expected to stay flat
+    while only the time grows with the number of due rows.
+    """
+    results = []
+    created = 0
+    for size in sorted(sizes):
+        generate(size - created)
+        created = size
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            due = sum(1 for _ in due_notifications(timezone.now()))
+            elapsed = time.perf_counter() - started
+
+        results.append({
+            'benchmark': 'planner',
+            'users': size,
+            'due': due,
+            'queries': len(queries),
+            'seconds': round(elapsed, 4),
+        })
+    return results
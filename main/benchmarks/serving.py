@@ -0,0 +1,137 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, WSGIServer
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from main.benchmarks.data import generate
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    A WSGI server handing requests to a fixed pool of threads, like a gunicorn gthread worker.
+
+    Threads outlive requests, so with CONN_MAX_AGE set every thread keeps
+    reusing its database connection.
+    """
+
+    def __init__(self, *args, threads=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+# Profile name: (server factory, CONN_MAX_AGE).
+PROFILES = {
+    # What `manage.py runserver` does: a new thread and a new connection per request.
+    'runserver': (lambda address: ThreadedWSGIServer(address, QuietRequestHandler), 0),
+    # The production profile: pooled threads keeping their connections open.
+    'pooled': (lambda address: PooledWSGIServer(address, QuietRequestHandler), 60),
+}
+
+
+def _serve(profile):
+    factory, conn_max_age = PROFILES[profile]
+    connections.settings['default']['CONN_MAX_AGE'] = conn_max_age
+    server = factory(('127.0.0.1', 0))
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _load(url, cookies, concurrency, requests_per_client):
+    def client():
+        timings, errors = [], 0
+        with requests.Session() as session:
+            session.cookies.update(cookies)
+            for _ in range(requests_per_client):
+                started = time.perf_counter()
+                response = session.get(url)
+                timings.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+        return timings, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda _: client(), range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings = [timing for client_timings, _ in outcomes for timing in client_timings]
+    return timings, sum(errors for _, errors in outcomes), elapsed
+
+
+def run(sizes=(1000, 10000), concurrency=16, requests_per_client=50):
+    """
+    Compare requests per second and p99 latency of the read endpoints under two serving profiles.
+
+    Each profile runs a real HTTP server in this process against the
+    benchmark database, loaded by `concurrency` clients with keep-alive
+    sessions: `runserver` starts a thread and opens a database connection
+    per request, as the development server does, while `pooled` hands
+    requests to a fixed pool of threads that keep their connections, as
+    gunicorn's gthread workers do with DB_CONN_MAX_AGE. Connection setup
+    only costs anything on a networked database such as PostgreSQL; on the
+    in-memory SQLite stand-in the difference is down to the threading model.
+    """
+    results = []
+    created = 0
+    default_max_age = connections.settings['default'].get('CONN_MAX_AGE', 0)
+    try:
+        with override_settings(ALLOWED_HOSTS=['127.0.0.1']):
+            for size in sorted(sizes):
+                generate(size - created)
+                created = size
+
+                login = Client()
+                login.force_login(User.objects.get(username='bench0'))
+                cookies = {name: morsel.value for name, morsel in login.cookies.items()}
+
+                for profile in PROFILES:
+                    server = _serve(profile)
+                    try:
+                        for endpoint in ('cities', 'my_subscriptions', 'health'):
+                            cache.clear()
+                            url = f'http://127.0.0.1:{server.server_port}{reverse(endpoint)}'
+                            timings, errors, elapsed = _load(url, cookies, concurrency, requests_per_client)
+                            percentiles = statistics.quantiles(timings, n=100)
+                            results.append({
+                                'benchmark': 'serving',
+                                'users': size,
+                                'profile': profile,
+                                'endpoint': endpoint,
+                                'requests': len(timings),
+                                'errors': errors,
+                                'requests_per_second': round(len(timings) / elapsed, 1),
+                                'p50_ms': round(percentiles[49] * 1000, 3),
+                                'p99_ms': round(percentiles[98] * 1000, 3),
+                            })
+                    finally:
+                        server.shutdown()
+                        server.server_close()
+    finally:
+        connections.settings['default']['CONN_MAX_AGE'] = default_max_age
+    return results
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from main.benchmarks.data import generate
+from main.delivery import mailers
+from main.models import Delivery, DispatchRun, Subscription
+from main.tasks import time_check
+from main.testing import SMTPSink, WeatherbitStub
+from main.weather import observations
+from weatherreminder.celery import app
+
+
+def run(sizes=(1000, 10000, 100000), latency=0.05):
+    """
+    Run whole dispatch ticks end to end at a growing number of users.
+
+    Every subscription is made due before the tick, and the tick runs
+    eagerly in this process: planning, the upstream fetch from a Weatherbit
+    stub answering after `latency` seconds, and delivery into a local SMTP
+    sink. The query count should grow with the number of shards only.
+    """
+    results = []
+    created = 0
+    app.conf.task_always_eager = True
+    try:
+        for size in sorted(sizes):
+            generate(size - created)
+            created = size
+            Delivery.objects.all().delete()
+            DispatchRun.objects.all().delete()
+            Subscription.objects.update(next_due_at=timezone.now() - timedelta(minutes=1))
+            cache.clear()
+            observations.clear()
+
+            with WeatherbitStub(latency=latency) as stub, SMTPSink(keep_messages=False) as sink, \
+                    override_settings(WEATHER_API_URL=stub.url, **sink.settings()), \
+                    CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                time_check()
+                elapsed = time.perf_counter() - started
+                mailers.close()
+
+            run = DispatchRun.objects.get()
+            results.append({
+                'benchmark': 'tick',
+                'users': size,
+                'sent': run.sent,
+                'seconds': round(elapsed, 4),
+                'queries': len(queries),
+                'upstream_requests': len(stub.requests),
+                'messages': sink.received,
+                'emails_per_second': round(run.sent / elapsed, 1),
+            })
+    finally:
+        app.conf.task_always_eager = False
+    return results
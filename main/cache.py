@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.core.cache import cache
+from main.metrics import Counter
+
+HITS = Counter('weather_cache_hits_total', 'Observation lookups answered with a fresh cached entry.')
+STALE_HITS = Counter('weather_cache_stale_hits_total', 'Observation lookups answered with an expired entry.')
+MISSES = Counter('weather_cache_misses_total', 'Observation lookups that had to wait for an upstream fetch.')
+REFRESHES = Counter('weather_cache_refreshes_total', 'Background refreshes started for expired entries.')
+UPSTREAM_FETCHES = Counter('weather_upstream_fetches_total', 'City observations actually fetched upstream.')
+FALLBACKS = Counter('weather_cache_fallbacks_total', 'Failed fetches answered with the last cached observation.')
+
+
+class ObservationCache:
+    """
+    A two-level cache of weather observations with stale-while-revalidate.
+
+    Lookups check a small in-process LRU first and the shared Django cache
+    (Redis) second, with one round trip for all the cities of a lookup.
+    Entries younger than `ttl` seconds are served as is. Older entries are
+    still served for another `stale_ttl` seconds while a background thread
+    refreshes them. Concurrent misses for the same city within a process are
+    merged into a single upstream fetch, and the misses of one lookup are
+    fetched together, so the fetcher can batch them. Entries are kept for
+    another `fallback_ttl` seconds after that, only to be served when the
+    fetch that should replace them fails.
+
+    Args:
+        fetch_many (callable): Fetches observations for a dict of cities keyed
+                               by city id, returns a dict keyed the same way.
+                               Cities that could not be fetched may be missing.
+        ttl (int): Seconds an entry is considered fresh.
+        stale_ttl (int): Seconds an expired entry may still be served.
+        local_size (int): Maximum number of entries kept in the in-process layer.
+        fallback_ttl (int): Seconds an entry past the stale window is kept as a fallback.
+    """
+
+    def __init__(self, fetch_many, ttl, stale_ttl, local_size, fallback_ttl=0):
+        self.fetch_many = fetch_many
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local_size = local_size
+        self.fallback_ttl = fallback_ttl
+        self._local = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix='weather-refresh')
+
+    @staticmethod
+    def _key(city_id):
+        return f'weather:{city_id}'
+
+    def get(self, city_id, city):
+        return self.get_many({city_id: city})[city_id]
+
+    def get_many(self, cities):
+        """
+        Return the observations for many cities, fetching upstream only what has nothing usable cached.
+
+        Args:
+            cities (dict): Whatever the fetcher needs to know about each city, keyed by city id.
+
+        Returns:
+            dict: Observations keyed by city id, None for cities that could
+                  not be fetched and have no fallback entry either.
+        """
+        now = time.time()
+        entries = self._lookup_many(cities)
+        results, stale, missing = {}, {}, {}
+        for city_id, city in cities.items():
+            entry = entries.get(city_id)
+            if entry is None or now - entry['fetched_at'] >= self.ttl + self.stale_ttl:
+                missing[city_id] = city
+                continue
+            results[city_id] = entry['weather']
+            if now - entry['fetched_at'] >= self.ttl:
+                stale[city_id] = city
+
+        if hits := len(results) - len(stale):
+            HITS.inc(hits)
+        if stale:
+            STALE_HITS.inc(len(stale))
+            self._refresh(stale)
+        if missing:
+            MISSES.inc(len(missing))
+            results.update(self._load(missing))
+            fallbacks = {city_id: entries[city_id]['weather'] for city_id in missing
+                         if results[city_id] is None and city_id in entries}
+            if fallbacks:
+                FALLBACKS.inc(len(fallbacks))
+                results.update(fallbacks)
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        """
+        Return the cache counters and the number of upstream fetches the cache saved.
+        """
+        counters = {
+            'hits': HITS.value(),
+            'stale_hits': STALE_HITS.value(),
+            'misses': MISSES.value(),
+            'refreshes': REFRESHES.value(),
+            'upstream_fetches': UPSTREAM_FETCHES.value(),
+            'fallbacks': FALLBACKS.value(),
+        }
+        lookups = counters['hits'] + counters['stale_hits'] + counters['misses']
+        counters['saved_fetches'] = lookups - counters['upstream_fetches']
+        return counters
+
+    def _lookup_many(self, city_ids):
+        now = time.time()
+        entries = {}
+        with self._lock:
+            for city_id in city_ids:
+                if (entry := self._local.get(city_id)) is not None:
+                    self._local.move_to_end(city_id)
+                    entries[city_id] = entry
+
+        expired = [city_id for city_id in city_ids
+                   if city_id not in entries or now - entries[city_id]['fetched_at'] >= self.ttl]
+        if expired:
+            shared = cache.get_many([self._key(city_id) for city_id in expired])
+            for city_id in expired:
+                entry = shared.get(self._key(city_id))
+                if entry is not None and (city_id not in entries or entry['fetched_at'] > entries[city_id]['fetched_at']):
+                    entries[city_id] = entry
+                    self._remember(city_id, entry)
+
+        return {city_id: entry for city_id, entry in entries.items()
+                if now - entry['fetched_at'] < self.ttl + self.stale_ttl + self.fallback_ttl}
+
+    def _remember(self, city_id, entry):
+        with self._lock:
+            self._local[city_id] = entry
+            self._local.move_to_end(city_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _load(self, cities):
+        with self._lock:
+            waiting = {city_id: self._inflight[city_id] for city_id in cities if city_id in self._inflight}
+            leading = {city_id: Future() for city_id in cities if city_id not in waiting}
+            self._inflight.update(leading)
+
+        results = {}
+        if leading:
+            try:
+                UPSTREAM_FETCHES.inc(len(leading))
+                fetched = self.fetch_many({city_id: cities[city_id] for city_id in leading})
+                entries = {}
+                for city_id, future in leading.items():
+                    weather = results[city_id] = fetched.get(city_id)
+                    if weather is not None:
+                        entries[city_id] = {'weather': weather, 'fetched_at': time.time()}
+                        self._remember(city_id, entries[city_id])
+                    future.set_result(weather)
+                cache.set_many({self._key(city_id): entry for city_id, entry in entries.items()},
+                               timeout=self.ttl + self.stale_ttl + self.fallback_ttl)
+            except BaseException as exc:
+                for future in leading.values():
+                    if not future.done():
+                        future.set_exception(exc)
+                raise
+            finally:
+                with self._lock:
+                    for city_id in leading:
+                        del self._inflight[city_id]
+
+        for city_id, future in waiting.items():
+            results[city_id] = future.result()
+        return results
+
+    def _refresh(self, cities):
+        with self._lock:
+            cities = {city_id: city for city_id, city in cities.items() if city_id not in self._inflight}
+        if cities:
+            REFRESHES.inc(len(cities))
+            self._refresher.submit(self._load, cities)
+
+
+def cities_version():
+    """
+    Return the current version of the City table.
+
+    The version is the time of the last change to any city, so it doubles as
+    the Last-Modified date of the city list.
+    """
+    cache.add('cities:version', time.time(), timeout=None)
+    return cache.get('cities:version') or time.time()
+
+
+def bump_cities_version():
+    cache.set('cities:version', time.time(), timeout=None)
+
+
+def city_names_version():
+    """
+    Return the current version of the set of city names, which changes whenever a city is saved or deleted.
+    """
+    cache.add('cities:names:version', time.time(), timeout=None)
+    return cache.get('cities:names:version') or time.time()
+
+
+def bump_city_names_version():
+    cache.set('cities:names:version', time.time(), timeout=None)
@@ -0,0 +1,65 @@
+import threading
+from main.cache import city_names_version
+from main.models import City
+
+
+class CityDirectory:
+    """
+    An in-process map of normalized city names to cities.
+
+    The whole map is loaded with one query and rebuilt whenever the city
+    names version in the shared cache moves, which every City save or
+    delete in any process does, so a lookup costs one cache read and no
+    query. Names missing from the map, e.g. of cities bulk-inserted since
+    it was built, are looked up by their indexed key before they are
+    reported unknown.
+    """
+
+    def __init__(self):
+        self._cities = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        """
+        Return the city with the given name, matched case- and diacritic-insensitively.
+
+        Returns:
+            City: The city with only id, name and key loaded, or None if there is no such city.
+        """
+        key = City.normalize(name)
+        self._refresh()
+        if (city := self._cities.get(key)) is None:
+            if (city := City.objects.filter(key=key).only('id', 'name', 'key').first()) is not None:
+                self._remember(city)
+        return city
+
+    def resolve_or_create(self, name):
+        """
+        Return the city with the given name, creating it if there is none yet.
+
+        Concurrent creations of the same city end up with the same row, as
+        the key is unique.
+
+        Returns:
+            City: The existing or new city.
+        """
+        if (city := self.resolve(name)) is None:
+            city, _ = City.objects.get_or_create(key=City.normalize(name), defaults={'name': ' '.join(name.split())})
+            self._remember(city)
+        return city
+
+    def _refresh(self):
+        version = city_names_version()
+        if version == self._version:
+            return
+        cities = {city.key: city for city in City.objects.only('id', 'name', 'key')}
+        with self._lock:
+            self._cities, self._version = cities, version
+
+    def _remember(self, city):
+        with self._lock:
+            self._cities[city.key] = city
+
+
+directory = CityDirectory()
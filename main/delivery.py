@@ -0,0 +1,236 @@
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+from itertools import groupby, islice
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from main.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SMTP_SECONDS = Histogram('smtp_send_seconds', 'Latency of sending one message to the SMTP relay, per attempt.')
+
+
+def weather_message(city, bulletin, recipients):
+    return EmailMessage(
+        f"Погода в {city}",
+        bulletin,
+        settings.EMAIL_HOST_USER,
+        bcc=recipients,
+        headers={'To': 'undisclosed-recipients:;'},
+    )
+
+
+def bulletin_messages(notifications, bulletins, bcc_size=None):
+    """
+    Build the emails for a stream of notifications, one per city and recipient batch.
+
+    Everyone subscribed to a city gets the same bulletin, so it is put into
+    a single message per EMAIL_BCC_SIZE recipients, addressed by BCC. The
+    number of messages built grows with the number of cities rather than
+    the number of subscribers. Each message carries the notifications it
+    delivers in its `notifications` attribute, for the delivery ledger.
+
+    Args:
+        notifications (Iterable): Due notifications ordered by city_id.
+        bulletins (dict): Rendered bulletins keyed by city id. Notifications
+                          for cities without a bulletin and for users
+                          without an email address are skipped.
+        bcc_size (int): Maximum number of recipients per message.
+
+    Yields:
+        EmailMessage: The messages to deliver.
+    """
+    bcc_size = bcc_size or settings.EMAIL_BCC_SIZE
+    for city_id, group in groupby(notifications, key=lambda notification: notification.city_id):
+        if (bulletin := bulletins.get(city_id)) is None:
+            continue
+        group = (notification for notification in group if notification.email)
+        while batch := list(islice(group, bcc_size)):
+            message = weather_message(batch[0].city_name, bulletin, [notification.email for notification in batch])
+            message.notifications = batch
+            yield message
+
+
+def digest_message(cities, bulletins, recipient):
+    return EmailMessage(
+        f"Погода: {', '.join(cities)}",
+        '\n'.join(bulletins),
+        settings.EMAIL_HOST_USER,
+        to=[recipient],
+    )
+
+
+def digest_messages(notifications, bulletins):
+    """
+    Build one email per user, covering all of the user's due cities.
+
+    Cities without a bulletin and users without an email address are left
+    out. Users left with a single city get no digest: their notification is
+    handed back, so it can go out in the city's shared BCC message, which
+    costs the relay the same single delivery. Each message carries the
+    notifications it delivers in its `notifications` attribute, for the
+    delivery ledger.
+
+    Args:
+        notifications (Iterable): Due notifications of users who chose digests, in any order.
+        bulletins (dict): Rendered bulletins keyed by city id.
+
+    Returns:
+        tuple: The digest messages, and the notifications to send with their city's message instead.
+    """
+    by_user = {}
+    for notification in notifications:
+        if notification.email and notification.city_id in bulletins:
+            by_user.setdefault(notification.user_id, []).append(notification)
+
+    messages, single = [], []
+    for batch in by_user.values():
+        if len(batch) == 1:
+            single.extend(batch)
+            continue
+        batch.sort(key=lambda notification: notification.city_name)
+        message = digest_message(
+            [notification.city_name for notification in batch],
+            [bulletins[notification.city_id] for notification in batch],
+            batch[0].email,
+        )
+        message.notifications = batch
+        messages.append(message)
+    return messages, single
+
+
+class Mailer:
+    """
+    Deliver emails over one long-lived SMTP connection.
+
+    A worker process keeps a single Mailer, so the TCP and TLS handshake
+    with EMAIL_HOST is paid once per connection rather than once per email.
+    Messages go out in batches of EMAIL_BATCH_SIZE and are throttled to
+    EMAIL_RATE_LIMIT messages per second (0 disables the limit). When the
+    relay drops the connection, the Mailer reconnects and carries on with
+    the message that failed, so nothing already delivered is sent twice.
+    The rate limit counts recipients, as a BCC'd message costs the relay one
+    delivery per recipient. A message the relay refuses outright is logged
+    and reported as rejected instead of failing the whole run.
+    The duration of recent batches is kept in `batch_timings`.
+    """
+
+    def __init__(self, batch_size=None, rate_limit=None, retries=2):
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+        self.retries = retries
+        self.batch_timings = deque(maxlen=100)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = get_connection()
+        self._connection.open()
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.close()
+                finally:
+                    self._connection = None
+
+    def _send_one(self, message):
+        for attempt in range(self.retries + 1):
+            try:
+                with SMTP_SECONDS.time():
+                    return self._connect().send_messages([message]) and len(message.recipients())
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+                if attempt == self.retries:
+                    raise
+                logger.warning('SMTP connection lost, reconnecting (attempt %s)', attempt + 1)
+                try:
+                    self._connection.close()
+                except (smtplib.SMTPException, OSError):
+                    self._connection.connection = None
+
+    def send(self, messages, on_batch=None):
+        """
+        Send messages in batches over the persistent connection.
+
+        Args:
+            messages (Iterable[EmailMessage]): The messages to deliver.
+            on_batch (callable): Called after every batch with the lists of
+                                 delivered and rejected messages, e.g. to
+                                 record them before the next batch starts.
+
+        Returns:
+            int: The number of recipients the messages were delivered to.
+        """
+        sent = 0
+        batch = []
+        with self._lock:
+            for message in messages:
+                batch.append(message)
+                if len(batch) == self.batch_size:
+                    sent += self._send_batch(batch, on_batch)
+                    batch = []
+            if batch:
+                sent += self._send_batch(batch, on_batch)
+        return sent
+
+    def _send_batch(self, batch, on_batch=None):
+        started = time.perf_counter()
+        delivered, rejected = [], []
+        try:
+            for message in batch:
+                try:
+                    (delivered if self._send_one(message) else rejected).append(message)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+                    logger.warning('Message for %s recipients rejected: %s', len(message.recipients()), exc)
+                    rejected.append(message)
+        except BaseException:
+            # Report what went out before the failure, so a retry does not send it again.
+            if on_batch is not None:
+                on_batch(delivered, rejected)
+            raise
+        sent = sum(len(message.recipients()) for message in delivered)
+        elapsed = time.perf_counter() - started
+
+        if self.rate_limit:
+            budget = sum(len(message.recipients()) for message in batch) / self.rate_limit
+            if elapsed < budget:
+                time.sleep(budget - elapsed)
+
+        self.batch_timings.append((len(batch), elapsed))
+        logger.info('Sent batch of %s emails in %.3fs', len(batch), elapsed)
+        if on_batch is not None:
+            on_batch(delivered, rejected)
+        return sent
+
+
+class MailerPool:
+    """
+    A fixed set of Mailers, each keeping its own SMTP connection.
+
+    The pipeline runs one sender per Mailer, so a worker delivers over
+    DISPATCH_SENDERS connections at once. EMAIL_RATE_LIMIT is shared
+    evenly between them, so the pool as a whole keeps to it.
+    """
+
+    def __init__(self, size=None):
+        size = size or settings.DISPATCH_SENDERS
+        self.mailers = [Mailer(rate_limit=settings.EMAIL_RATE_LIMIT / size) for _ in range(size)]
+
+    def __iter__(self):
+        return iter(self.mailers)
+
+    def __len__(self):
+        return len(self.mailers)
+
+    def close(self):
+        for mailer in self.mailers:
+            mailer.close()
+
+
+mailers = MailerPool()
@@ -0,0 +1,183 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from main.models import City, Observation, ObservationAggregate
+
+AVERAGED = ('temp', 'app_temp', 'pres', 'wind_spd', 'rh', 'vis')
+MINIMUMS = ('temp',)
+MAXIMUMS = ('temp', 'wind_spd', 'uv')
+
+# Aggregates of raw observations, by ObservationAggregate field.
+FROM_OBSERVATIONS = {
+    'samples': Count('id'),
+    **{f'{field}_avg': Avg(field) for field in AVERAGED},
+    **{f'{field}_min': Min(field) for field in MINIMUMS},
+    **{f'{field}_max': Max(field) for field in MAXIMUMS},
+}
+# Aggregates of finer aggregates. Averages are summed weighted by their samples, and divided by them afterwards.
+FROM_AGGREGATES = {
+    'samples': Sum('samples'),
+    **{f'{field}_avg': Sum(F(f'{field}_avg') * F('samples'), output_field=FloatField()) for field in AVERAGED},
+    **{f'{field}_min': Min(f'{field}_min') for field in MINIMUMS},
+    **{f'{field}_max': Max(f'{field}_max') for field in MAXIMUMS},
+}
+TRUNCATE = {ObservationAggregate.HOUR: TruncHour, ObservationAggregate.DAY: TruncDay}
+
+
+def _grouped(rows, time_field, resolution, aggregates):
+    """
+    Aggregate rows per city and UTC bucket of the given resolution, in the database.
+
+    Yields:
+        ObservationAggregate: Unsaved aggregates, one per city and bucket.
+    """
+    grouped = (
+        rows
+        .annotate(bucket=TRUNCATE[resolution](time_field, tzinfo=dt_timezone.utc))
+        .order_by()
+        .values('city_id', 'bucket')
+        # Prefixed, as aggregates of aggregates would clash with the fields they are computed from.
+        .annotate(**{f'total_{name}': aggregate for name, aggregate in aggregates.items()})
+    )
+    for row in grouped:
+        values = {name: row[f'total_{name}'] for name in aggregates}
+        if aggregates is FROM_AGGREGATES:
+            for field in AVERAGED:
+                values[f'{field}_avg'] /= values['samples']
+        yield ObservationAggregate(city_id=row['city_id'], start=row['bucket'], resolution=resolution, **values)
+
+
+def _merge(into, other):
+    """
+    Add the observations of an aggregate of the same city and bucket to another one.
+    """
+    samples = into.samples + other.samples
+    for field in AVERAGED:
+        name = f'{field}_avg'
+        setattr(into, name, (getattr(into, name) * into.samples + getattr(other, name) * other.samples) / samples)
+    for field in MINIMUMS:
+        setattr(into, f'{field}_min', min(getattr(into, f'{field}_min'), getattr(other, f'{field}_min')))
+    for field in MAXIMUMS:
+        setattr(into, f'{field}_max', max(getattr(into, f'{field}_max'), getattr(other, f'{field}_max')))
+    into.samples = samples
+    return into
+
+
+def _roll_up(rows, time_field, resolution, cutoff, aggregates):
+    """
+    Replace the rows older than `cutoff` by aggregates of the given resolution, one UTC day at a time.
+
+    Every day is aggregated, stored and deleted in its own transaction, so
+    an interrupted run leaves no row counted twice and the next run carries
+    on with the days that are left. Buckets that already exist, e.g. when
+    late observations arrive for an hour that was rolled up before, are
+    merged with the new rows instead of replaced.
+
+    Returns:
+        int: The number of aggregates written.
+    """
+    rows = rows.filter(**{f'{time_field}__lt': cutoff})
+    written = 0
+    while (oldest := rows.aggregate(oldest=Min(time_field))['oldest']) is not None:
+        day = oldest.astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        end = min(day + timedelta(days=1), cutoff)
+        in_day = rows.filter(**{f'{time_field}__gte': day, f'{time_field}__lt': end})
+        with transaction.atomic():
+            existing = {
+                (aggregate.city_id, aggregate.start): aggregate
+                for aggregate in ObservationAggregate.objects.select_for_update().filter(
+                    resolution=resolution, start__gte=day, start__lt=end
+                )
+            }
+            created, merged = [], []
+            for aggregate in _grouped(in_day, time_field, resolution, aggregates):
+                if (previous := existing.get((aggregate.city_id, aggregate.start))) is not None:
+                    merged.append(_merge(previous, aggregate))
+                else:
+                    created.append(aggregate)
+            ObservationAggregate.objects.bulk_create(created)
+            ObservationAggregate.objects.bulk_update(
+                merged, ['samples'] + [f'{field}_avg' for field in AVERAGED]
+                + [f'{field}_min' for field in MINIMUMS] + [f'{field}_max' for field in MAXIMUMS],
+            )
+            in_day.delete()
+        written += len(created) + len(merged)
+    return written
+
+
+def downsample(now=None):
+    """
+    Roll old weather history up into coarser aggregates and drop the rows that were rolled up.
+
+    Observations older than OBSERVATION_RAW_RETENTION_DAYS become hourly
+    aggregates, and hourly aggregates older than
+    OBSERVATION_HOURLY_RETENTION_DAYS become daily ones, which are kept.
+    Cutoffs fall on UTC midnight, so only whole days are rolled up. The
+    latest observation of every city is kept as it is until a newer one
+    replaces it, as the city list still shows it.
+
+    Args:
+        now (datetime): The time to count the retention periods back from, now by default.
+
+    Returns:
+        tuple: The numbers of hourly and daily aggregates written.
+    """
+    today = (now or timezone.now()).astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    latest = City.objects.filter(latest_observation__isnull=False).values('latest_observation_id')
+    hourly = _roll_up(
+        Observation.objects.exclude(id__in=latest), 'ob_time', ObservationAggregate.HOUR,
+        today - timedelta(days=settings.OBSERVATION_RAW_RETENTION_DAYS), FROM_OBSERVATIONS,
+    )
+    daily = _roll_up(
+        ObservationAggregate.objects.filter(resolution=ObservationAggregate.HOUR), 'start', ObservationAggregate.DAY,
+        today - timedelta(days=settings.OBSERVATION_HOURLY_RETENTION_DAYS), FROM_AGGREGATES,
+    )
+    return hourly, daily
+
+
+def history(city_id, resolution, since, until):
+    """
+    Return a city's weather history between two times, oldest first.
+
+    Raw history is read as stored. Hourly and daily history combine the
+    stored aggregates of that resolution with the finer rows that are not
+    rolled up yet, grouped on the fly, so recent weather shows up before
+    the retention job gets to it. Every source is read with a range scan
+    of its (city, time) index, so the cost depends on the length of the
+    range, not on how much history is stored.
+
+    Args:
+        city_id (int): The city to read the history of.
+        resolution (str): 'raw', or one of ObservationAggregate.RESOLUTION_CHOICES.
+        since (datetime): Start of the range, included.
+        until (datetime): End of the range, excluded.
+
+    Returns:
+        list: Observations for raw history, ObservationAggregates otherwise.
+    """
+    observations = Observation.objects.filter(city_id=city_id, ob_time__gte=since, ob_time__lt=until)
+    if resolution == 'raw':
+        return list(observations.order_by('ob_time'))
+
+    buckets = {
+        aggregate.start: aggregate
+        for aggregate in ObservationAggregate.objects.filter(
+            city_id=city_id, resolution=resolution, start__gte=since, start__lt=until
+        )
+    }
+    sources = [(observations, 'ob_time', FROM_OBSERVATIONS)]
+    if resolution == ObservationAggregate.DAY:
+        hourly = ObservationAggregate.objects.filter(
+            city_id=city_id, resolution=ObservationAggregate.HOUR, start__gte=since, start__lt=until
+        )
+        sources.append((hourly, 'start', FROM_AGGREGATES))
+    for rows, time_field, aggregates in sources:
+        for aggregate in _grouped(rows, time_field, resolution, aggregates):
+            if (previous := buckets.get(aggregate.start)) is not None:
+                _merge(previous, aggregate)
+            else:
+                buckets[aggregate.start] = aggregate
+    return [buckets[start] for start in sorted(buckets)]
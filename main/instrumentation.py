@@ -0,0 +1,111 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import connection
+from main import metrics
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = metrics.Histogram('dispatch_stage_seconds', 'Seconds a dispatch task spent in each stage.')
+TASK_QUERIES = metrics.Counter('task_db_queries_total', 'Database queries run by tasks.')
+
+
+class TaskStats:
+    """
+    Collect the stage timings and the database query count of one task run.
+
+    Stages may be timed from several threads at once, e.g. by the pipeline
+    stages, and their times add up per stage. Queries are counted on the
+    connection of the thread that runs `count_queries`, which is where all
+    database work of a task happens.
+
+    Args:
+        task (str): The task name, used as a metrics label.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.stages = defaultdict(float)
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] += seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Add the seconds spent in the `with` block to a stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    @contextmanager
+    def count_queries(self):
+        def count(execute, sql, params, many, context):
+            self.queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            yield
+
+    def finish(self, **fields):
+        """
+        Export the collected numbers as metrics and log them as one structured line.
+
+        Args:
+            **fields: More fields to log along with the timings, e.g. the sent count.
+
+        Returns:
+            dict: The stage timings in seconds and the query count, ready to be sent as a task event.
+        """
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, task=self.task, stage=stage)
+        TASK_QUERIES.inc(self.queries, task=self.task)
+        metrics.flush()
+
+        summary = {
+            'stages': {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            'queries': self.queries,
+        }
+        log_event(logger, 'task_finished', task=self.task, **summary, **fields)
+        return summary
+
+
+def log_event(logger, event, sample_rate=1.0, **fields):
+    """
+    Log an event with structured fields, keeping only a random `sample_rate` share of them.
+
+    Per-notification events are logged with LOG_SAMPLE_RATE, so a tick of
+    any size produces a readable number of lines that still shows what
+    typical deliveries looked like.
+    """
+    if sample_rate < 1 and random.random() >= sample_rate:
+        return
+    logger.info(event, extra={'fields': fields})
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line, including the fields passed to log_event.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
@@ -0,0 +1,77 @@
+from django.db.models import Count
+from django.utils import timezone
+from main.models import Delivery, DispatchRun
+
+
+def _slot(notification):
+    return notification.subscription_id, notification.user_id, notification.next_due_at
+
+
+def pending(notifications):
+    """
+    Drop the notifications the ledger already has as sent or skipped for their slot.
+
+    The ledger is read with a single query for the whole block, so a fresh
+    shard pays one empty lookup and a resumed one skips everything it had
+    already done before it stopped. The query is narrowed to the block's
+    users as well as its schedules, so a schedule shared by many users
+    only reads the rows of the users in the block. Failed notifications are kept, so they
+    are attempted again.
+
+    Args:
+        notifications (list): Due notifications, as returned by due_notifications.
+
+    Returns:
+        list: The notifications still to be delivered, in their original order.
+    """
+    if not notifications:
+        return []
+    done = set(
+        Delivery.objects
+        .filter(
+            subscription_id__in={notification.subscription_id for notification in notifications},
+            user_id__in={notification.user_id for notification in notifications},
+            due_at__in={notification.next_due_at for notification in notifications},
+            status__in=Delivery.DONE,
+        )
+        .values_list('subscription_id', 'user_id', 'due_at')
+    )
+    return [notification for notification in notifications if _slot(notification) not in done]
+
+
+def record(notifications, status, run_id=None):
+    """
+    Write the outcome of many notifications to the ledger in one bulk upsert.
+
+    Entries already in the ledger for the same slot, e.g. from a failed
+    earlier attempt, are overwritten with the new status.
+    """
+    if not notifications:
+        return
+    Delivery.objects.bulk_create(
+        [
+            Delivery(subscription_id=subscription_id, user_id=user_id, due_at=due_at, status=status, run_id=run_id)
+            for subscription_id, user_id, due_at in {_slot(notification) for notification in notifications}
+        ],
+        update_conflicts=True,
+        unique_fields=['subscription', 'user', 'due_at'],
+        update_fields=['status', 'run', 'updated_at'],
+    )
+
+
+def finish(run_id):
+    """
+    Store the final counts and the duration of a dispatch run.
+
+    Returns:
+        DispatchRun: The finished run.
+    """
+    run = DispatchRun.objects.get(id=run_id)
+    counts = dict(run.deliveries.values_list('status').annotate(count=Count('id')).order_by())
+    run.sent = counts.get(Delivery.SENT, 0)
+    run.skipped = counts.get(Delivery.SKIPPED, 0)
+    run.failed = counts.get(Delivery.FAILED, 0)
+    run.finished_at = timezone.now()
+    run.duration = (run.finished_at - run.started_at).total_seconds()
+    run.save(update_fields=['sent', 'skipped', 'failed', 'finished_at', 'duration'])
+    return run
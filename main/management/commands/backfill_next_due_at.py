@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.models import Subscription
+
+
+class Command(BaseCommand):
+    help = 'Set next_due_at on subscriptions created before due times were stored.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reschedule', action='store_true',
+            help='Recompute next_due_at for every subscription, e.g. after changing DISPATCH_SPREAD_MINUTES.',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        subscriptions = Subscription.objects.all()
+        if not options['reschedule']:
+            subscriptions = subscriptions.filter(next_due_at__isnull=True)
+        updated = 0
+
+        # Every subscription with the same city and period shares its first
+        # slot, so one UPDATE per distinct schedule covers the whole table.
+        schedules = subscriptions.order_by().values_list('city_id', 'notification_period').distinct()
+        for city_id, period in schedules:
+            updated += subscriptions.filter(city_id=city_id, notification_period=period).update(
+                next_due_at=Subscription.first_due_at(period, now, Subscription.dispatch_offset(city_id, period))
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled next_due_at on {updated} subscriptions'))
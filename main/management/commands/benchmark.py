@@ -0,0 +1,82 @@
+import json
+import subprocess
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from main.benchmarks import BENCHMARKS, compare
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    with open(path) as file:
+        data = json.load(file)
+    return data['results'] if isinstance(data, dict) else data
+
+
+class Command(BaseCommand):
+    help = 'Run dispatch and API benchmarks against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run: {", ".join(BENCHMARKS)}. Defaults to all.')
+        parser.add_argument('--sizes', nargs='+', type=int, help='Data set sizes to measure at.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', metavar='BASELINE', help='Compare the results with an earlier --output file.')
+        parser.add_argument(
+            '--max-regression', type=float, metavar='PERCENT',
+            help='With --compare, fail if any metric got worse by more than this many percent.',
+        )
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        kwargs = {'sizes': options['sizes']} if options['sizes'] else {}
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = []
+            for name in names:
+                call_command('flush', interactive=False, verbosity=0)
+                for result in BENCHMARKS[name](**kwargs):
+                    self.stdout.write(json.dumps(result))
+                    results.append(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'commit': current_commit(),
+                    'created_at': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'results': results,
+                }, file, indent=2)
+
+        if baseline is not None:
+            self.report(list(compare(baseline, results)), options['max_regression'])
+
+    def report(self, changes, max_regression):
+        regressions = []
+        for change in changes:
+            key = ' '.join(f'{name}={value}' for name, value in change['key'])
+            line = (f"{change['benchmark']} {key} {change['metric']}: "
+                    f"{change['baseline']} -> {change['value']} ({change['change_percent']:+}%)")
+            if max_regression is not None and (change['regression_percent'] or 0) > max_regression:
+                regressions.append(line)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} metrics regressed by more than {max_regression}%')
@@ -0,0 +1,193 @@
+import threading
+import time
+from contextlib import contextmanager
+from django.core.cache import cache
+
+REGISTRY = {}
+
+
+class Metric:
+    """
+    A named metric shared by every process.
+
+    Values live in the Django cache (Redis in production), so updates made
+    by Celery workers and web processes are seen by all of them. Metrics
+    may be split by label values, e.g. `SENT.inc(minute=5)`.
+    """
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        suffix = ','.join(f'{key}={value}' for key, value in sorted(labels.items()))
+        return f'metrics:{self.name}:{suffix}'
+
+    def _remember_labels(self, labels):
+        """
+        Register a label set, so `samples()` finds it, unless it is already registered.
+
+        Every label set is claimed with an atomic add on a key of its own and
+        then written to the next numbered slot, so processes registering new
+        label sets at the same time never overwrite each other.
+        """
+        if not cache.add(f'{self._key(labels)}:registered', True, timeout=None):
+            return
+        cache.add(f'metrics:{self.name}:labels', 0, timeout=None)
+        index = cache.incr(f'metrics:{self.name}:labels')
+        cache.set(f'metrics:{self.name}:labels:{index}', labels, timeout=None)
+
+    def value(self, **labels):
+        return cache.get(self._key(labels), 0)
+
+    def samples(self):
+        """
+        Return every recorded (labels, value) pair of this metric.
+        """
+        count = cache.get(f'metrics:{self.name}:labels', 0)
+        slots = cache.get_many([f'metrics:{self.name}:labels:{index}' for index in range(1, count + 1)])
+        # A slot may still be empty while another process is registering it.
+        return [(labels, self.value(**labels)) for labels in slots.values()]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing counter, so increments made by every process add up to one total.
+    """
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        # Only the increment that creates the counter registers its labels.
+        if cache.add(key, value, timeout=None):
+            self._remember_labels(labels)
+        else:
+            cache.incr(key, value)
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, holding whatever was set last by any process.
+    """
+
+    def set(self, value, **labels):
+        cache.set(self._key(labels), value, timeout=None)
+        self._remember_labels(labels)
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values, counted into cumulative buckets like a Prometheus histogram.
+
+    Observations are made on hot paths, e.g. once per SMTP message, so they
+    are only added up in process memory and written to the cache by
+    `flush()`, one increment per touched bucket. Sums are kept in
+    millionths, as the cache only increments integers.
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        bucket = next(bound for bound in self.buckets if value <= bound)
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            pending = self._pending.setdefault(key, {'buckets': {}, 'count': 0, 'sum': 0.0})
+            pending['buckets'][bucket] = pending['buckets'].get(bucket, 0) + 1
+            pending['count'] += 1
+            pending['sum'] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds spent in the `with` block.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for key, values in pending.items():
+            labels = dict(key)
+            increments = {f'bucket={bound}': count for bound, count in values['buckets'].items()}
+            increments['count'] = values['count']
+            increments['sum'] = round(values['sum'] * 1_000_000)
+            for field, value in increments.items():
+                field_key = f'{self._key(labels)}:{field}'
+                if not cache.add(field_key, value, timeout=None):
+                    cache.incr(field_key, value)
+            self._remember_labels(labels)
+
+    def value(self, **labels):
+        """
+        Return the flushed state of one label set.
+
+        Returns:
+            dict: `buckets` as (upper bound, cumulative count) pairs, `count` and `sum`.
+        """
+        key = self._key(labels)
+        fields = [f'bucket={bound}' for bound in self.buckets] + ['count', 'sum']
+        stored = cache.get_many([f'{key}:{field}' for field in fields])
+        cumulative = 0
+        buckets = []
+        for bound in self.buckets:
+            cumulative += stored.get(f'{key}:bucket={bound}', 0)
+            buckets.append((bound, cumulative))
+        return {
+            'buckets': buckets,
+            'count': stored.get(f'{key}:count', 0),
+            'sum': stored.get(f'{key}:sum', 0) / 1_000_000,
+        }
+
+
+def flush():
+    """
+    Write the observations buffered in this process to the cache.
+    """
+    for metric in REGISTRY.values():
+        if isinstance(metric, Histogram):
+            metric.flush()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, metric in sorted(REGISTRY.items()):
+        kind = type(metric).__name__.lower()
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in metric.samples():
+            if kind == 'histogram':
+                for bound, count in value['buckets']:
+                    lines.append(f'{name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+            else:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-18 00:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_subscription_next_due_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Observation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ob_time', models.DateTimeField()),
+                ('temp', models.FloatField()),
+                ('app_temp', models.FloatField()),
+                ('pres', models.FloatField()),
+                ('wind_spd', models.FloatField()),
+                ('wind_cdir_full', models.CharField(blank=True, max_length=50)),
+                ('rh', models.FloatField()),
+                ('vis', models.FloatField()),
+                ('uv', models.FloatField()),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='main.city')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='latest_observation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.observation'),
+        ),
+        migrations.AddConstraint(
+            model_name='observation',
+            constraint=models.UniqueConstraint(fields=('city', 'ob_time'), name='unique_city_observation_time'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-18 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_observation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
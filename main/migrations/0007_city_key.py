@@ -0,0 +1,56 @@
+# Generated by Django 4.2.3 on 2026-10-18 01:10
+
+import unicodedata
+from django.db import migrations, models
+
+
+def normalize(name):
+    # A copy of City.normalize as of this migration.
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def fill_keys(apps, schema_editor):
+    """
+    Set the key of every city, merging cities whose names fold to the same key into the oldest one.
+
+    Subscriptions and observations of the merged cities move over to the
+    kept one, except observations taken at a time the kept city already
+    has one for.
+    """
+    City = apps.get_model('main', 'City')
+    Subscription = apps.get_model('main', 'Subscription')
+    Observation = apps.get_model('main', 'Observation')
+
+    kept = {}
+    duplicates = {}
+    for city in City.objects.order_by('id').only('id', 'name'):
+        key = normalize(city.name)
+        if key in kept:
+            duplicates[city.id] = kept[key]
+        else:
+            kept[key] = city.id
+            City.objects.filter(id=city.id).update(key=key)
+
+    for duplicate_id, city_id in duplicates.items():
+        Subscription.objects.filter(city_id=duplicate_id).update(city_id=city_id)
+        taken = Observation.objects.filter(city_id=city_id).values('ob_time')
+        Observation.objects.filter(city_id=duplicate_id).exclude(ob_time__in=taken).update(city_id=city_id)
+    City.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_delivery_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='key',
+            field=models.CharField(editable=False, max_length=100, null=True),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+    ]
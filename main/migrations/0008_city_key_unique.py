@@ -0,0 +1,20 @@
+# Generated by Django 4.2.3 on 2026-10-18 01:10
+
+from django.db import migrations, models
+
+
+# Kept apart from 0007, which deletes merged cities: on PostgreSQL those deletes leave
+# deferred foreign key checks pending, and the table cannot be altered in the same transaction.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_city_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='city',
+            name='key',
+            field=models.CharField(editable=False, max_length=100, unique=True),
+        ),
+    ]
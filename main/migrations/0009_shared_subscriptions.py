@@ -0,0 +1,67 @@
+# Generated by Django 4.2.3 on 2026-10-18 01:30
+
+from django.db import migrations
+
+
+def merge_schedules(apps, schema_editor):
+    """
+    Merge subscriptions with the same city and period into the oldest one.
+
+    Users and ledger entries of the merged rows move over to the kept row,
+    dropping those the kept row already has. The kept row takes the
+    earliest due time of its group, so nobody misses a pending slot.
+    """
+    Subscription = apps.get_model('main', 'Subscription')
+    Delivery = apps.get_model('main', 'Delivery')
+    through = apps.get_model('main', 'UserSubscriptions').subscriptions.through
+
+    kept = {}
+    duplicates = {}
+    for subscription in Subscription.objects.order_by('id'):
+        schedule = (subscription.city_id, subscription.notification_period)
+        if schedule not in kept:
+            kept[schedule] = subscription
+            continue
+        duplicates[subscription.id] = kept[schedule]
+        due_times = [due_at for due_at in (kept[schedule].next_due_at, subscription.next_due_at) if due_at]
+        kept[schedule].next_due_at = min(due_times, default=None)
+    if not duplicates:
+        return
+
+    Subscription.objects.bulk_update(set(duplicates.values()), ['next_due_at'])
+
+    moved = list(through.objects.filter(subscription_id__in=duplicates))
+    links = set(through.objects.filter(usersubscriptions_id__in={link.usersubscriptions_id for link in moved})
+                .exclude(subscription_id__in=duplicates).values_list('usersubscriptions_id', 'subscription_id'))
+    created = []
+    for link in moved:
+        target = (link.usersubscriptions_id, duplicates[link.subscription_id].id)
+        if target not in links:
+            links.add(target)
+            created.append(through(usersubscriptions_id=target[0], subscription_id=target[1]))
+    through.objects.bulk_create(created)
+
+    moved = list(Delivery.objects.filter(subscription_id__in=duplicates).order_by('id'))
+    slots = set(Delivery.objects.filter(subscription_id__in={target.id for target in duplicates.values()})
+                .values_list('subscription_id', 'user_id', 'due_at'))
+    updated = []
+    for delivery in moved:
+        target = (duplicates[delivery.subscription_id].id, delivery.user_id, delivery.due_at)
+        if target not in slots:
+            slots.add(target)
+            delivery.subscription_id = target[0]
+            updated.append(delivery)
+    Delivery.objects.bulk_update(updated, ['subscription'])
+
+    Subscription.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_city_key_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.3 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+
+# Kept apart from 0009, which deletes merged subscriptions: on PostgreSQL those deletes leave
+# deferred foreign key checks pending, and the table cannot be altered in the same transaction.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_shared_subscriptions'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('city', 'notification_period'), name='unique_subscription_schedule'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_subscription_unique_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscriptions',
+            name='digest',
+            field=models.BooleanField(default=False, help_text='Get the bulletins of all cities due in the same tick as one email.'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.3 on 2026-10-18 02:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_usersubscriptions_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObservationAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField()),
+                ('temp_avg', models.FloatField()),
+                ('temp_min', models.FloatField()),
+                ('temp_max', models.FloatField()),
+                ('app_temp_avg', models.FloatField()),
+                ('pres_avg', models.FloatField()),
+                ('wind_spd_avg', models.FloatField()),
+                ('wind_spd_max', models.FloatField()),
+                ('rh_avg', models.FloatField()),
+                ('vis_avg', models.FloatField()),
+                ('uv_max', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['ob_time'], name='observation_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='observationaggregate',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregates', to='main.city'),
+        ),
+        migrations.AddIndex(
+            model_name='observationaggregate',
+            index=models.Index(fields=['resolution', 'start'], name='aggregate_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='observationaggregate',
+            constraint=models.UniqueConstraint(fields=('city', 'resolution', 'start'), name='unique_city_aggregate_bucket'),
+        ),
+    ]
@@ -1,27 +1,307 @@
+import math
+import unicodedata
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 
 class City(models.Model):
     name = models.CharField(max_length=50)
+    # The name folded by normalize(), so every spelling of a city maps to one row.
+    key = models.CharField(max_length=100, unique=True, editable=False)
+    # Coordinates resolved from the first upstream answer, used for bulk fetches.
+    lat = models.FloatField(null=True, blank=True)
+    lon = models.FloatField(null=True, blank=True)
+    # Legacy pre-rendered bulletin, only used for cities without an observation.
     current_weather = models.CharField(max_length=255, blank=True)
+    latest_observation = models.ForeignKey(
+        'Observation', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.key = self.normalize(self.name)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def normalize(name):
+        """
+        Fold a city name to its lookup key.
+
+        Case and diacritics are dropped and runs of whitespace collapsed, so
+        "Kyiv", " KYIV " and "Kýiv" all give "kyiv". Bulk inserts bypass
+        save() and have to set the key with this themselves.
+        """
+        decomposed = unicodedata.normalize('NFKD', name)
+        stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+        return ' '.join(stripped.casefold().split())
+
+
+class Observation(models.Model):
+    """
+    A weather observation for a city, as reported by the Weatherbit API.
+
+    Observations are stored as typed values rather than rendered text, so
+    one fetch can be rendered for email, the API and any language on demand.
+    """
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='observations')
+    ob_time = models.DateTimeField()
+    temp = models.FloatField()
+    app_temp = models.FloatField()
+    pres = models.FloatField()
+    wind_spd = models.FloatField()
+    wind_cdir_full = models.CharField(max_length=50, blank=True)
+    rh = models.FloatField()
+    vis = models.FloatField()
+    uv = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'ob_time'], name='unique_city_observation_time'),
+        ]
+        indexes = [
+            # Lets the retention job find the oldest observations without scanning every city.
+            models.Index(fields=['ob_time'], name='observation_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.city}, {self.ob_time:%Y-%m-%d %H:%M}: {self.temp}°C"
+
+    @classmethod
+    def from_weatherbit(cls, city_id, data):
+        """
+        Build an unsaved observation from an item of a Weatherbit `data` list.
+        """
+        return cls(
+            city_id=city_id,
+            ob_time=datetime.strptime(data['ob_time'], '%Y-%m-%d %H:%M').replace(tzinfo=dt_timezone.utc),
+            temp=data['temp'],
+            app_temp=data['app_temp'],
+            pres=data['pres'],
+            wind_spd=data['wind_spd'],
+            wind_cdir_full=data['wind_cdir_full'],
+            rh=data['rh'],
+            vis=data['vis'],
+            uv=data['uv'],
+        )
+
+
+class ObservationAggregate(models.Model):
+    """
+    A city's weather over one hour or one UTC day, downsampled from older history.
+
+    Observations older than OBSERVATION_RAW_RETENTION_DAYS are rolled up into
+    hourly aggregates and dropped, and hourly aggregates older than
+    OBSERVATION_HOURLY_RETENTION_DAYS into daily ones (see main.history).
+    Averages are stored with the number of observations behind them, so
+    buckets can be merged and rolled up again without skewing them.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTION_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='aggregates')
+    resolution = models.CharField(max_length=4, choices=RESOLUTION_CHOICES)
+    start = models.DateTimeField()
+    samples = models.PositiveIntegerField()
+    temp_avg = models.FloatField()
+    temp_min = models.FloatField()
+    temp_max = models.FloatField()
+    app_temp_avg = models.FloatField()
+    pres_avg = models.FloatField()
+    wind_spd_avg = models.FloatField()
+    wind_spd_max = models.FloatField()
+    rh_avg = models.FloatField()
+    vis_avg = models.FloatField()
+    uv_max = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'resolution', 'start'], name='unique_city_aggregate_bucket'),
+        ]
+        indexes = [
+            # Lets the retention job read one day of buckets of every city at once.
+            models.Index(fields=['resolution', 'start'], name='aggregate_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.city}, {self.resolution} of {self.start:%Y-%m-%d %H:%M}: {self.temp_avg:.1f}°C"
+
 
 class Subscription(models.Model):
+    """
+    A notification schedule: a city's weather every `notification_period` hours.
+
+    There is one row per (city, period), shared by every user subscribed to
+    it through UserSubscriptions, so a tick plans and advances schedules
+    rather than per-user copies of them.
+    """
     city = models.ForeignKey(City, on_delete=models.CASCADE)
     notification_period = models.FloatField(validators=[MinValueValidator(1)])
+    next_due_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'notification_period'], name='unique_subscription_schedule'),
+        ]
 
     def __str__(self):
         return f"{self.city}, notification period: {self.notification_period} hours."
 
+    def save(self, *args, **kwargs):
+        if self.next_due_at is None:
+            self.schedule()
+        super().save(*args, **kwargs)
+
+    def schedule(self, now=None):
+        """
+        Put the subscription on the first slot of its schedule at or after `now`.
+
+        save() does this for new subscriptions; bulk writes, which bypass
+        save(), call it themselves.
+        """
+        self.next_due_at = self.first_due_at(
+            self.notification_period, now or timezone.now(), self.dispatch_offset(self.city_id, self.notification_period)
+        )
+
+    @classmethod
+    def for_schedules(cls, schedules, now=None):
+        """
+        Return the shared subscriptions of the given schedules, creating the missing ones.
+
+        Existing rows are read with one query. Missing rows are inserted in
+        bulk, skipping any a concurrent request has inserted meanwhile, and
+        read back with a second query, so the number of queries does not
+        depend on the number of schedules.
+
+        Args:
+            schedules (Iterable[tuple]): (city id, notification period) pairs.
+            now (datetime): The time new subscriptions are scheduled from, now by default.
+
+        Returns:
+            dict: Subscriptions with their city selected, keyed by (city id, notification period).
+        """
+        schedules = set(schedules)
+
+        def existing():
+            rows = cls.objects.filter(
+                city_id__in={city_id for city_id, _ in schedules},
+                notification_period__in={notification_period for _, notification_period in schedules},
+            ).select_related('city')
+            return {(row.city_id, row.notification_period): row for row in rows
+                    if (row.city_id, row.notification_period) in schedules}
+
+        found = existing() if schedules else {}
+        if missing := schedules - set(found):
+            now = now or timezone.now()
+            created = [cls(city_id=city_id, notification_period=notification_period)
+                       for city_id, notification_period in missing]
+            for subscription in created:
+                subscription.schedule(now)
+            cls.objects.bulk_create(created, ignore_conflicts=True)
+            found = existing()
+        return found
+
+    @staticmethod
+    def dispatch_offset(city_id, notification_period):
+        """
+        Return how far past the top of the hour a schedule's slots fall.
+
+        With DISPATCH_SPREAD_MINUTES set, every (city, period) schedule gets a
+        stable offset of whole minutes within that window, derived from a
+        hash, so the sends of an hour are spread evenly across it instead of
+        all landing at minute zero. Subscribers of the same schedule still
+        share their slot and therefore their bulletin.
+        """
+        if not settings.DISPATCH_SPREAD_MINUTES:
+            return timedelta()
+        key = f'{city_id}:{notification_period}'.encode()
+        return timedelta(minutes=zlib.crc32(key) % settings.DISPATCH_SPREAD_MINUTES)
+
+    @staticmethod
+    def first_due_at(notification_period, now, offset=timedelta()):
+        """
+        Return the first slot at or after `now` for the given notification period.
+
+        Slots are counted from local midnight plus `offset`, so without an
+        offset an existing subscription keeps the hours it was notified at
+        under the old `hour % period` rule.
+        """
+        start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) + offset
+        period = timedelta(hours=notification_period)
+        return start + period * math.ceil((now - start) / period)
+
+    @staticmethod
+    def next_due_after(due_at, notification_period, now):
+        """
+        Return the first slot after `now` that follows `due_at` by whole notification periods.
+        """
+        period = timedelta(hours=notification_period)
+        return due_at + period * (math.floor((now - due_at) / period) + 1)
+
 
 class UserSubscriptions(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     subscriptions = models.ManyToManyField(Subscription, blank=True)
+    digest = models.BooleanField(
+        default=False, help_text='Get the bulletins of all cities due in the same tick as one email.'
+    )
 
     def __str__(self):
         return f"{self.user}'s subscriptions"
+
+
+class DispatchRun(models.Model):
+    """
+    A summary of one dispatch tick.
+
+    The counts are taken from the delivery ledger when the last shard of the
+    tick is done, so a shard that had to be retried is only counted once.
+    """
+    tick = models.DateTimeField(db_index=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds from planning to the last shard.')
+    sent = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Tick {self.tick:%Y-%m-%d %H:%M}: {self.sent} sent, {self.skipped} skipped, {self.failed} failed"
+
+
+class Delivery(models.Model):
+    """
+    A ledger entry recording what happened to one user's notification for one due slot.
+
+    Entries are unique per (subscription, user, due slot), so a shard that
+    is run again after a crash or a broker redelivery can tell which
+    notifications of the slot are already done and send only the rest.
+    """
+    SENT = 'sent'
+    SKIPPED = 'skipped'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(SENT, 'Sent'), (SKIPPED, 'Skipped'), (FAILED, 'Failed')]
+    DONE = (SENT, SKIPPED)
+
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='deliveries')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    due_at = models.DateTimeField()
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES)
+    run = models.ForeignKey(DispatchRun, null=True, blank=True, on_delete=models.SET_NULL, related_name='deliveries')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'deliveries'
+        constraints = [
+            models.UniqueConstraint(fields=['subscription', 'user', 'due_at'], name='unique_delivery_slot'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} / {self.subscription} at {self.due_at:%Y-%m-%d %H:%M}: {self.status}"
@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor pagination over the primary key.
+
+    Pages are addressed by an opaque cursor, so every page is an indexed
+    range read however deep into the list it is.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'id'
+
+
+class RecentFirstCursorPagination(IdCursorPagination):
+    """
+    Cursor pagination over the primary key, newest rows first.
+    """
+    ordering = '-id'
@@ -1,9 +1,19 @@
 from rest_framework import permissions
-from main.models import UserSubscriptions, Subscription
+from main.models import UserSubscriptions
 
 
 class MyPermissionIsAdminOrOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if obj in Subscription.objects.filter(id__in=UserSubscriptions.objects.get(user=request.user).subscriptions.all()):
+        if request.user and request.user.is_staff:
             return True
-        return bool(request.user and request.user.is_staff)
+        if not request.user or not request.user.is_authenticated:
+            return False
+
+        # DRF may check the same object more than once per request, so the
+        # answer is memoised on the request.
+        owned = request.__dict__.setdefault('_owned_subscriptions', {})
+        if obj.pk not in owned:
+            owned[obj.pk] = UserSubscriptions.subscriptions.through.objects.filter(
+                usersubscriptions__user=request.user, subscription_id=obj.pk
+            ).exists()
+        return owned[obj.pk]
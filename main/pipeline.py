@@ -0,0 +1,208 @@
+import queue
+import threading
+import time
+from main.delivery import bulletin_messages, digest_messages
+from main.models import Delivery, Observation
+from main.weather import Location, collect_weather, render_weather
+
+_END = object()
+
+
+class Pipeline:
+    """
+    Deliver a stream of notification blocks through fetch, render and send stages running side by side.
+
+    The fetch stage looks up the weather of each block's cities, the render
+    stage turns it into bulletins and messages, and one sender per Mailer
+    drains the messages over its own SMTP connection, so the slowest stage
+    sets the pace instead of the sum of all three. Stages are connected by
+    queues of at most `queue_size` items: a stage that falls behind fills its
+    input queue, which blocks the stage before it, and so on back to the
+    database cursor, so memory stays flat however many notifications are
+    streamed. The notifications of users who chose digests are the
+    exception: the render stage keeps them until the last block, as a
+    user's cities may be spread over several blocks, and sends them as one
+    message per user at the end. All database work, reading the blocks and
+    recording outcomes in the ledger, stays in the calling thread.
+
+    Args:
+        mailers (list[Mailer]): One sender thread is started per Mailer.
+        record (callable): Called in the calling thread with a list of
+                           notifications and the Delivery status they ended with.
+        queue_size (int): Maximum number of items waiting between two stages.
+        stats (TaskStats): Optionally collects the time spent working in the
+                           fetch, render and send stages, not counting the
+                           time spent waiting on the queues.
+    """
+
+    def __init__(self, mailers, record, queue_size, stats=None):
+        self.mailers = mailers
+        self.record = record
+        self.queue_size = queue_size
+        self.stats = stats
+        self._stop = threading.Event()
+        self._errors = []
+        self._outcomes = queue.SimpleQueue()
+
+    def run(self, blocks):
+        """
+        Push every block through the stages and wait until the last message is sent.
+
+        Args:
+            blocks (Iterable[list]): Lists of pending notifications ordered by city_id.
+
+        Returns:
+            int: The number of emails sent.
+
+        Raises:
+            Exception: The first error raised by any stage, after all stages stopped.
+        """
+        self._owner = threading.current_thread()
+        weather_queue, render_queue, send_queue = (queue.Queue(self.queue_size) for _ in range(3))
+        threads = [
+            threading.Thread(target=self._guard, args=(self._fetch, weather_queue, render_queue)),
+            threading.Thread(target=self._guard, args=(self._render, render_queue, send_queue)),
+        ] + [
+            threading.Thread(target=self._guard, args=(self._send, mailer, send_queue)) for mailer in self.mailers
+        ]
+        for thread in threads:
+            thread.start()
+
+        sent = finished = 0
+        try:
+            for block in blocks:
+                if self._stop.is_set():
+                    # A stage failed; reading the rest of the shard would be wasted queries.
+                    break
+                self._put(weather_queue, block)
+            self._put(weather_queue, _END)
+            while finished < len(self.mailers) and not self._errors:
+                for count in self._drain(timeout=0.1):
+                    sent += count
+                    finished += 1
+        finally:
+            if finished < len(self.mailers):
+                self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._drain()
+
+        if self._errors:
+            raise self._errors[0]
+        return sent
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as exc:
+            self._errors.append(exc)
+            self._stop.set()
+
+    def _put(self, target, item):
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if threading.current_thread() is self._owner:
+                    self._drain()
+
+    def _get(self, source):
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _drain(self, timeout=None):
+        """
+        Record the outcomes reported so far, returning the counts of the senders that finished.
+        """
+        counts = []
+        while True:
+            try:
+                outcome = self._outcomes.get(timeout=timeout) if timeout else self._outcomes.get_nowait()
+            except queue.Empty:
+                return counts
+            timeout = None
+            if outcome[0] is _END:
+                counts.append(outcome[1])
+            else:
+                self.record(*outcome)
+
+    def _fetch(self, inbox, outbox):
+        while (block := self._get(inbox)) is not _END:
+            cities = {
+                notification.city_id: Location(notification.city_name, notification.city_lat, notification.city_lon)
+                for notification in block if notification.email
+            }
+            started = time.perf_counter()
+            weather_by_city = collect_weather(cities)
+            self._spent('fetch', started)
+            self._put(outbox, (block, weather_by_city))
+        self._put(outbox, _END)
+
+    def _render(self, inbox, outbox):
+        bulletins = {}
+        digests = []
+        while (item := self._get(inbox)) is not _END:
+            block, weather_by_city = item
+            started = time.perf_counter()
+            for city_id, weather in weather_by_city.items():
+                if city_id not in bulletins:
+                    city_name = next(notification.city_name for notification in block if notification.city_id == city_id)
+                    bulletins[city_id] = render_weather(city_name, Observation.from_weatherbit(city_id, weather))
+
+            skipped = [notification for notification in block if not notification.email]
+            if skipped:
+                self._outcomes.put((skipped, Delivery.SKIPPED))
+            # Left for the retry, as the weather of these cities could not be fetched.
+            failed = [notification for notification in block
+                      if notification.email and notification.city_id not in weather_by_city]
+            if failed:
+                self._outcomes.put((failed, Delivery.FAILED))
+            digests += [notification for notification in block if notification.digest]
+            messages = list(bulletin_messages(
+                (notification for notification in block if not notification.digest), bulletins
+            ))
+            self._spent('render', started)
+            for message in messages:
+                self._put(outbox, message)
+
+        started = time.perf_counter()
+        messages, single = digest_messages(digests, bulletins)
+        messages += bulletin_messages(sorted(single, key=lambda notification: notification.city_id), bulletins)
+        self._spent('render', started)
+        for message in messages:
+            self._put(outbox, message)
+        for _ in self.mailers:
+            self._put(outbox, _END)
+
+    def _send(self, mailer, inbox):
+        waited = 0.0
+
+        def messages():
+            nonlocal waited
+            while True:
+                started = time.perf_counter()
+                message = self._get(inbox)
+                waited += time.perf_counter() - started
+                if message is _END:
+                    return
+                yield message
+
+        def record_batch(delivered, rejected):
+            for batch, status in ((delivered, Delivery.SENT), (rejected, Delivery.FAILED)):
+                if notifications := [notification for message in batch for notification in message.notifications]:
+                    self._outcomes.put((notifications, status))
+
+        started = time.perf_counter()
+        sent = mailer.send(messages(), on_batch=record_batch)
+        if self.stats is not None:
+            self.stats.add('send', time.perf_counter() - started - waited)
+        self._outcomes.put((_END, sent))
+
+    def _spent(self, stage, started):
+        if self.stats is not None:
+            self.stats.add(stage, time.perf_counter() - started)
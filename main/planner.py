@@ -0,0 +1,138 @@
+from django.db.models import Exists, F, OuterRef
+from main.models import Subscription, UserSubscriptions
+from main.weather import Location
+
+
+def _due_rows(now):
+    through = UserSubscriptions.subscriptions.through
+    return (
+        through.objects
+        .filter(subscription__next_due_at__lte=now)
+        .annotate(
+            user_id=F('usersubscriptions__user_id'),
+            email=F('usersubscriptions__user__email'),
+            digest=F('usersubscriptions__digest'),
+            city_id=F('subscription__city_id'),
+            city_name=F('subscription__city__name'),
+            city_lat=F('subscription__city__lat'),
+            city_lon=F('subscription__city__lon'),
+            next_due_at=F('subscription__next_due_at'),
+            notification_period=F('subscription__notification_period'),
+        )
+    )
+
+
+def due_notifications(now, first_id=None, last_id=None, chunk_size=2000):
+    """
+    Stream the notifications that are due at the given time.
+
+    The whole plan is resolved in a single joined query over the
+    UserSubscriptions <-> Subscription through table, so the number of
+    queries does not depend on the number of users. Due schedules are
+    selected by an indexed range scan on Subscription.next_due_at, one row
+    per (city, period) however many users share it, and fanned out to their
+    members through the indexed subscription_id of the through table. Each row
+    already carries the recipient email, the user's digest setting and the
+    city name, so nothing else has to be looked up while sending. Users
+    without an email address are included, so they are recorded as skipped.
+
+    Args:
+        now (datetime): The time the tick is running for.
+        first_id (int): Optional lower bound of the UserSubscriptions id range to plan.
+        last_id (int): Optional upper bound of the UserSubscriptions id range to plan.
+        chunk_size (int): How many rows the database cursor fetches at a time.
+
+    Returns:
+        Iterator: Named rows with subscription_id, user_id, email, city_id,
+                  city_name, city_lat, city_lon, next_due_at,
+                  notification_period and digest fields.
+    """
+    rows = _due_rows(now)
+    if first_id is not None:
+        rows = rows.filter(usersubscriptions_id__gte=first_id)
+    if last_id is not None:
+        rows = rows.filter(usersubscriptions_id__lte=last_id)
+
+    return (
+        rows
+        .order_by('city_id', 'user_id')
+        .values_list(
+            'subscription_id', 'user_id', 'email', 'city_id', 'city_name', 'city_lat', 'city_lon',
+            'next_due_at', 'notification_period', 'digest',
+            named=True,
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def due_cities(now):
+    """
+    Return the distinct cities that have at least one notification due at the given time.
+
+    Only the due schedules with at least one member are read, without
+    joining every member, so the cost depends on the number of schedules.
+
+    Returns:
+        dict: Locations keyed by city id.
+    """
+    members = UserSubscriptions.subscriptions.through.objects.filter(subscription=OuterRef('pk'))
+    rows = (
+        Subscription.objects
+        .filter(Exists(members), next_due_at__lte=now)
+        .order_by()
+        .values_list('city_id', 'city__name', 'city__lat', 'city__lon')
+        .distinct()
+    )
+    return {city_id: Location(name, lat, lon) for city_id, name, lat, lon in rows}
+
+
+def due_shards(now, chunk_size):
+    """
+    Split the notifications due at the given time into shards of whole users.
+
+    The UserSubscriptions ids of the due through table rows are streamed in
+    order and cut into consecutive ranges of about `chunk_size` due rows
+    each, only ever between two users, so all the notifications of a user
+    end up in the same shard and can be sent as one digest. A user with
+    more due rows than `chunk_size` gets a shard of their own.
+
+    Yields:
+        tuple: Inclusive (first_id, last_id) UserSubscriptions id bounds of each shard.
+    """
+    ids = (
+        _due_rows(now).order_by('usersubscriptions_id').values_list('usersubscriptions_id', flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    first_id = last_id = None
+    count = 0
+    for entry_id in ids:
+        if count >= chunk_size and entry_id != last_id:
+            yield first_id, last_id
+            first_id, count = None, 0
+        if first_id is None:
+            first_id = entry_id
+        last_id = entry_id
+        count += 1
+    if first_id is not None:
+        yield first_id, last_id
+
+
+def advance(now):
+    """
+    Move every subscription due at the given time to its next slot after it.
+
+    Subscriptions are shared by all their users, whose notifications may be
+    spread over many shards, so they are only advanced once the whole tick
+    is done. Subscriptions that share a due time and period share the same
+    next slot, so they are advanced together in one UPDATE. Every UPDATE
+    only matches rows still at the due time that was read, which makes
+    advancing safe to repeat for the same tick.
+    """
+    slots = list(
+        Subscription.objects.filter(next_due_at__lte=now).order_by()
+        .values_list('next_due_at', 'notification_period').distinct()
+    )
+    for due_at, notification_period in slots:
+        Subscription.objects.filter(next_due_at=due_at, notification_period=notification_period).update(
+            next_due_at=Subscription.next_due_after(due_at, notification_period, now)
+        )
@@ -1,20 +1,247 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from main.models import City, Subscription
+from main.cities import directory
+from main.models import City, DispatchRun, Observation, ObservationAggregate, Subscription, UserSubscriptions
+from main.weather import render_weather
+
+
+class ObservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Observation
+        exclude = ('id', 'city')
+
+
+class ObservationAggregateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ObservationAggregate
+        exclude = ('id', 'city', 'resolution')
+
+
+class HistoryQuerySerializer(serializers.Serializer):
+    """
+    Validates the query parameters of the city history endpoint.
+
+    Without `since`, the range covers the last day of raw history, the last
+    week of hourly history or the last year of daily history up to `until`,
+    which defaults to now. Ranges are capped per resolution, so a response
+    never holds more than a few thousand points.
+    """
+    DEFAULT_SPANS = {'raw': timedelta(days=1), 'hour': timedelta(days=7), 'day': timedelta(days=365)}
+    MAX_SPANS = {'raw': timedelta(days=31), 'hour': timedelta(days=92), 'day': timedelta(days=3660)}
+
+    resolution = serializers.ChoiceField(
+        choices=['raw'] + [value for value, _ in ObservationAggregate.RESOLUTION_CHOICES], default='raw'
+    )
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        resolution = data['resolution']
+        data.setdefault('until', timezone.now())
+        data.setdefault('since', data['until'] - self.DEFAULT_SPANS[resolution])
+        if data['since'] >= data['until']:
+            raise serializers.ValidationError('since must be before until.')
+        if data['until'] - data['since'] > self.MAX_SPANS[resolution]:
+            raise serializers.ValidationError(
+                f'{resolution} history can be read for at most {self.MAX_SPANS[resolution].days} days at a time.'
+            )
+        return data
 
 
 class CitySerializer(serializers.ModelSerializer):
+    """
+    Serializes cities, optionally limited to the fields listed in the
+    `fields` query parameter, e.g. `?fields=id,name` to leave out the weather.
+
+    The bulletin in `current_weather` is rendered from the latest stored
+    observation, in the language given by the `lang` query parameter.
+    """
+    current_weather = serializers.SerializerMethodField()
+    weather = ObservationSerializer(source='latest_observation', read_only=True)
+
     class Meta:
         model = City
-        fields = '__all__'
+        fields = ('id', 'name', 'current_weather', 'weather')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and (selected := request.query_params.get('fields')):
+            for name in set(self.fields) - set(selected.split(',')):
+                self.fields.pop(name)
+
+    def get_current_weather(self, obj):
+        if obj.latest_observation is None:
+            return obj.current_weather
+        request = self.context.get('request')
+        return render_weather(obj.name, obj.latest_observation, request and request.query_params.get('lang'))
+
+
+class CityNameField(serializers.CharField):
+    """
+    A city given by its name.
+
+    Validation only cleans the name up. The serializer resolves it through
+    the city directory, creating the city if it is new, once the whole
+    subscription has been validated, so a rejected request adds no city.
+    """
+
+    def run_validation(self, data=serializers.empty):
+        return ' '.join(super().run_validation(data).split())
+
+    def to_representation(self, value):
+        return str(value)
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
-    city_name = serializers.SerializerMethodField()
+    """
+    Serializes subscriptions. New subscriptions name their city either by
+    id in `city` or by name in `city_name`; a name no city has yet creates it.
+    """
+    city_name = CityNameField(source='city', max_length=50, required=False)
 
     class Meta:
         model = Subscription
         fields = '__all__'
+        read_only_fields = ('next_due_at',)
+        extra_kwargs = {'city': {'required': False}}
+
+    def validate(self, attrs):
+        if not self.partial and 'city' not in attrs:
+            raise serializers.ValidationError({'city': 'Either city or city_name is required.'})
+        return attrs
 
     @staticmethod
-    def get_city_name(obj):
-        return str(obj.city)
+    def resolve_city(city):
+        """
+        Return the City of a validated `city`, which is a name when it was given in `city_name`.
+        """
+        return directory.resolve_or_create(city) if isinstance(city, str) else city
+
+    def create(self, validated_data):
+        schedule = (self.resolve_city(validated_data['city']).id, validated_data['notification_period'])
+        return Subscription.for_schedules([schedule])[schedule]
+
+    def update(self, instance, validated_data):
+        """
+        Return the shared subscription of the schedule the changes lead to.
+
+        Subscriptions are shared by all their users, so `instance` itself is
+        left as it is; the view moves the user over to the returned one.
+        """
+        schedule = (
+            self.resolve_city(validated_data.get('city', instance.city)).id,
+            validated_data.get('notification_period', instance.notification_period),
+        )
+        if schedule == (instance.city_id, instance.notification_period):
+            return instance
+        return Subscription.for_schedules([schedule])[schedule]
+
+
+class DeferredCityField(serializers.PrimaryKeyRelatedField):
+    """
+    A city reference that is only checked to be an id, leaving the lookup to the list serializer.
+    """
+
+    def to_internal_value(self, data):
+        return serializers.IntegerField(min_value=1).run_validation(data)
+
+
+class BulkSubscriptionListSerializer(serializers.ListSerializer):
+    """
+    Subscribes one user to many schedules, or moves them between schedules, with a constant number of queries.
+
+    All referenced cities are resolved with a single `in` query during
+    validation, and the shared subscriptions of all the schedules involved
+    are looked up or created together by Subscription.for_schedules. The
+    user's links are then written with one bulk insert into the
+    UserSubscriptions through table, plus one bulk delete of the links an
+    update moves away from, inside a single transaction. The user's
+    UserSubscriptions entry is expected in the `user_subscriptions` context.
+    """
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            ids = [item.get('id') for item in attrs]
+            if None in ids:
+                raise serializers.ValidationError('Every item must carry the id of the subscription to update.')
+            if len(set(ids)) != len(ids):
+                raise serializers.ValidationError('Every subscription may only be updated once per request.')
+            unknown = set(ids) - {subscription.id for subscription in self.instance}
+            if unknown:
+                raise serializers.ValidationError(f'Unknown subscriptions: {", ".join(map(str, sorted(unknown)))}.')
+
+        cities = City.objects.in_bulk({item['city'] for item in attrs if 'city' in item})
+        unknown = {item['city'] for item in attrs if 'city' in item} - set(cities)
+        if unknown:
+            raise serializers.ValidationError(f'Unknown cities: {", ".join(map(str, sorted(unknown)))}.')
+        for item in attrs:
+            if 'city' in item:
+                item['city'] = cities[item['city']]
+        return attrs
+
+    def create(self, validated_data):
+        schedules = [(item['city'].id, item['notification_period']) for item in validated_data]
+        with transaction.atomic():
+            subscriptions = Subscription.for_schedules(schedules)
+            self._link({subscription.id for subscription in subscriptions.values()})
+        return [subscriptions[schedule] for schedule in schedules]
+
+    def update(self, instance, validated_data):
+        current = {subscription.id: subscription for subscription in instance}
+        moves = []
+        for item in validated_data:
+            subscription = current[item['id']]
+            schedule = (
+                item.get('city', subscription.city).id,
+                item.get('notification_period', subscription.notification_period),
+            )
+            moves.append((subscription, schedule))
+
+        with transaction.atomic():
+            subscriptions = Subscription.for_schedules(schedule for _, schedule in moves)
+            moved = [(old, subscriptions[schedule]) for old, schedule in moves if subscriptions[schedule].id != old.id]
+            if moved:
+                UserSubscriptions.subscriptions.through.objects.filter(
+                    usersubscriptions=self.context['user_subscriptions'], subscription__in=[old for old, _ in moved]
+                ).delete()
+                self._link({new.id for _, new in moved})
+        return [subscriptions[schedule] for _, schedule in moves]
+
+    def _link(self, subscription_ids):
+        through = UserSubscriptions.subscriptions.through
+        through.objects.bulk_create(
+            [through(usersubscriptions=self.context['user_subscriptions'], subscription_id=subscription_id)
+             for subscription_id in subscription_ids],
+            ignore_conflicts=True,
+        )
+
+
+class BulkSubscriptionSerializer(SubscriptionSerializer):
+    id = serializers.IntegerField(required=False)
+    city = DeferredCityField(queryset=City.objects.all())
+    city_name = serializers.CharField(source='city.name', read_only=True)
+
+    class Meta(SubscriptionSerializer.Meta):
+        list_serializer_class = BulkSubscriptionListSerializer
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.SUBSCRIPTION_BULK_LIMIT)
+        kwargs.setdefault('allow_empty', False)
+        return super().many_init(*args, **kwargs)
+
+
+class UserSettingsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserSubscriptions
+        fields = ('digest',)
+
+
+class DispatchRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DispatchRun
+        fields = '__all__'
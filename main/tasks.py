@@ -1,76 +1,218 @@
+import logging
+import smtplib
 from datetime import datetime
-import requests
+from itertools import islice
+from celery import chord
 from celery.schedules import crontab
-from django.contrib.auth.models import User
-from django.core.mail import send_mail
-from main.models import City, UserSubscriptions
+from celery.signals import worker_process_shutdown
+from django.core.cache import cache
+from django.utils import timezone
+from main import ledger
+from main.delivery import mailers
+from main.history import downsample
+from main.instrumentation import TaskStats, log_event
+from main.metrics import Counter
+from main.models import Delivery, DispatchRun
+from main.pipeline import Pipeline
+from main.planner import advance, due_cities, due_notifications, due_shards
+from main.weather import fetch_bulletins
 from weatherreminder.celery import app
 from django.conf import settings
 
 
+logger = logging.getLogger(__name__)
+
+SENT = Counter('weather_emails_sent_total', 'Emails sent, by the minute of the hour their tick ran at.')
+# Held by the tick being sent, so the next tick cannot plan the same due rows again.
+DISPATCH_LOCK = 'dispatch:lock'
+
+
+class DeliveryFailed(Exception):
+    """
+    Raised by a shard that recorded failed notifications, so it is retried for them.
+    """
+
+
+def report(task, stats, **fields):
+    """
+    Export a task's stage timings and query count, and send them as a `task-stats` Celery event.
+
+    Events are only sent for tasks run by a worker, which has a connection
+    to the broker; eager and direct calls only export the metrics.
+    """
+    summary = stats.finish(**fields)
+    if not (task.request.called_directly or task.request.is_eager):
+        task.send_event('task-stats', **summary, **fields)
+
+
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(
-        crontab(minute=0, hour='*/1'),
+        crontab() if settings.DISPATCH_SPREAD_MINUTES else crontab(minute=0, hour='*/1'),
         time_check.s()
     )
+    sender.add_periodic_task(crontab(minute=30, hour=3), downsample_history.s())
+
+
+@worker_process_shutdown.connect
+def close_mailers(**kwargs):
+    mailers.close()
+
+
+@app.task(bind=True)
+def time_check(self):
+    """
+    Plan a tick and fan it out to the workers.
+
+    Ticks run hourly, or every minute when DISPATCH_SPREAD_MINUTES spreads
+    the schedules across the hour. Due subscriptions are those whose
+    next_due_at has passed. The weather for every due city is fetched once,
+    up front. The due notifications are then split into id-range shards of
+    DISPATCH_CHUNK_SIZE rows and sent by a chord of send_chunk tasks, so any
+    number of workers can share the tick. The chord callback returns the
+    total sent count, advances the due subscriptions to their next slot
+    and stores the summary of the tick's DispatchRun. A tick with a failed
+    shard leaves its subscriptions due, so the next tick sends what is
+    still missing according to the delivery ledger.
+
+    Due subscriptions only move on once the whole tick is sent, so a tick
+    holds the dispatch lock until then and ticks starting meanwhile are
+    skipped instead of sending the same rows a second time. The lock expires
+    after DISPATCH_LOCK_TIMEOUT seconds in case the callback never runs.
+    """
+    now = timezone.now()
+    if not cache.add(DISPATCH_LOCK, now.isoformat(), timeout=settings.DISPATCH_LOCK_TIMEOUT):
+        log_event(logger, 'tick_skipped', tick=now.isoformat(), running=cache.get(DISPATCH_LOCK))
+        return "Skipped, the previous tick is still being sent"
+
+    stats = TaskStats('time_check')
+    try:
+        with stats.count_queries():
+            with stats.stage('query'):
+                run = DispatchRun.objects.create(tick=now)
+                cities = due_cities(now)
+            with stats.stage('fetch'):
+                fetch_bulletins(cities)
+
+            with stats.stage('query'):
+                shards = [
+                    send_chunk.s(now.isoformat(), first_id, last_id, run.id)
+                    for first_id, last_id in due_shards(now, settings.DISPATCH_CHUNK_SIZE)
+                ]
+                if not shards:
+                    advance(now)
+                    ledger.finish(run.id)
+    except Exception:
+        release_dispatch(now.isoformat())
+        raise
+    report(self, stats, cities=len(cities), shards=len(shards))
+
+    if not shards:
+        release_dispatch(now.isoformat())
+        return "Sent 0 emails"
+    callback = total_sent.s(run.id, now.isoformat())
+    callback.link_error(release_dispatch.si(now.isoformat()))
+    chord(shards)(callback)
+    return f"Dispatched {len(shards)} chunks"
+
+
+@app.task(
+    bind=True, autoretry_for=(smtplib.SMTPException, OSError, DeliveryFailed), retry_backoff=True, max_retries=3
+)
+def send_chunk(self, now, first_id, last_id, run_id=None):
+    """
+    Send the notifications of one shard of the tick.
+
+    The shard's due rows are streamed from the database cursor in blocks of
+    DISPATCH_BLOCK_SIZE through a Pipeline, which fetches the weather,
+    renders the messages and sends them over the worker's pool of SMTP
+    connections side by side, with bounded queues in between. Notifications
+    the delivery ledger already has as done for their slot are left out,
+    so a shard that is retried after an SMTP failure, or delivered again
+    after a worker crash, carries on where it stopped. The weather comes
+    from the observation cache, which the planning step has already filled,
+    so a shard only goes upstream for cities whose fetch failed earlier.
+    Outcomes are written to the ledger in bulk as the batches go out.
+    Notifications whose weather could not be fetched or whose recipients
+    the relay rejected are recorded as failed, and the shard is retried for
+    them; once its retries are used up they are left failed in the ledger.
+    Subscriptions are shared with the users of other shards, so they are
+    left for the chord callback to advance. The time spent in every stage
+    and the number of queries are reported as metrics, a structured log
+    line and a `task-stats` event, and a LOG_SAMPLE_RATE share of the
+    individual outcomes is logged.
+
+    Returns:
+        int: The number of emails sent.
+    """
+    now = datetime.fromisoformat(now)
+    stats = TaskStats('send_chunk')
+    planned = failed = 0
+
+    def blocks():
+        nonlocal planned
+        rows = due_notifications(now, first_id, last_id, chunk_size=settings.DISPATCH_BLOCK_SIZE)
+        while True:
+            with stats.stage('query'):
+                if not (block := list(islice(rows, settings.DISPATCH_BLOCK_SIZE))):
+                    return
+                planned += len(block)
+                pending = ledger.pending(block)
+            if pending:
+                yield pending
+
+    def record(notifications, status):
+        nonlocal failed
+        if status == Delivery.FAILED:
+            failed += len(notifications)
+        with stats.stage('query'):
+            ledger.record(notifications, status, run_id)
+        for notification in notifications:
+            log_event(
+                logger, 'notification', settings.LOG_SAMPLE_RATE, status=status, user_id=notification.user_id,
+                subscription_id=notification.subscription_id, city_id=notification.city_id,
+            )
+
+    with stats.count_queries():
+        sent = Pipeline(mailers, record, settings.DISPATCH_QUEUE_SIZE, stats).run(blocks())
+    if sent:
+        SENT.inc(sent, minute=timezone.localtime(now).minute)
+    report(self, stats, sent=sent, planned=planned, failed=failed)
+    if failed and self.request.retries < self.max_retries:
+        raise DeliveryFailed(f'{failed} notifications failed')
+    return sent
 
 
 @app.task
-def time_check():
-    now = datetime.now().hour
-    checked_cities = []
-    sent = 0
-
-    for user_subs in UserSubscriptions.objects.all():
-        print(f'checking {User.objects.get(id=user_subs.user_id).username}')
-        if not (user := User.objects.get(id=user_subs.user_id)).email:
-            continue
-
-        for subscription in user_subs.subscriptions.all():
-            if now % subscription.notification_period == 0:
-                sent += 1
-                city_name = City.objects.get(id=subscription.city_id).name
-                send_weather_info(user.email, city_name, city_name in checked_cities)
-                checked_cities.append(city_name)
-
-    return f"Sent {sent} emails"
-
-
-def send_weather_info(email, city, is_city_checked):
-    if is_city_checked:
-        message = City.objects.get(name=city).current_weather
-    else:
-        api_url = "https://api.weatherbit.io/v2.0/current"
-        api_key = settings.WEATHER_API_KEY
-        lang = "UK"
-        response = requests.get(api_url, params={"city": city, "key": api_key, "lang": lang})
-
-        if response.status_code == 200:
-            weather = response.json()['data'][0]
-        else:
-            return "error: Failed to fetch weather data"
-
-        message = f"\nПогода в {city}:\n" \
-                  f"Температура: {weather['temp']}°C\n" \
-                  f"Відчувається як: {weather['app_temp']}°C\n" \
-                  f"Тиск: {weather['pres']} mb.\n" \
-                  f"Швидкість вітру: {weather['wind_spd']} м/с\n" \
-                  f"Напрямок вітру: {weather['wind_cdir_full']}\n" \
-                  f"Вологість повітря: {weather['rh']}%\n" \
-                  f"Видимість: {weather['vis']}км\n" \
-                  f"УФ-індекс: {weather['uv']}\n" \
-                  f"Час останнього спостереження: {weather['ob_time']}"
-
-        current_city = City.objects.get(name=city)
-        current_city.current_weather = message
-        current_city.save()
-
-    send_mail(
-        f"Погода в {city}",
-        message,
-        settings.EMAIL_HOST_USER,
-        [email]
-    )
+def total_sent(counts, run_id=None, now=None):
+    if now is not None:
+        advance(datetime.fromisoformat(now))
+    if run_id is not None:
+        ledger.finish(run_id)
+    if now is not None:
+        release_dispatch(now)
+    return f"Sent {sum(counts)} emails"
+
+
+@app.task
+def release_dispatch(tick):
+    """
+    Release the dispatch lock if the tick starting at `tick` (an ISO time) still holds it.
+    """
+    if cache.get(DISPATCH_LOCK) == tick:
+        cache.delete(DISPATCH_LOCK)
+
+
+@app.task(bind=True)
+def downsample_history(self):
+    """
+    Roll weather history past its retention period up into hourly and daily aggregates.
 
-    return 'Success'
+    Runs once a day. See main.history.downsample.
+    """
+    stats = TaskStats('downsample_history')
+    with stats.count_queries():
+        with stats.stage('query'):
+            hourly, daily = downsample()
+    report(self, stats, hourly=hourly, daily=daily)
+    return f"Wrote {hourly} hourly and {daily} daily aggregates"
@@ -0,0 +1,206 @@
+import json
+import re
+import socketserver
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+RECORDED_POINTS = Path(__file__).resolve().parent / 'tests' / 'data' / 'weatherbit_points.json'
+
+
+def observation(city, lat=None, lon=None):
+    checksum = zlib.crc32(city.encode())
+    return {
+        'city_name': city,
+        'lat': 44 + checksum % 800 / 100 if lat is None else lat,
+        'lon': 22 + checksum // 800 % 1800 / 100 if lon is None else lon,
+        'temp': 21.5,
+        'app_temp': 22.1,
+        'pres': 1012.4,
+        'wind_spd': 3.2,
+        'wind_cdir_full': 'південно-західний',
+        'rh': 64,
+        'vis': 16,
+        'uv': 4.5,
+        'ob_time': '2023-07-20 12:00',
+    }
+
+
+class WeatherbitStub:
+    """
+    A local stand-in for the Weatherbit current weather API.
+
+    The server runs in a background thread, answers every request after an
+    artificial delay and records the request parameters, so tests and
+    benchmarks can measure fetch concurrency without touching the network.
+    Cities are looked up by `city` name or in bulk by `points`. Bulk answers
+    come from a recorded Weatherbit response where the coordinates match
+    one of its observations, are synthesized otherwise, and are returned in
+    reverse order, as the API does not promise to keep the request order.
+    Cities listed in `failing` are answered with HTTP 500.
+    """
+
+    def __init__(self, latency=0.0, failing=()):
+        self.latency = latency
+        self.failing = set(failing)
+        self.recorded = json.loads(RECORDED_POINTS.read_text())['data']
+        self.requests = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v2.0/current'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                with stub._lock:
+                    stub.requests.append(params)
+                time.sleep(stub.latency)
+
+                status, body = stub.respond(params)
+                payload = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except ConnectionError:
+                    # The client gave up waiting, e.g. on its read timeout.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, params):
+        if 'points' in params:
+            points = [(float(lat), float(lon)) for lat, lon in re.findall(r'\(([-\d.]+),([-\d.]+)\)', params['points'])]
+            data = [self.recorded_point(lat, lon) or observation(f'{lat},{lon}', lat, lon) for lat, lon in points]
+            return 200, {'count': len(data), 'data': data[::-1]}
+
+        city = params.get('city')
+        if city in self.failing:
+            return 500, {'error': 'Internal error'}
+        return 200, {'count': 1, 'data': [observation(city)]}
+
+    def recorded_point(self, lat, lon):
+        for weather in self.recorded:
+            if abs(weather['lat'] - lat) < 0.01 and abs(weather['lon'] - lon) < 0.01:
+                return weather
+        return None
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SMTPSink:
+    """
+    A minimal local SMTP server that accepts and records every message.
+
+    It speaks just enough SMTP for smtplib and Django's SMTP backend (no TLS
+    or AUTH) and counts sessions, so tests and benchmarks can tell how many
+    connections a delivery run opened. With `disconnect_after` set, every
+    session is dropped after that many messages to simulate a relay closing
+    idle or busy connections. Recipients listed in `rejecting` are refused.
+    With `keep_messages` off only `received` is counted, so long benchmark
+    runs do not grow the process.
+    """
+
+    def __init__(self, disconnect_after=None, rejecting=(), keep_messages=True):
+        self.disconnect_after = disconnect_after
+        self.rejecting = set(rejecting)
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _handler(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with sink._lock:
+                    sink.connections += 1
+                session_messages = 0
+                recipients = []
+                self.reply('220 localhost SMTP sink')
+
+                while line := self.rfile.readline():
+                    command = line.decode(errors='replace').strip()
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-localhost')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'MAIL':
+                        recipients = []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipient = command.split(':', 1)[1].strip(' <>')
+                        if recipient in sink.rejecting:
+                            self.reply('550 Mailbox unavailable')
+                            continue
+                        recipients.append(recipient)
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = b''.join(iter(lambda: self.rfile.readline(), b'.\r\n'))
+                        with sink._lock:
+                            sink.received += 1
+                            if sink.keep_messages:
+                                sink.messages.append((recipients, data))
+                        self.reply('250 OK')
+                        session_messages += 1
+                        if sink.disconnect_after and session_messages >= sink.disconnect_after:
+                            return
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    elif verb in ('HELO', 'RSET', 'NOOP'):
+                        self.reply('250 OK')
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
+
+    def settings(self):
+        """
+        Return the Django email settings that route mail into this sink.
+        """
+        return {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': self.host,
+            'EMAIL_PORT': self.port,
+            'EMAIL_USE_TLS': False,
+            'EMAIL_HOST_USER': '',
+            'EMAIL_HOST_PASSWORD': '',
+        }
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from main.authentication import _cached_fields, _user_key, cached_user
+
+
+def _user_queries(queries):
+    return [query['sql'] for query in queries if 'auth_user' in query['sql'] or 'authtoken_token' in query['sql']]
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.url = reverse('my_settings')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_answered_from_cache(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(_user_queries(queries), [])
+
+    def test_deactivated_user_rejected_at_once(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_reloads_user(self):
+        self.client.get(self.url)
+        self.user.set_password('newpassword')
+        self.user.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(_user_queries(queries)), 1)
+
+    def test_deleted_user_rejected(self):
+        self.client.get(self.url)
+        self.user.delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_hash_not_cached(self):
+        self.client.get(self.url)
+
+        self.assertNotIn('password', cache.get(_user_key(self.user.id)))
+        user = cached_user(self.user.id)
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('testpassword'))
+
+    def test_entry_cached_before_deactivation_ignored(self):
+        self.client.get(self.url)
+        stale_key, stale_user = _user_key(self.user.id), User.objects.get(id=self.user.id)
+        self.user.is_active = False
+        self.user.save()
+        # A request that read the user before the save caches it afterwards.
+        cache.set(stale_key, _cached_fields(stale_user))
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('my_settings')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_known_token_needs_no_query(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(_user_queries(queries), [])
+
+    def test_deleted_token_rejected(self):
+        self.client.get(self.url)
+        self.token.delete()
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_rejected(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
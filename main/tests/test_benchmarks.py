@@ -0,0 +1,30 @@
+from django.test import SimpleTestCase
+from main.benchmarks import compare
+
+
+class CompareTest(SimpleTestCase):
+    def test_regressions_follow_metric_direction(self):
+        baseline = [
+            {'benchmark': 'api', 'users': 1000, 'endpoint': 'cities', 'p99_ms': 10.0},
+            {'benchmark': 'tick', 'users': 1000, 'seconds': 2.0, 'emails_per_second': 1000.0},
+        ]
+        results = [
+            {'benchmark': 'api', 'users': 1000, 'endpoint': 'cities', 'p99_ms': 12.0},
+            {'benchmark': 'tick', 'users': 1000, 'seconds': 1.0, 'emails_per_second': 500.0},
+        ]
+
+        changes = {(change['benchmark'], change['metric']): change for change in compare(baseline, results)}
+
+        self.assertEqual(changes['api', 'p99_ms']['regression_percent'], 20.0)
+        self.assertEqual(changes['tick', 'seconds']['regression_percent'], -50.0)
+        self.assertEqual(changes['tick', 'emails_per_second']['regression_percent'], 50.0)
+        self.assertNotIn(('api', 'users'), changes)
+
+    def test_results_matched_by_size_and_labels(self):
+        baseline = [{'benchmark': 'api', 'users': 1000, 'endpoint': 'cities', 'p50_ms': 1.0}]
+        results = [
+            {'benchmark': 'api', 'users': 10000, 'endpoint': 'cities', 'p50_ms': 5.0},
+            {'benchmark': 'api', 'users': 1000, 'endpoint': 'my_subscriptions', 'p50_ms': 5.0},
+        ]
+
+        self.assertEqual(list(compare(baseline, results)), [])
@@ -0,0 +1,98 @@
+import threading
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from main.cache import ObservationCache
+
+
+class ObservationCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.fetched = []
+        self.observations = ObservationCache(self.fetch, ttl=60, stale_ttl=60, local_size=2)
+
+    def fetch(self, cities):
+        fetched = {}
+        for city_id, city in cities.items():
+            self.fetched.append(city)
+            fetched[city_id] = {'city_name': city, 'version': len(self.fetched)}
+        return fetched
+
+    def test_second_lookup_is_a_hit(self):
+        first = self.observations.get(1, 'Kyiv')
+        second = self.observations.get(1, 'Kyiv')
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.fetched, ['Kyiv'])
+        stats = self.observations.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['saved_fetches']), (1, 1, 1))
+
+    def test_shared_layer_used_by_other_processes(self):
+        self.observations.get(1, 'Kyiv')
+        other_process = ObservationCache(self.fetch, ttl=60, stale_ttl=60, local_size=2)
+
+        other_process.get(1, 'Kyiv')
+
+        self.assertEqual(self.fetched, ['Kyiv'])
+
+    def test_local_layer_evicts_least_recently_used(self):
+        for city_id, city in enumerate(('Kyiv', 'Lviv', 'Odesa')):
+            self.observations.get(city_id, city)
+
+        self.assertEqual(list(self.observations._local), [1, 2])
+
+    def test_expired_entry_served_while_refreshing(self):
+        stale = self.observations.get(1, 'Kyiv')
+
+        with mock.patch('main.cache.time.time', return_value=time.time() + 90):
+            served = self.observations.get(1, 'Kyiv')
+            self.observations._refresher.submit(lambda: None).result()
+            refreshed = self.observations.get(1, 'Kyiv')
+
+        self.assertEqual(served, stale)
+        self.assertEqual(refreshed['version'], 2)
+        self.assertEqual(self.observations.stats()['refreshes'], 1)
+
+    def test_entry_past_stale_window_fetched_again(self):
+        self.observations.get(1, 'Kyiv')
+
+        with mock.patch('main.cache.time.time', return_value=time.time() + 150):
+            self.assertEqual(self.observations.get(1, 'Kyiv')['version'], 2)
+
+    def test_concurrent_misses_merged(self):
+        started = threading.Event()
+
+        def slow_fetch(cities):
+            started.set()
+            time.sleep(0.2)
+            return self.fetch(cities)
+
+        self.observations.fetch_many = slow_fetch
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.observations.get(1, 'Kyiv'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.fetched, ['Kyiv'])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.observations.stats()['upstream_fetches'], 1)
+
+    def test_misses_fetched_together(self):
+        calls = []
+        fetch = self.fetch
+        self.observations.fetch_many = lambda cities: calls.append(list(cities)) or fetch(cities)
+        self.observations.get(1, 'Kyiv')
+
+        results = self.observations.get_many({1: 'Kyiv', 2: 'Lviv', 3: 'Odesa'})
+
+        self.assertEqual(calls, [[1], [2, 3]])
+        self.assertEqual(set(results), {1, 2, 3})
+
+    def test_failed_city_not_cached(self):
+        self.observations.fetch_many = lambda cities: {}
+
+        self.assertIsNone(self.observations.get(1, 'Kyiv'))
+        self.assertIsNone(cache.get(self.observations._key(1)))
@@ -0,0 +1,60 @@
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase
+from main.cities import CityDirectory
+from main.models import City
+
+
+class CityKeyTest(TestCase):
+    def test_key_folds_case_diacritics_and_whitespace(self):
+        city = City.objects.create(name='  Zürich   Nord ')
+
+        self.assertEqual(city.key, 'zurich nord')
+        self.assertEqual(City.normalize('KÝIV'), City.normalize('kyiv'))
+
+    def test_folded_duplicate_rejected(self):
+        City.objects.create(name='Kyiv')
+
+        with self.assertRaises(IntegrityError):
+            City.objects.create(name='KYÏV')
+
+
+class CityDirectoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = CityDirectory()
+        self.kyiv = City.objects.create(name='Kyiv')
+
+    def test_resolve_answered_from_memory(self):
+        self.directory.resolve('Lviv')
+
+        with self.assertNumQueries(0):
+            city = self.directory.resolve(' kyïv ')
+
+        self.assertEqual(city.id, self.kyiv.id)
+
+    def test_unknown_name(self):
+        self.assertIsNone(self.directory.resolve('Atlantis'))
+
+    def test_map_rebuilt_after_city_change(self):
+        self.directory.resolve('Kyiv')
+        self.kyiv.delete()
+        lviv = City.objects.create(name='Lviv')
+
+        self.assertIsNone(self.directory.resolve('Kyiv'))
+        self.assertEqual(self.directory.resolve('LVIV').id, lviv.id)
+
+    def test_bulk_inserted_city_found_by_key(self):
+        self.directory.resolve('Kyiv')
+        odesa, = City.objects.bulk_create([City(name='Odesa', key=City.normalize('Odesa'))])
+
+        self.assertEqual(self.directory.resolve('odesa').id, odesa.id)
+
+    def test_resolve_or_create(self):
+        existing = self.directory.resolve_or_create('KYIV')
+        created = self.directory.resolve_or_create(' Kharkiv ')
+
+        self.assertEqual(existing.id, self.kyiv.id)
+        self.assertEqual(created.name, 'Kharkiv')
+        self.assertEqual(self.directory.resolve_or_create('kharkiv').id, created.id)
+        self.assertEqual(City.objects.count(), 2)
@@ -0,0 +1,119 @@
+import smtplib
+import time
+from collections import namedtuple
+from django.test import SimpleTestCase, override_settings
+from main.delivery import Mailer, bulletin_messages, digest_messages, weather_message
+from main.testing import SMTPSink
+
+
+class MailerTest(SimpleTestCase):
+    def setUp(self):
+        self.sink = SMTPSink()
+        self.sink.__enter__()
+        self.addCleanup(self.sink.__exit__)
+        settings_override = override_settings(**self.sink.settings())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def messages(self, count):
+        return [weather_message('Kyiv', 'Сонячно', [f'user{i}@example.com']) for i in range(count)]
+
+    def send(self, mailer, messages):
+        return self.send_with(mailer, messages)
+
+    def send_with(self, mailer, messages, on_batch=None):
+        try:
+            return mailer.send(messages, on_batch=on_batch)
+        finally:
+            mailer.close()
+
+    def test_messages_share_one_connection(self):
+        self.assertEqual(self.send(Mailer(batch_size=4), self.messages(10)), 10)
+
+        self.assertEqual(self.sink.connections, 1)
+        self.assertEqual(len(self.sink.messages), 10)
+
+    def test_reconnects_without_resending(self):
+        self.sink.disconnect_after = 3
+
+        self.assertEqual(self.send(Mailer(batch_size=5), self.messages(7)), 7)
+
+        self.assertEqual(self.sink.connections, 3)
+        self.assertEqual(sorted(recipients[0] for recipients, _ in self.sink.messages),
+                         sorted(f'user{i}@example.com' for i in range(7)))
+
+    def test_delivered_messages_reported_when_batch_fails(self):
+        self.sink.disconnect_after = 2
+        reported = []
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            self.send_with(Mailer(batch_size=5, retries=0), self.messages(4),
+                           lambda delivered, rejected: reported.append((len(delivered), len(rejected))))
+
+        self.assertEqual(reported, [(2, 0)])
+
+    def test_batch_timings_recorded(self):
+        mailer = Mailer(batch_size=3)
+
+        self.send(mailer, self.messages(7))
+
+        self.assertEqual([size for size, _ in mailer.batch_timings], [3, 3, 1])
+
+    def test_rate_limit(self):
+        started = time.perf_counter()
+        self.send(Mailer(batch_size=5, rate_limit=50), self.messages(10))
+
+        self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+
+
+Notification = namedtuple('Notification', 'email city_id city_name user_id', defaults=(None,))
+
+
+class BulletinMessagesTest(SimpleTestCase):
+    def test_one_message_per_city_and_batch(self):
+        notifications = [Notification(f'kyiv{i}@example.com', 1, 'Kyiv') for i in range(5)]
+        notifications += [Notification('lviv@example.com', 2, 'Lviv')]
+
+        messages = list(bulletin_messages(notifications, {1: 'Сонячно', 2: 'Дощ'}, bcc_size=2))
+
+        self.assertEqual([len(message.bcc) for message in messages], [2, 2, 1, 1])
+        self.assertEqual([message.body for message in messages], ['Сонячно'] * 3 + ['Дощ'])
+        self.assertNotIn('kyiv0@example.com', messages[0].message().as_string())
+
+    def test_users_without_email_skipped(self):
+        notifications = [Notification('', 1, 'Kyiv'), Notification('kyiv@example.com', 1, 'Kyiv')]
+
+        messages = list(bulletin_messages(notifications, {1: 'Сонячно'}))
+
+        self.assertEqual([message.bcc for message in messages], [['kyiv@example.com']])
+
+    def test_city_without_bulletin_skipped(self):
+        notifications = [Notification('kyiv@example.com', 1, 'Kyiv'), Notification('lviv@example.com', 2, 'Lviv')]
+
+        messages = list(bulletin_messages(notifications, {2: 'Дощ'}))
+
+        self.assertEqual([message.bcc for message in messages], [['lviv@example.com']])
+
+
+class DigestMessagesTest(SimpleTestCase):
+    def test_one_message_per_user(self):
+        notifications = [
+            Notification('anna@example.com', 2, 'Lviv', 1),
+            Notification('petro@example.com', 1, 'Kyiv', 2),
+            Notification('anna@example.com', 1, 'Kyiv', 1),
+            Notification('anna@example.com', 3, 'Odesa', 1),
+        ]
+
+        messages, single = digest_messages(notifications, {1: 'Сонячно', 2: 'Дощ'})
+
+        message, = messages
+        self.assertEqual(message.to, ['anna@example.com'])
+        self.assertEqual(message.subject, 'Погода: Kyiv, Lviv')
+        self.assertEqual(message.body, 'Сонячно\nДощ')
+        self.assertEqual(len(message.notifications), 2)
+        self.assertEqual(single, [notifications[1]])
+
+    def test_users_without_email_skipped(self):
+        notifications = [Notification('', 1, 'Kyiv', 1), Notification('', 2, 'Lviv', 1)]
+
+        self.assertEqual(digest_messages(notifications, {1: 'Сонячно', 2: 'Дощ'}), ([], []))
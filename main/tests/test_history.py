@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.test import TestCase, override_settings
+from main.history import downsample, history
+from main.models import City, Observation, ObservationAggregate
+
+NOW = datetime(2026, 3, 20, 12, 0, tzinfo=dt_timezone.utc)
+
+
+def observe(city, ob_time, temp, **fields):
+    values = dict(app_temp=temp, pres=1000, wind_spd=2, wind_cdir_full='north', rh=50, vis=10, uv=1)
+    values.update(fields)
+    return Observation.objects.create(city=city, ob_time=ob_time, temp=temp, **values)
+
+
+@override_settings(OBSERVATION_RAW_RETENTION_DAYS=7, OBSERVATION_HOURLY_RETENTION_DAYS=30)
+class DownsampleTest(TestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Kyiv')
+        self.old = datetime(2026, 3, 1, 10, 0, tzinfo=dt_timezone.utc)
+
+    def test_old_observations_rolled_up_hourly(self):
+        observe(self.city, self.old, 10, wind_spd=1)
+        observe(self.city, self.old + timedelta(minutes=30), 14, wind_spd=5)
+        observe(self.city, self.old + timedelta(hours=1), 20)
+        recent = observe(self.city, NOW - timedelta(days=1), 5)
+
+        self.assertEqual(downsample(NOW), (2, 0))
+
+        first, second = ObservationAggregate.objects.order_by('start')
+        self.assertEqual((first.resolution, first.start, first.samples), ('hour', self.old, 2))
+        self.assertEqual((first.temp_avg, first.temp_min, first.temp_max, first.wind_spd_max), (12, 10, 14, 5))
+        self.assertEqual((second.start, second.samples, second.temp_avg), (self.old + timedelta(hours=1), 1, 20))
+        self.assertEqual(list(Observation.objects.all()), [recent])
+
+    def test_latest_observation_of_a_city_kept(self):
+        latest = observe(self.city, self.old, 10)
+        self.city.latest_observation = latest
+        self.city.save()
+
+        self.assertEqual(downsample(NOW), (0, 0))
+        self.assertTrue(Observation.objects.filter(id=latest.id).exists())
+
+    def test_late_observation_merged_into_existing_bucket(self):
+        observe(self.city, self.old, 10)
+        downsample(NOW)
+        observe(self.city, self.old + timedelta(minutes=20), 16, uv=7)
+
+        downsample(NOW)
+
+        aggregate = ObservationAggregate.objects.get()
+        self.assertEqual((aggregate.samples, aggregate.temp_avg, aggregate.temp_max, aggregate.uv_max), (2, 13, 16, 7))
+
+    def test_old_hourly_aggregates_rolled_up_daily(self):
+        day = datetime(2026, 1, 10, tzinfo=dt_timezone.utc)
+        for hour, minute, temp in ((1, 0, 10), (1, 20, 10), (1, 40, 10), (5, 0, 30)):
+            observe(self.city, day + timedelta(hours=hour, minutes=minute), temp)
+
+        self.assertEqual(downsample(NOW), (2, 1))
+
+        aggregate = ObservationAggregate.objects.get()
+        self.assertEqual((aggregate.resolution, aggregate.start, aggregate.samples), ('day', day, 4))
+        self.assertEqual((aggregate.temp_avg, aggregate.temp_min, aggregate.temp_max), (15, 10, 30))
+        self.assertFalse(Observation.objects.exists())
+
+    def test_repeated_run_writes_nothing(self):
+        observe(self.city, self.old, 10)
+        downsample(NOW)
+
+        self.assertEqual(downsample(NOW), (0, 0))
+
+
+class HistoryTest(TestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Kyiv')
+        self.hour = datetime(2026, 3, 19, 9, 0, tzinfo=dt_timezone.utc)
+
+    def test_raw_history_limited_to_range(self):
+        observe(self.city, self.hour - timedelta(hours=1), 1)
+        inside = observe(self.city, self.hour, 2)
+        observe(self.city, self.hour + timedelta(hours=1), 3)
+
+        self.assertEqual(history(self.city.id, 'raw', self.hour, self.hour + timedelta(hours=1)), [inside])
+
+    def test_hourly_history_combines_stored_and_recent_rows(self):
+        ObservationAggregate.objects.create(
+            city=self.city, resolution='hour', start=self.hour, samples=3, temp_avg=10, temp_min=8, temp_max=12,
+            app_temp_avg=10, pres_avg=1000, wind_spd_avg=2, wind_spd_max=3, rh_avg=50, vis_avg=10, uv_max=1,
+        )
+        observe(self.city, self.hour + timedelta(minutes=30), 14)
+        observe(self.city, self.hour + timedelta(hours=1), 20)
+
+        first, second = history(self.city.id, 'hour', self.hour, self.hour + timedelta(hours=2))
+
+        self.assertEqual((first.start, first.samples, first.temp_avg, first.temp_max), (self.hour, 4, 11, 14))
+        self.assertEqual((second.start, second.samples, second.temp_avg), (self.hour + timedelta(hours=1), 1, 20))
+
+    def test_daily_history_of_recent_observations(self):
+        observe(self.city, self.hour, 10)
+        observe(self.city, self.hour + timedelta(hours=2), 20)
+
+        (day,) = history(self.city.id, 'day', self.hour - timedelta(hours=9), self.hour + timedelta(hours=15))
+
+        self.assertEqual((day.start, day.samples, day.temp_avg), (self.hour - timedelta(hours=9), 2, 15))
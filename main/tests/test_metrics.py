@@ -0,0 +1,114 @@
+import logging
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from main.instrumentation import TaskStats, log_event
+from main.metrics import Counter, Histogram, REGISTRY, render_prometheus
+from main.models import City
+
+
+class CounterTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = Counter('test_total', 'Test events.')
+        self.addCleanup(REGISTRY.pop, 'test_total')
+
+    def test_every_label_set_sampled_once(self):
+        self.counter.inc(minute=5)
+        self.counter.inc(minute=6)
+        self.counter.inc(2, minute=5)
+
+        samples = sorted(self.counter.samples(), key=lambda sample: sample[0]['minute'])
+        self.assertEqual(samples, [({'minute': 5}, 3), ({'minute': 6}, 1)])
+
+    def test_known_label_set_not_registered_again(self):
+        self.counter.inc(minute=5)
+
+        with mock.patch('main.metrics.cache', wraps=cache) as spy:
+            self.counter.inc(minute=5)
+
+        self.assertEqual([call[0] for call in spy.method_calls], ['add', 'incr'])
+
+
+class HistogramTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.histogram = Histogram('test_seconds', 'Test latencies.', buckets=(0.1, 1))
+        self.addCleanup(REGISTRY.pop, 'test_seconds')
+
+    def test_observations_buffered_until_flushed(self):
+        self.histogram.observe(0.05, stage='fetch')
+        self.assertEqual(self.histogram.value(stage='fetch')['count'], 0)
+
+        self.histogram.observe(0.5, stage='fetch')
+        self.histogram.observe(5, stage='fetch')
+        self.histogram.flush()
+
+        value = self.histogram.value(stage='fetch')
+        self.assertEqual(value['buckets'], [(0.1, 1), (1, 2), (float('inf'), 3)])
+        self.assertEqual(value['count'], 3)
+        self.assertAlmostEqual(value['sum'], 5.55)
+
+    def test_rendered_in_prometheus_format(self):
+        self.histogram.observe(0.5, stage='fetch')
+        self.histogram.flush()
+
+        lines = render_prometheus().splitlines()
+
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="0.1"} 0', lines)
+        self.assertIn('test_seconds_bucket{stage="fetch",le="+Inf"} 1', lines)
+        self.assertIn('test_seconds_count{stage="fetch"} 1', lines)
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_task_queries_and_stages_collected(self):
+        stats = TaskStats('test_task')
+        with stats.count_queries():
+            with stats.stage('query'):
+                list(City.objects.all())
+                City.objects.count()
+
+        summary = stats.finish()
+
+        self.assertEqual(summary['queries'], 2)
+        self.assertEqual(set(summary['stages']), {'query'})
+        self.assertEqual(REGISTRY['task_db_queries_total'].value(task='test_task'), 2)
+        self.assertEqual(REGISTRY['dispatch_stage_seconds'].value(task='test_task', stage='query')['count'], 1)
+
+    def test_events_sampled(self):
+        with self.assertLogs('main', level='INFO') as logs, \
+                mock.patch('main.instrumentation.random.random', side_effect=[0.5, 0.005]):
+            log_event(logging.getLogger('main.tests'), 'notification', 0.01, user_id=1)
+            log_event(logging.getLogger('main.tests'), 'notification', 0.01, user_id=2)
+
+        self.assertEqual([record.fields for record in logs.records], [{'user_id': 2}])
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('metrics')
+        Counter('test_requests_total', 'Test requests.').inc(3, view='cities')
+        self.addCleanup(REGISTRY.pop, 'test_requests_total')
+
+    def test_scraped_with_token(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('test_requests_total{view="cities"} 3', response.content.decode().splitlines())
+
+    def test_staff_allowed(self):
+        User.objects.create_user(username='admin', password='adminpassword', is_staff=True)
+        self.client.login(username='admin', password='adminpassword')
+
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_others_forbidden(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
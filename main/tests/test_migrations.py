@@ -0,0 +1,88 @@
+from datetime import datetime, timezone as dt_timezone
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Migrate back to `migrate_from`, let the test seed rows, then migrate to `migrate_to`.
+    """
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('main', self.migrate_from)])
+        self.apps = executor.loader.project_state([('main', self.migrate_from)]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('main', self.migrate_to)])
+        return executor.loader.project_state([('main', self.migrate_to)]).apps
+
+
+class CityKeyMigrationTest(MigrationTestCase):
+    migrate_from = '0006_delivery_ledger'
+    migrate_to = '0008_city_key_unique'
+
+    def test_duplicate_cities_merged(self):
+        City = self.apps.get_model('main', 'City')
+        Subscription = self.apps.get_model('main', 'Subscription')
+        Observation = self.apps.get_model('main', 'Observation')
+        kept = City.objects.create(name='Kyiv')
+        duplicate = City.objects.create(name=' KYÏV ')
+        subscription = Subscription.objects.create(city=duplicate, notification_period=3)
+        weather = dict(temp=1, app_temp=1, pres=1000, wind_spd=1, rh=50, vis=10, uv=1)
+        first, second = (datetime(2026, 3, 1, hour, tzinfo=dt_timezone.utc) for hour in (9, 10))
+        Observation.objects.create(city=kept, ob_time=first, **weather)
+        Observation.objects.create(city=duplicate, ob_time=first, **weather)
+        moved = Observation.objects.create(city=duplicate, ob_time=second, **weather)
+
+        apps = self.migrate()
+
+        City = apps.get_model('main', 'City')
+        self.assertEqual(list(City.objects.values_list('id', 'key')), [(kept.id, 'kyiv')])
+        self.assertEqual(apps.get_model('main', 'Subscription').objects.get(id=subscription.id).city_id, kept.id)
+        observations = apps.get_model('main', 'Observation').objects.order_by('ob_time')
+        self.assertEqual([(row.city_id, row.ob_time) for row in observations], [(kept.id, first), (kept.id, second)])
+        self.assertEqual(observations.last().id, moved.id)
+
+
+class SharedSubscriptionsMigrationTest(MigrationTestCase):
+    migrate_from = '0008_city_key_unique'
+    migrate_to = '0010_subscription_unique_schedule'
+
+    def test_duplicate_schedules_merged(self):
+        User = self.apps.get_model('auth', 'User')
+        City = self.apps.get_model('main', 'City')
+        Subscription = self.apps.get_model('main', 'Subscription')
+        UserSubscriptions = self.apps.get_model('main', 'UserSubscriptions')
+        Delivery = self.apps.get_model('main', 'Delivery')
+        city = City.objects.create(name='Kyiv', key='kyiv')
+        early, late = (datetime(2026, 3, 1, hour, tzinfo=dt_timezone.utc) for hour in (9, 10))
+        kept = Subscription.objects.create(city=city, notification_period=3, next_due_at=late)
+        duplicate = Subscription.objects.create(city=city, notification_period=3, next_due_at=early)
+        other = Subscription.objects.create(city=city, notification_period=5, next_due_at=late)
+        both, one = (User.objects.create(username=name) for name in ('both', 'one'))
+        UserSubscriptions.objects.create(user=both).subscriptions.add(kept, duplicate)
+        UserSubscriptions.objects.create(user=one).subscriptions.add(duplicate, other)
+        Delivery.objects.create(subscription=kept, user=both, due_at=early, status='sent')
+        Delivery.objects.create(subscription=duplicate, user=both, due_at=early, status='sent')
+        moved = Delivery.objects.create(subscription=duplicate, user=one, due_at=early, status='sent')
+
+        apps = self.migrate()
+
+        Subscription = apps.get_model('main', 'Subscription')
+        self.assertEqual(list(Subscription.objects.order_by('id').values_list('id', flat=True)), [kept.id, other.id])
+        self.assertEqual(Subscription.objects.get(id=kept.id).next_due_at, early)
+        through = apps.get_model('main', 'UserSubscriptions').subscriptions.through
+        links = set(through.objects.values_list('usersubscriptions__user__username', 'subscription_id'))
+        self.assertEqual(links, {('both', kept.id), ('one', kept.id), ('one', other.id)})
+        deliveries = apps.get_model('main', 'Delivery').objects
+        self.assertEqual(deliveries.count(), 2)
+        self.assertEqual(deliveries.get(id=moved.id).subscription_id, kept.id)
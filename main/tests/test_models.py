@@ -1,7 +1,12 @@
+from datetime import datetime, timedelta
+from io import StringIO
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.core.validators import MinValueValidator
-from django.test import TestCase
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 from ..models import City, Subscription, UserSubscriptions
 
 
@@ -72,6 +77,72 @@ class SubscriptionModelTest(TestCase):
             subscription.full_clean()
 
 
+    def test_next_due_at_set_on_create(self):
+        subscription = Subscription.objects.create(city=self.city, notification_period=self.valid_notification_period)
+        self.assertIsNotNone(subscription.next_due_at)
+        self.assertGreaterEqual(subscription.next_due_at, timezone.now() - timedelta(seconds=1))
+
+    def test_first_due_at_keeps_hours_aligned_to_midnight(self):
+        now = timezone.make_aware(datetime(2023, 7, 20, 10, 15))
+        self.assertEqual(Subscription.first_due_at(3, now), timezone.make_aware(datetime(2023, 7, 20, 12)))
+        self.assertEqual(Subscription.first_due_at(1.5, now), timezone.make_aware(datetime(2023, 7, 20, 10, 30)))
+
+    def test_next_due_after_skips_missed_slots(self):
+        due_at = timezone.make_aware(datetime(2023, 7, 20, 9))
+        now = timezone.make_aware(datetime(2023, 7, 20, 13, 30))
+        self.assertEqual(Subscription.next_due_after(due_at, 2, now), timezone.make_aware(datetime(2023, 7, 20, 15)))
+
+    def test_no_dispatch_offset_by_default(self):
+        self.assertEqual(Subscription.dispatch_offset(self.city.id, 3), timedelta())
+
+    @override_settings(DISPATCH_SPREAD_MINUTES=60)
+    def test_dispatch_offsets_spread_across_hour(self):
+        offsets = [Subscription.dispatch_offset(city_id, period) for city_id in range(100) for period in (1, 3, 6)]
+
+        self.assertTrue(all(timedelta() <= offset < timedelta(hours=1) for offset in offsets))
+        self.assertGreater(len(set(offsets)), 50)
+        self.assertEqual(Subscription.dispatch_offset(7, 3), Subscription.dispatch_offset(7, 3))
+
+    def test_first_due_at_with_offset(self):
+        now = timezone.make_aware(datetime(2023, 7, 20, 10, 15))
+        self.assertEqual(
+            Subscription.first_due_at(3, now, timedelta(minutes=20)),
+            timezone.make_aware(datetime(2023, 7, 20, 12, 20)),
+        )
+        self.assertEqual(
+            Subscription.first_due_at(1, now, timedelta(minutes=20)),
+            timezone.make_aware(datetime(2023, 7, 20, 10, 20)),
+        )
+
+    def test_one_subscription_per_schedule(self):
+        Subscription.objects.create(city=self.city, notification_period=3)
+
+        with self.assertRaises(IntegrityError):
+            Subscription.objects.create(city=self.city, notification_period=3)
+
+    def test_for_schedules_shares_existing_and_creates_missing(self):
+        existing = Subscription.objects.create(city=self.city, notification_period=3)
+
+        with self.assertNumQueries(3):
+            subscriptions = Subscription.for_schedules([(self.city.id, 3), (self.city.id, 6), (self.city.id, 6)])
+        with self.assertNumQueries(1):
+            again = Subscription.for_schedules([(self.city.id, 3.0), (self.city.id, 6)])
+
+        self.assertEqual(subscriptions[self.city.id, 3], existing)
+        self.assertIsNotNone(subscriptions[self.city.id, 6].next_due_at)
+        self.assertEqual(again, subscriptions)
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_backfill_next_due_at(self):
+        Subscription.objects.create(city=self.city, notification_period=2)
+        Subscription.objects.create(city=self.city, notification_period=1.5)
+        Subscription.objects.update(next_due_at=None)
+
+        call_command('backfill_next_due_at', stdout=StringIO())
+
+        self.assertFalse(Subscription.objects.filter(next_due_at__isnull=True).exists())
+
+
 class UserSubscriptionsModelTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -0,0 +1,96 @@
+import smtplib
+import threading
+from collections import namedtuple
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from main.models import Delivery
+from main.pipeline import Pipeline
+from main.testing import WeatherbitStub
+from main.weather import observations
+
+Notification = namedtuple(
+    'Notification',
+    'subscription_id user_id email city_id city_name city_lat city_lon next_due_at notification_period digest',
+    defaults=(False,),
+)
+
+
+def notification(i, city_id=1, email=True):
+    return Notification(i, i, f'user{i}@example.com' if email else '', city_id, f'City {city_id}', None, None, None, 1)
+
+
+class FakeMailer:
+    def __init__(self, release=None, fail=False):
+        self.release = release
+        self.fail = fail
+        self.sent = []
+
+    def send(self, messages, on_batch=None):
+        count = 0
+        for message in messages:
+            if self.release is not None:
+                self.release.wait()
+            if self.fail:
+                raise smtplib.SMTPServerDisconnected('Connection lost')
+            self.sent.append(message)
+            on_batch([message], [])
+            count += len(message.recipients())
+        return count
+
+
+class PipelineTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        self.recorded = []
+        stub = WeatherbitStub()
+        stub.__enter__()
+        self.addCleanup(stub.__exit__)
+        settings_override = override_settings(WEATHER_API_URL=stub.url, EMAIL_BCC_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def record(self, notifications, status):
+        self.recorded += [(item.subscription_id, status) for item in notifications]
+
+    def test_every_notification_delivered_or_skipped(self):
+        mailers = [FakeMailer(), FakeMailer()]
+        blocks = [[notification(i, city_id=i // 4) for i in range(start, start + 4)] for start in range(0, 20, 4)]
+        blocks[0][0] = notification(0, email=False)
+
+        sent = Pipeline(mailers, self.record, queue_size=2).run(blocks)
+
+        self.assertEqual(sent, 19)
+        self.assertEqual(sorted(self.recorded), [(0, Delivery.SKIPPED)] + [(i, Delivery.SENT) for i in range(1, 20)])
+        self.assertTrue(all(mailer.sent for mailer in mailers))
+
+    def test_slow_sender_holds_back_the_reader(self):
+        release = threading.Event()
+        read = []
+
+        def blocks():
+            for i in range(100):
+                read.append(i)
+                yield [notification(i)]
+
+        pipeline = Pipeline([FakeMailer(release)], self.record, queue_size=2)
+        runner = threading.Thread(target=pipeline.run, args=(blocks(),))
+        runner.start()
+        release.wait(0.5)
+        read_while_blocked = len(read)
+        release.set()
+        runner.join()
+
+        self.assertLess(read_while_blocked, 12)
+        self.assertEqual(len(self.recorded), 100)
+
+    def test_sender_error_raised_after_stages_stop(self):
+        unread = iter(range(100))
+        blocks = ([notification(i)] for i in unread)
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            Pipeline([FakeMailer(fail=True)], self.record, queue_size=2).run(blocks)
+
+        self.assertEqual(self.recorded, [])
+        # Reading stopped once the sender failed.
+        self.assertTrue(list(unread))
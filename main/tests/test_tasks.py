@@ -0,0 +1,300 @@
+import smtplib
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from main.benchmarks.data import generate
+from main.delivery import Mailer, mailers
+from main import ledger
+from main.models import City, Delivery, DispatchRun, Subscription, UserSubscriptions
+from main.pipeline import Pipeline
+from main.planner import advance, due_notifications, due_shards
+from main.tasks import SENT, send_chunk, time_check, total_sent
+from main.testing import SMTPSink, WeatherbitStub
+from main.weather import observations, render_weather
+from weatherreminder.celery import app
+
+
+class DueNotificationsTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpassword')
+        self.city = City.objects.create(name='Kyiv')
+        self.due = Subscription.objects.create(
+            city=self.city, notification_period=3, next_due_at=self.now - timedelta(minutes=1)
+        )
+        self.not_due = Subscription.objects.create(
+            city=self.city, notification_period=5, next_due_at=self.now + timedelta(minutes=1)
+        )
+        self.fractional = Subscription.objects.create(
+            city=self.city, notification_period=1.5, next_due_at=self.now - timedelta(hours=2)
+        )
+        user_subscriptions = UserSubscriptions.objects.create(user=self.user)
+        user_subscriptions.subscriptions.add(self.due, self.not_due, self.fractional)
+
+    def test_only_due_subscriptions_selected(self):
+        due = list(due_notifications(self.now))
+
+        self.assertEqual({row.subscription_id for row in due}, {self.due.id, self.fractional.id})
+        self.assertEqual(due[0].email, self.user.email)
+        self.assertEqual(due[0].city_name, self.city.name)
+
+    def test_due_subscriptions_advanced_past_now(self):
+        advance(self.now)
+
+        self.due.refresh_from_db()
+        self.fractional.refresh_from_db()
+        self.assertEqual(self.due.next_due_at, self.now - timedelta(minutes=1) + timedelta(hours=3))
+        self.assertEqual(self.fractional.next_due_at, self.now - timedelta(hours=2) + timedelta(hours=3))
+        self.assertEqual(list(due_notifications(self.now)), [])
+
+    def test_advance_is_idempotent(self):
+        advance(self.now)
+        advance(self.now)
+
+        self.due.refresh_from_db()
+        self.assertEqual(self.due.next_due_at, self.now - timedelta(minutes=1) + timedelta(hours=3))
+
+    def test_query_count_independent_of_user_count(self):
+        generate(10)
+        with self.assertNumQueries(1):
+            small = len(list(due_notifications(self.now)))
+
+        generate(100)
+        with self.assertNumQueries(1):
+            large = len(list(due_notifications(self.now)))
+
+        self.assertGreater(large, small)
+
+    def test_due_rows_split_into_shards(self):
+        generate(5)
+        due = len(list(due_notifications(self.now)))
+
+        shards = [list(due_notifications(self.now, first, last)) for first, last in due_shards(self.now, 3)]
+
+        self.assertEqual(sum(len(shard) for shard in shards), due)
+        self.assertTrue(all(len(shard) >= 3 for shard in shards[:-1]))
+        users = [{row.user_id for row in shard} for shard in shards]
+        self.assertEqual(sum(len(shard_users) for shard_users in users), len(set().union(*users)))
+
+
+class TimeCheckTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+
+        self.city = City.objects.create(name='Lviv')
+        subscription = Subscription.objects.create(city=self.city, notification_period=1, next_due_at=timezone.now())
+        for i in range(3):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='testpassword')
+            UserSubscriptions.objects.create(user=user).subscriptions.add(subscription)
+
+    @override_settings(DISPATCH_CHUNK_SIZE=2)
+    def test_tick_split_into_chunks(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            self.assertEqual(time_check(), "Dispatched 2 chunks")
+
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(sorted(sum((message.bcc for message in mail.outbox), [])), [f'user{i}@example.com' for i in range(3)])
+        city = City.objects.select_related('latest_observation').get(id=self.city.id)
+        self.assertEqual({message.body for message in mail.outbox}, {render_weather(city.name, city.latest_observation)})
+
+    def test_bulletin_sent_once_per_city(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            self.assertEqual(time_check(), "Dispatched 1 chunks")
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(len(mail.outbox[0].bcc), 3)
+
+    def test_sends_counted_by_minute(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            time_check()
+
+        self.assertEqual(sum(value for _, value in SENT.samples()), 3)
+        self.assertEqual(len(SENT.samples()), 1)
+
+    def test_subscriptions_advanced_after_sending(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            time_check()
+            self.assertEqual(time_check(), "Sent 0 emails")
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertTrue(all(subscription.next_due_at > timezone.now() for subscription in Subscription.objects.all()))
+
+    def test_nothing_sent_when_fetch_fails(self):
+        with WeatherbitStub(failing=['Lviv']) as stub, override_settings(WEATHER_API_URL=stub.url):
+            time_check()
+
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(set(Delivery.objects.values_list('status', flat=True)), {Delivery.FAILED})
+
+    def test_failed_fetch_retried(self):
+        run = Pipeline.run
+
+        def recover(pipeline, blocks):
+            try:
+                return run(pipeline, blocks)
+            finally:
+                stub.failing.clear()
+
+        with WeatherbitStub(failing=['Lviv']) as stub, override_settings(WEATHER_API_URL=stub.url), \
+                mock.patch.object(Pipeline, 'run', recover):
+            time_check()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(len(mail.outbox[0].bcc), 3)
+        self.assertEqual(set(Delivery.objects.values_list('status', flat=True)), {Delivery.SENT})
+
+    def test_chunk_counts_aggregated(self):
+        self.assertEqual(total_sent([2, 0, 1]), "Sent 3 emails")
+
+    def test_overlapping_tick_skipped_until_callback_runs(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            # The chord is only queued, as when its shards are still being sent.
+            with mock.patch('main.tasks.chord') as queued:
+                self.assertEqual(time_check(), "Dispatched 1 chunks")
+                self.assertEqual(time_check(), "Skipped, the previous tick is still being sent")
+            self.assertEqual(queued.call_count, 1)
+
+            (shard,), = queued.call_args.args
+            callback, = queued.return_value.call_args.args
+            counts = [shard.apply().get()]
+            callback.clone(args=(counts,)).apply()
+
+            self.assertEqual(time_check(), "Sent 0 emails")
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(len(mail.outbox[0].bcc), 3)
+
+
+class DigestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+
+        now = timezone.now()
+        kyiv, lviv = (Subscription.objects.create(city=City.objects.create(name=name), notification_period=1,
+                                                  next_due_at=now) for name in ('Kyiv', 'Lviv'))
+        for i in range(2):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='testpassword')
+            UserSubscriptions.objects.create(user=user, digest=True).subscriptions.add(kyiv, lviv)
+        user = User.objects.create_user(username='single', email='single@example.com', password='testpassword')
+        UserSubscriptions.objects.create(user=user, digest=True).subscriptions.add(kyiv)
+
+    def test_due_cities_sent_as_one_email_per_user(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            time_check()
+
+        digests = [message for message in mail.outbox if message.to]
+        self.assertEqual(sorted(message.to[0] for message in digests), ['user0@example.com', 'user1@example.com'])
+        self.assertTrue(all('Kyiv' in message.body and 'Lviv' in message.body for message in digests))
+        shared, = (message for message in mail.outbox if not message.to)
+        self.assertEqual(shared.bcc, ['single@example.com'])
+        self.assertEqual(DispatchRun.objects.get().sent, 5)
+
+    def test_sent_count_reflects_digests(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            now = timezone.now()
+            self.assertEqual(send_chunk(now.isoformat(), None, None), 3)
+
+        UserSubscriptions.objects.update(digest=False)
+        Delivery.objects.all().delete()
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            self.assertEqual(send_chunk(now.isoformat(), None, None), 5)
+
+
+class DeliveryLedgerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+
+        self.now = timezone.now()
+        city = City.objects.create(name='Lviv')
+        subscription = Subscription.objects.create(city=city, notification_period=1, next_due_at=self.now)
+        for i in range(3):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='testpassword')
+            UserSubscriptions.objects.create(user=user).subscriptions.add(subscription)
+        UserSubscriptions.objects.create(user=User.objects.create_user(username='noemail')).subscriptions.add(subscription)
+
+    def test_run_summary_saved(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            time_check()
+
+        run = DispatchRun.objects.get()
+        self.assertEqual((run.sent, run.skipped, run.failed), (3, 1, 0))
+        self.assertIsNotNone(run.duration)
+        self.assertEqual(Delivery.objects.filter(run=run).count(), 4)
+
+    def test_resumed_shard_sends_only_the_rest(self):
+        notifications = list(due_notifications(self.now))
+        ledger.record([notification for notification in notifications if notification.email == 'user0@example.com'],
+                      Delivery.SENT)
+
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            self.assertEqual(send_chunk(self.now.isoformat(), None, None), 2)
+
+        self.assertEqual(sorted(mail.outbox[0].bcc), ['user1@example.com', 'user2@example.com'])
+        self.assertEqual(Delivery.objects.filter(status=Delivery.SENT).count(), 3)
+
+    def test_pending_is_one_query(self):
+        notifications = list(due_notifications(self.now))
+        ledger.record(notifications[:2], Delivery.SENT)
+        ledger.record(notifications[2:3], Delivery.FAILED)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(ledger.pending(notifications), notifications[2:])
+
+    def test_pending_reads_only_the_block_users_of_a_shared_schedule(self):
+        subscription = Subscription.objects.get()
+        for i in range(3, 30):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com')
+            UserSubscriptions.objects.create(user=user).subscriptions.add(subscription)
+        notifications = list(due_notifications(self.now))
+        ledger.record(notifications[:20], Delivery.SENT)
+
+        with mock.patch('main.ledger.set', create=True, wraps=set) as read:
+            self.assertEqual(ledger.pending(notifications[18:25]), notifications[20:25])
+
+        self.assertEqual(len(read.call_args.args[0]), 2)
+
+    @override_settings(EMAIL_BCC_SIZE=1)
+    def test_messages_sent_before_a_failure_recorded(self):
+        mailer = Mailer(retries=0)
+        with SMTPSink(disconnect_after=2) as sink, override_settings(**sink.settings()), \
+                WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url), \
+                mock.patch('main.tasks.mailers', [mailer]):
+            try:
+                with self.assertRaises(smtplib.SMTPServerDisconnected):
+                    send_chunk(self.now.isoformat(), None, None)
+            finally:
+                mailer.close()
+
+        delivered = sorted(recipients[0] for recipients, _ in sink.messages)
+        self.assertEqual(len(delivered), 2)
+        self.assertEqual(
+            sorted(Delivery.objects.filter(status=Delivery.SENT).values_list('user__email', flat=True)), delivered
+        )
+
+    @override_settings(EMAIL_BCC_SIZE=1)
+    def test_rejected_recipient_recorded_as_failed(self):
+        with SMTPSink(rejecting=['user1@example.com']) as sink, override_settings(**sink.settings()), \
+                WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            try:
+                time_check()
+            finally:
+                mailers.close()
+
+        run = DispatchRun.objects.get()
+        self.assertEqual((run.sent, run.failed), (2, 1))
+        self.assertEqual(Delivery.objects.get(status=Delivery.FAILED).user.username, 'user1')
+        self.assertEqual(len(sink.messages), 2)
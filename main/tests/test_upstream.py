@@ -0,0 +1,86 @@
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from main.upstream import BREAKER_STATE, RATE_LIMIT_WAITS, CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RateLimiter
+
+
+class RateLimiterTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_requests_within_rate_do_not_wait(self):
+        limiter = RateLimiter('test', rate=100)
+
+        self.assertEqual(sum(limiter.acquire() for _ in range(10)), 0)
+
+    def test_bucket_shared_between_limiters(self):
+        first, second = RateLimiter('test', rate=2), RateLimiter('test', rate=2)
+
+        with mock.patch('main.upstream.time.time', return_value=1000.0), \
+                mock.patch('main.upstream.time.sleep', side_effect=StopIteration) as sleep:
+            first.acquire()
+            second.acquire()
+            with self.assertRaises(StopIteration):
+                first.acquire()
+
+        sleep.assert_called_once_with(1.0)
+
+    def test_wait_recorded(self):
+        limiter = RateLimiter('test', rate=20)
+        started = time.perf_counter()
+
+        for _ in range(25):
+            limiter.acquire()
+
+        self.assertGreater(time.perf_counter() - started, 0)
+        self.assertEqual(RATE_LIMIT_WAITS.value(upstream='test'), 1)
+
+    def test_disabled_limit(self):
+        self.assertEqual(RateLimiter('test', rate=0).acquire(), 0)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', threshold=3, reset_timeout=60)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(BREAKER_STATE.value(upstream='test'), 2)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_single_probe_after_reset_timeout(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        with mock.patch('main.upstream.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.breaker.state(), HALF_OPEN)
+            self.assertTrue(self.breaker.allow())
+            self.assertFalse(CircuitBreaker('test', threshold=3, reset_timeout=60).allow())
+            self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertEqual(BREAKER_STATE.value(upstream='test'), 0)
+
+    def test_failed_probe_opens_again(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        later = time.time() + 61
+        with mock.patch('main.upstream.time.time', return_value=later):
+            self.breaker.allow()
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state(), OPEN)
@@ -1,13 +1,21 @@
+import time
+from datetime import timedelta
+from unittest import mock
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.test import APITestCase
 from rest_framework import status
-from main.models import City, Subscription, UserSubscriptions
+from main.models import City, DispatchRun, Observation, ObservationAggregate, Subscription, UserSubscriptions
 from main.serializers import SubscriptionSerializer
 
 
 class CityListViewTest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.city1 = City.objects.create(name='Tokyo', current_weather='Sunny')
         self.city2 = City.objects.create(name='London', current_weather='Rainy')
@@ -18,18 +26,132 @@ class CityListViewTest(APITestCase):
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
 
-        self.assertEqual(response.data[0]['name'], self.city1.name)
-        self.assertEqual(response.data[0]['current_weather'], self.city1.current_weather)
-        self.assertEqual(response.data[1]['name'], self.city2.name)
-        self.assertEqual(response.data[1]['current_weather'], self.city2.current_weather)
+        self.assertEqual(results[0]['name'], self.city1.name)
+        self.assertEqual(results[0]['current_weather'], self.city1.current_weather)
+        self.assertEqual(results[1]['name'], self.city2.name)
+        self.assertEqual(results[1]['current_weather'], self.city2.current_weather)
 
     def test_city_list_view_unauthenticated(self):
         response = self.client.get(self.url)
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_city_list_field_selection(self):
+        self.client.login(username='testuser', password='testpassword')
+
+        response = self.client.get(self.url, {'fields': 'id,name'})
+
+        self.assertEqual(response.data['results'][0], {'id': self.city1.id, 'name': self.city1.name})
+
+    def test_city_list_weather_rendered_from_latest_observation(self):
+        self.client.login(username='testuser', password='testpassword')
+        latest = Observation.objects.create(
+            city=self.city1, ob_time=timezone.now(), temp=30, app_temp=32, pres=1010, wind_spd=2,
+            wind_cdir_full='north', rh=40, vis=10, uv=7,
+        )
+        self.city1.latest_observation = latest
+        self.city1.save()
+
+        response = self.client.get(self.url, {'lang': 'en'})
+
+        self.assertIn("Temperature: 30°C", response.data['results'][0]['current_weather'])
+        self.assertEqual(response.data['results'][0]['weather']['temp'], 30)
+        self.assertIsNone(response.data['results'][1]['weather'])
+
+    def test_city_list_not_modified(self):
+        self.client.login(username='testuser', password='testpassword')
+        cache.set('cities:version', time.time() - 5, timeout=None)
+        first = self.client.get(self.url)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_city_list_last_modified_left_out_within_its_second(self):
+        self.client.login(username='testuser', password='testpassword')
+        cache.set('cities:version', time.time(), timeout=None)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_city_list_served_from_cache_until_city_saved(self):
+        self.client.login(username='testuser', password='testpassword')
+        first = self.client.get(self.url)
+
+        # Only the session and user lookups remain for a cached page.
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+        self.city1.current_weather = 'Cloudy'
+        self.city1.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['current_weather'], 'Cloudy')
+
+    @override_settings(ALLOWED_HOSTS=['one.example.com', 'two.example.com'])
+    def test_city_list_cached_per_host(self):
+        self.client.login(username='testuser', password='testpassword')
+        first = self.client.get(self.url, {'page_size': 1}, HTTP_HOST='one.example.com')
+
+        response = self.client.get(
+            self.url, {'page_size': 1}, HTTP_HOST='two.example.com', HTTP_IF_NONE_MATCH=first['ETag']
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(first.data['next'].startswith('http://one.example.com/'))
+        self.assertTrue(response.data['next'].startswith('http://two.example.com/'))
+
+
+class CityHistoryViewTest(APITestCase):
+    def setUp(self):
+        User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.city = City.objects.create(name='Tokyo')
+        self.url = reverse('city-history', args=[self.city.id])
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for hours_ago, temp in ((2, 10), (30, 20)):
+            Observation.objects.create(
+                city=self.city, ob_time=self.now - timedelta(hours=hours_ago), temp=temp, app_temp=temp, pres=1010,
+                wind_spd=2, wind_cdir_full='north', rh=40, vis=10, uv=7,
+            )
+        ObservationAggregate.objects.create(
+            city=self.city, resolution='hour', start=self.now - timedelta(days=3), samples=2, temp_avg=5, temp_min=4,
+            temp_max=6, app_temp_avg=5, pres_avg=1000, wind_spd_avg=2, wind_spd_max=3, rh_avg=50, vis_avg=10, uv_max=1,
+        )
+
+    def test_raw_history_of_last_day_by_default(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['resolution'], 'raw')
+        self.assertEqual([entry['temp'] for entry in response.data['results']], [10])
+
+    def test_hourly_history_includes_aggregates(self):
+        response = self.client.get(self.url, {'resolution': 'hour'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([entry['temp_avg'] for entry in response.data['results']], [5, 20, 10])
+        self.assertEqual([entry['samples'] for entry in response.data['results']], [2, 1, 1])
+
+    def test_range_too_long_rejected(self):
+        since = (self.now - timedelta(days=100)).isoformat()
+
+        response = self.client.get(self.url, {'resolution': 'hour', 'since': since})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_city(self):
+        response = self.client.get(reverse('city-history', args=[self.city.id + 1]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class SubscriptionListViewTest(APITestCase):
 
@@ -56,11 +178,39 @@ class SubscriptionListViewTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        subscriptions = Subscription.objects.filter(id__in=UserSubscriptions.objects.get(user=self.user).subscriptions.all())
-        self.assertEqual(len(response.data), subscriptions.count())
+        subscriptions = UserSubscriptions.objects.get(user=self.user).subscriptions.order_by('id')
+        self.assertEqual(len(response.data['results']), subscriptions.count())
 
         serializer = SubscriptionSerializer(subscriptions, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_user_subscriptions_list_paginated(self):
+        user_subscriptions = UserSubscriptions.objects.create(user=self.user)
+        user_subscriptions.subscriptions.add(*[
+            Subscription.objects.create(city=self.city1, notification_period=period) for period in range(4, 9)
+        ])
+
+        first = self.client.get(self.url, {'page_size': 3})
+        second = self.client.get(first.data['next'])
+
+        self.assertEqual(len(first.data['results']), 3)
+        self.assertEqual(len(second.data['results']), 2)
+        self.assertIsNone(second.data['next'])
+
+    def test_user_subscriptions_list_query_count_independent_of_subscription_count(self):
+        user_subscriptions = UserSubscriptions.objects.create(user=self.user)
+        user_subscriptions.subscriptions.add(self.subscription1)
+        # Session, user, the UserSubscriptions entry and the page of subscriptions.
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+        user_subscriptions.subscriptions.add(*[
+            Subscription.objects.create(city=self.city2, notification_period=period) for period in range(6, 26)
+        ])
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data['results']), 21)
 
     def test_user_subscriptions_list_unauthenticated(self):
         self.client.logout()
@@ -104,11 +254,252 @@ class SubscriptionRetrieveViewTest(APITestCase):
         response = self.client.put(self.url, data)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        updated_subscription = Subscription.objects.get(id=self.subscription.id)
+        updated_subscription = self.user_subscriptions.subscriptions.get()
         self.assertEqual(updated_subscription.notification_period, updated_notification_period)
+        self.assertEqual(response.data['id'], updated_subscription.id)
+
+    def test_subscription_update_moves_only_the_owner(self):
+        other = UserSubscriptions.objects.create(user=User.objects.create_user(username='otheruser'))
+        other.subscriptions.add(self.subscription)
+        shared = Subscription.objects.create(city=self.city, notification_period=5)
+
+        self.client.patch(self.url, {'notification_period': 5})
+
+        self.assertEqual(list(self.user_subscriptions.subscriptions.all()), [shared])
+        self.assertEqual(list(other.subscriptions.all()), [self.subscription])
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.notification_period, 3)
 
     def test_subscription_delete_authenticated_owner(self):
+        other = UserSubscriptions.objects.create(user=User.objects.create_user(username='otheruser'))
+        other.subscriptions.add(self.subscription)
+
         response = self.client.delete(self.url)
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertFalse(Subscription.objects.filter(id=self.subscription.id).exists())
+        self.assertFalse(self.user_subscriptions.subscriptions.exists())
+        self.assertEqual(list(other.subscriptions.all()), [self.subscription])
+
+    def test_subscription_retrieve_other_user_forbidden(self):
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        self.client.force_login(other)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_subscription_retrieve_query_count_independent_of_subscription_count(self):
+        # Session, user, subscription with its city and the ownership check.
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+        self.user_subscriptions.subscriptions.add(*[
+            Subscription.objects.create(city=self.city, notification_period=period) for period in range(4, 54)
+        ])
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SubscriptionCreateViewTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.city = City.objects.create(name='Kyiv')
+        self.url = reverse('subscribe')
+
+    def test_subscribe_by_city_id(self):
+        response = self.client.post(self.url, {'city': self.city.id, 'notification_period': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['city_name'], 'Kyiv')
+        self.assertEqual(UserSubscriptions.objects.get(user=self.user).subscriptions.get().city, self.city)
+
+    def test_subscribe_by_city_name_resolves_existing_city(self):
+        response = self.client.post(self.url, {'city_name': ' KYÏV', 'notification_period': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['city'], self.city.id)
+        self.assertEqual(City.objects.count(), 1)
+
+    def test_subscribe_by_new_city_name_creates_city(self):
+        response = self.client.post(self.url, {'city_name': 'Odesa', 'notification_period': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(City.objects.get(id=response.data['city']).name, 'Odesa')
+
+    def test_new_city_name_not_created_for_invalid_subscription(self):
+        response = self.client.post(self.url, {'city_name': 'Atlantis', 'notification_period': 0})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(City.objects.filter(name='Atlantis').exists())
+
+    def test_subscribe_without_city_rejected(self):
+        response = self.client.post(self.url, {'notification_period': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class UserSettingsViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.url = reverse('my_settings')
+
+    def test_defaults_to_separate_emails(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data, {'digest': False})
+
+    def test_digest_enabled(self):
+        response = self.client.patch(self.url, {'digest': True})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(UserSubscriptions.objects.get(user=self.user).digest)
+
+
+class DispatchRunListViewTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('dispatch_runs')
+        now = timezone.now()
+        self.runs = [DispatchRun.objects.create(tick=now, sent=i) for i in range(3)]
+
+    def test_runs_listed_newest_first_for_staff(self):
+        User.objects.create_user(username='admin', password='adminpassword', is_staff=True)
+        self.client.login(username='admin', password='adminpassword')
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([run['sent'] for run in response.data['results']], [2, 1, 0])
+
+    def test_runs_hidden_from_other_users(self):
+        User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class HealthViewTest(APITestCase):
+    def test_health_needs_no_authentication(self):
+        response = self.client.get(reverse('health'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'status': 'ok'})
+
+    def test_ready_checks_database_and_cache(self):
+        response = self.client.get(reverse('ready'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'database': 'ok', 'cache': 'ok'})
+
+    def test_ready_fails_when_cache_is_down(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            response = self.client.get(reverse('ready'))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['cache'], 'unreadable')
+
+    def test_ready_hides_backend_errors(self):
+        with mock.patch('main.views.cache') as broken, self.assertLogs('main.views', 'ERROR'):
+            broken.set.side_effect = ConnectionError('Error connecting to redis://:secret@cache:6379')
+            response = self.client.get(reverse('ready'))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json(), {'database': 'ok', 'cache': 'unavailable'})
+
+
+class SubscriptionBulkViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        self.cities = [City.objects.create(name=f'City {i}') for i in range(3)]
+        self.url = reverse('subscriptions-bulk')
+
+    def create(self, count):
+        return self.client.post(self.url, [
+            {'city': self.cities[i % 3].id, 'notification_period': i % 5 + 1} for i in range(count)
+        ], format='json')
+
+    def test_bulk_create(self):
+        response = self.create(6)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual(response.data[0]['city_name'], 'City 0')
+        owned = UserSubscriptions.objects.get(user=self.user).subscriptions.all()
+        self.assertEqual(owned.count(), 6)
+        self.assertTrue(all(subscription.next_due_at is not None for subscription in owned))
+
+    def test_bulk_create_shares_existing_subscriptions(self):
+        existing = Subscription.objects.create(city=self.cities[0], notification_period=1)
+
+        response = self.create(2)
+
+        self.assertEqual(response.data[0]['id'], existing.id)
+        self.assertEqual(Subscription.objects.count(), 2)
+
+    def test_bulk_create_query_count_independent_of_list_length(self):
+        UserSubscriptions.objects.create(user=self.user)
+        # Session, user, UserSubscriptions lookup, cities, savepoint, subscriptions lookup, insert of the
+        # missing ones, second lookup, links insert, savepoint release.
+        with self.assertNumQueries(10):
+            self.create(2)
+        with self.assertNumQueries(10):
+            self.create(50)
+
+    def test_unknown_city_rejects_whole_request(self):
+        response = self.client.post(self.url, [
+            {'city': self.cities[0].id, 'notification_period': 3},
+            {'city': 999, 'notification_period': 3},
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_bulk_update(self):
+        created = self.create(3).data
+        old = Subscription.objects.get(id=created[1]['id'])
+
+        response = self.client.patch(self.url, [
+            {'id': created[0]['id'], 'notification_period': 12},
+            {'id': created[1]['id'], 'city': self.cities[2].id},
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        owned = UserSubscriptions.objects.get(user=self.user).subscriptions
+        self.assertEqual(
+            set(owned.values_list('city', 'notification_period')),
+            {(self.cities[0].id, 12), (self.cities[2].id, old.notification_period), (self.cities[2].id, 3)},
+        )
+        self.assertEqual((response.data[0]['notification_period'], response.data[1]['city']), (12, self.cities[2].id))
+        self.assertTrue(Subscription.objects.filter(id=created[0]['id'], notification_period=1).exists())
+
+    def test_bulk_update_of_foreign_subscription_rejected(self):
+        foreign = Subscription.objects.create(city=self.cities[0], notification_period=3)
+
+        response = self.client.patch(self.url, [{'id': foreign.id, 'notification_period': 1}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.notification_period, 3)
+
+    def test_bulk_delete(self):
+        created = self.create(3).data
+        foreign = Subscription.objects.create(city=self.cities[0], notification_period=3)
+
+        rejected = self.client.delete(self.url, {'ids': [created[0]['id'], foreign.id]}, format='json')
+        response = self.client.delete(self.url, {'ids': [created[0]['id'], created[2]['id']]}, format='json')
+
+        self.assertEqual(rejected.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(UserSubscriptions.objects.get(user=self.user).subscriptions.values_list('id', flat=True)),
+                         [created[1]['id']])
+        self.assertEqual(Subscription.objects.count(), 4)
+
+    @override_settings(SUBSCRIPTION_BULK_LIMIT=5)
+    def test_list_length_limited(self):
+        self.assertEqual(self.create(6).status_code, status.HTTP_400_BAD_REQUEST)
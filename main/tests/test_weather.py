@@ -0,0 +1,206 @@
+import json
+import time
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from main.cache import cities_version
+from main.models import City, Observation
+from main.testing import RECORDED_POINTS, WeatherbitStub, observation
+from main.weather import (
+    Location, WeatherClient, collect_weather, fetch_bulletins, match_points, observations, render_weather,
+)
+
+
+class FetchBulletinsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        patcher = mock.patch('main.weather.client', WeatherClient(backoff=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cities = {City.objects.create(name=f'City {i}').id: Location(f'City {i}') for i in range(8)}
+
+    def test_each_city_fetched_once_and_stored(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            bulletins = fetch_bulletins(self.cities)
+
+        self.assertEqual(sorted(request['city'] for request in stub.requests),
+                         sorted(city.name for city in self.cities.values()))
+        self.assertEqual(set(bulletins), set(self.cities))
+        for city in City.objects.all():
+            self.assertEqual(render_weather(city.name, city.latest_observation), bulletins[city.id])
+            self.assertIn(f"Погода в {city.name}", bulletins[city.id])
+        self.assertEqual(Observation.objects.count(), len(self.cities))
+
+    def test_city_list_version_bumped(self):
+        version = cities_version()
+
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            fetch_bulletins(self.cities)
+
+        self.assertNotEqual(cities_version(), version)
+
+    def test_same_observation_stored_once(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            fetch_bulletins(self.cities)
+            observations.clear()
+            cache.clear()
+            fetch_bulletins(self.cities)
+
+        self.assertEqual(len(stub.requests), 2 * len(self.cities))
+        self.assertEqual(Observation.objects.count(), len(self.cities))
+
+    def test_failed_city_left_out(self):
+        with WeatherbitStub(failing=['City 3']) as stub, override_settings(WEATHER_API_URL=stub.url):
+            bulletins = fetch_bulletins(self.cities)
+
+        failed = City.objects.get(name='City 3')
+        self.assertNotIn(failed.id, bulletins)
+        self.assertIsNone(failed.latest_observation)
+        self.assertEqual(len(bulletins), len(self.cities) - 1)
+
+    def test_cities_fetched_in_parallel(self):
+        latency = 0.2
+        with WeatherbitStub(latency=latency) as stub, override_settings(WEATHER_API_URL=stub.url):
+            started = time.perf_counter()
+            fetch_bulletins(self.cities)
+            elapsed = time.perf_counter() - started
+
+        self.assertLess(elapsed, latency * len(self.cities) / 2)
+
+
+    def test_coordinates_stored_from_answer(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            fetch_bulletins(self.cities)
+
+        for city in City.objects.all():
+            weather = observation(city.name)
+            self.assertEqual((city.lat, city.lon), (weather['lat'], weather['lon']))
+
+
+@override_settings(WEATHER_BULK_SIZE=2)
+class BulkFetchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+        recorded = json.loads(RECORDED_POINTS.read_text())['data']
+        self.cities = {
+            City.objects.create(name=weather['city_name'], lat=weather['lat'], lon=weather['lon']).id:
+                Location(weather['city_name'], weather['lat'], weather['lon'])
+            for weather in recorded
+        }
+
+    def test_located_cities_fetched_in_batches(self):
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            bulletins = fetch_bulletins(self.cities)
+
+        self.assertEqual(len(stub.requests), 2)
+        self.assertTrue(all('points' in request for request in stub.requests))
+        for city_id, city in self.cities.items():
+            self.assertIn(f"Погода в {city.name}", bulletins[city_id])
+        self.assertEqual(City.objects.get(name='Lviv').latest_observation.temp, 16.9)
+
+    def test_unlocated_city_fetched_by_name_then_in_bulk(self):
+        city_id = City.objects.create(name='Kharkiv').id
+        cities = {**self.cities, city_id: Location('Kharkiv')}
+
+        with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+            fetch_bulletins(cities)
+            self.assertEqual(sorted('city' in request for request in stub.requests), [False, False, True])
+
+            city = City.objects.get(id=city_id)
+            cities[city_id] = Location(city.name, city.lat, city.lon)
+            observations.clear()
+            cache.clear()
+            stub.requests.clear()
+            fetch_bulletins(cities)
+
+        self.assertEqual(len(stub.requests), 2)
+        self.assertTrue(all('points' in request for request in stub.requests))
+
+
+class WeatherClientTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        observations.clear()
+
+    def test_failed_request_retried(self):
+        client = WeatherClient(retries=2, backoff=0)
+
+        with WeatherbitStub(failing=['Kyiv']) as stub, override_settings(WEATHER_API_URL=stub.url):
+            self.assertIsNone(client.get({'city': 'Kyiv'}))
+
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_hung_request_times_out(self):
+        client = WeatherClient(read_timeout=0.1, retries=0)
+
+        with WeatherbitStub(latency=1) as stub, override_settings(WEATHER_API_URL=stub.url):
+            started = time.perf_counter()
+            self.assertIsNone(client.get({'city': 'Kyiv'}))
+            elapsed = time.perf_counter() - started
+
+        self.assertLess(elapsed, 0.5)
+
+    @override_settings(WEATHER_BREAKER_THRESHOLD=2)
+    def test_open_breaker_stops_requests(self):
+        client = WeatherClient(retries=0)
+
+        with WeatherbitStub(failing=['Kyiv']) as stub, override_settings(WEATHER_API_URL=stub.url):
+            for _ in range(4):
+                client.get({'city': 'Kyiv'})
+            self.assertIsNone(client.get({'city': 'Lviv'}))
+
+        self.assertEqual(len(stub.requests), 2)
+
+    @override_settings(WEATHER_BREAKER_THRESHOLD=1)
+    def test_open_breaker_falls_back_to_last_observation(self):
+        cities = {1: Location('Kyiv'), 2: Location('Lviv')}
+        with mock.patch('main.weather.client', WeatherClient(retries=0)):
+            with WeatherbitStub() as stub, override_settings(WEATHER_API_URL=stub.url):
+                collect_weather(cities)
+
+            future = time.time() + observations.ttl + observations.stale_ttl + 1
+            with WeatherbitStub(failing=['Kyiv', 'Lviv']) as stub, override_settings(WEATHER_API_URL=stub.url), \
+                    mock.patch('main.cache.time.time', return_value=future):
+                collect_weather(cities)
+                failed_requests = len(stub.requests)
+                weather = collect_weather(cities)
+
+        self.assertEqual(len(stub.requests), failed_requests)
+        self.assertEqual({city_id: data['city_name'] for city_id, data in weather.items()}, {1: 'Kyiv', 2: 'Lviv'})
+        self.assertEqual(observations.stats()['fallbacks'], 4)
+
+
+class MatchPointsTest(SimpleTestCase):
+    def test_observations_matched_to_nearest_city(self):
+        recorded = json.loads(RECORDED_POINTS.read_text())['data']
+        cities = {1: Location('Kyiv', 50.45, 30.52), 2: Location('Lviv', 49.84, 24.03), 3: Location('Odesa', 46.48, 30.74)}
+
+        matched = match_points(cities, recorded)
+
+        self.assertEqual({city_id: weather['city_name'] for city_id, weather in matched.items()},
+                         {1: 'Kyiv', 2: 'Lviv', 3: 'Odesa'})
+
+    def test_missing_observation_leaves_city_out(self):
+        recorded = json.loads(RECORDED_POINTS.read_text())['data']
+        cities = {1: Location('Kyiv', 50.45, 30.52), 2: Location('Lviv', 49.84, 24.03)}
+
+        matched = match_points(cities, [recorded[1]])
+
+        self.assertEqual(list(matched), [1])
+
+
+class RenderWeatherTest(TestCase):
+    def setUp(self):
+        self.observation = Observation.from_weatherbit(None, observation('Kyiv'))
+
+    def test_bulletin_rendered_in_ukrainian_by_default(self):
+        bulletin = render_weather('Kyiv', self.observation)
+
+        self.assertIn("Погода в Kyiv", bulletin)
+        self.assertIn("Вологість повітря: 64%", bulletin)
+        self.assertIn("Час останнього спостереження: 2023-07-20 12:00", bulletin)
+
+    def test_bulletin_rendered_in_english(self):
+        self.assertIn("Weather in Kyiv", render_weather('Kyiv', self.observation, 'en'))
@@ -0,0 +1,126 @@
+import math
+import time
+from django.core.cache import cache
+from main.metrics import Counter, Gauge
+
+RATE_LIMIT_WAITS = Counter('upstream_rate_limit_waits_total', 'Upstream requests that had to wait for the rate limiter.')
+RATE_LIMIT_WAIT_MS = Counter(
+    'upstream_rate_limit_wait_milliseconds_total', 'Time spent waiting for the rate limiter, in milliseconds.'
+)
+BREAKER_STATE = Gauge('upstream_circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.')
+BREAKER_REJECTIONS = Counter('upstream_circuit_breaker_rejections_total', 'Requests refused by an open circuit breaker.')
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class RateLimiter:
+    """
+    A token bucket shared by every process through the Django cache.
+
+    The bucket holds `rate` tokens per second, refilled in whole windows of
+    at least a second, so the request rate of all Celery workers together
+    stays within the upstream quota. Taking a token is a single atomic
+    increment of the current window's counter. When the window is used up,
+    the caller sleeps until the next one.
+
+    Args:
+        name (str): The name of the bucket, also used as the metrics label.
+        rate (float): Requests allowed per second, 0 disables the limit.
+    """
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.rate = rate
+        self.period = max(1.0, 1 / rate) if rate else 0
+        self.capacity = max(1, int(rate * self.period)) if rate else 0
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty.
+
+        Returns:
+            float: The seconds spent waiting.
+        """
+        if not self.rate:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            now = time.time()
+            window = int(now // self.period)
+            key = f'ratelimit:{self.name}:{window}'
+            cache.add(key, 0, timeout=math.ceil(self.period) + 1)
+            if cache.incr(key) <= self.capacity:
+                break
+            delay = (window + 1) * self.period - now
+            time.sleep(delay)
+            waited += delay
+
+        if waited:
+            RATE_LIMIT_WAITS.inc(upstream=self.name)
+            RATE_LIMIT_WAIT_MS.inc(round(waited * 1000), upstream=self.name)
+        return waited
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream that keeps failing, for every process at once.
+
+    After `threshold` consecutive failures the breaker opens and callers
+    are refused for `reset_timeout` seconds. After that a single caller is
+    let through as a probe: its success closes the breaker, its failure
+    opens it again. The state lives in the Django cache, so one worker's
+    failures spare the others from piling onto the same outage.
+
+    Args:
+        name (str): The name of the upstream, also used as the metrics label.
+        threshold (int): Consecutive failures that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a probe.
+    """
+
+    def __init__(self, name, threshold, reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+    def _key(self, suffix):
+        return f'breaker:{self.name}:{suffix}'
+
+    def state(self):
+        opened_at = cache.get(self._key('opened_at'))
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def allow(self):
+        """
+        Return whether a request may be sent upstream now.
+        """
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and cache.add(self._key('probe'), 1, timeout=math.ceil(self.reset_timeout) or None):
+            self._report(HALF_OPEN)
+            return True
+        BREAKER_REJECTIONS.inc(upstream=self.name)
+        return False
+
+    def record_success(self):
+        if cache.get(self._key('opened_at')) is not None:
+            cache.delete_many([self._key('opened_at'), self._key('probe')])
+            self._report(CLOSED)
+        cache.delete(self._key('failures'))
+
+    def record_failure(self):
+        key = self._key('failures')
+        cache.add(key, 0, timeout=None)
+        if cache.incr(key) >= self.threshold or self.state() == HALF_OPEN:
+            cache.set(self._key('opened_at'), time.time(), timeout=None)
+            cache.delete(self._key('probe'))
+            self._report(OPEN)
+
+    def _report(self, state):
+        BREAKER_STATE.set(STATE_VALUES[state], upstream=self.name)
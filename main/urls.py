@@ -6,9 +6,16 @@ from . import views
 
 urlpatterns = [
     path('api/cities/', views.CityListView.as_view(), name='cities'),
+    path('api/cities/<int:pk>/history/', views.CityHistoryView.as_view(), name='city-history'),
     path('api/my_subscriptions/', views.SubscriptionListView.as_view(), name='my_subscriptions'),
+    path('api/my_subscriptions/bulk/', views.SubscriptionBulkView.as_view(), name='subscriptions-bulk'),
     path('api/my_subscriptions/<int:pk>/', views.SubscriptionRetrieveView.as_view(), name='subscription-detail'),
     path('api/subscribe/',  views.SubscriptionCreateView.as_view(), name='subscribe'),
+    path('api/my_settings/', views.UserSettingsView.as_view(), name='my_settings'),
+    path('api/dispatch_runs/', views.DispatchRunListView.as_view(), name='dispatch_runs'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('health', views.health_view, name='health'),
+    path('ready', views.ready_view, name='ready'),
 
     path('api/auth/', include('djoser.urls')),
     path('api/auth/', include('djoser.urls.jwt')),
@@ -1,9 +1,28 @@
+import hashlib
+import logging
+import math
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from .models import City, UserSubscriptions, Subscription
+from . import metrics
+from .cache import cities_version
+from .history import history
+from .models import City, DispatchRun, UserSubscriptions, Subscription
+from .pagination import IdCursorPagination, RecentFirstCursorPagination
 from .permissions import MyPermissionIsAdminOrOwner
-from .serializers import CitySerializer, SubscriptionSerializer
+from .serializers import (
+    BulkSubscriptionSerializer, CitySerializer, DispatchRunSerializer, HistoryQuerySerializer,
+    ObservationAggregateSerializer, ObservationSerializer, SubscriptionSerializer, UserSettingsSerializer
+)
+
+logger = logging.getLogger(__name__)
 
 
 class CityListView(generics.ListAPIView):
@@ -12,11 +31,81 @@ class CityListView(generics.ListAPIView):
 
     This view allows authenticated users to access a list of cities
     available in the system. The cities are retrieved from the City model
-    and are serialized using the CitySerializer.
+    and are serialized using the CitySerializer, in pages addressed by a
+    cursor. Serialized pages are cached per version of the City table, and
+    responses carry ETag and Last-Modified headers, so clients polling an
+    unchanged list get 304 Not Modified without any serialization.
     """
-    queryset = City.objects.all()
+    queryset = City.objects.select_related('latest_observation')
     serializer_class = CitySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        """
+        List cities, answering from the response cache or with 304 when possible.
+
+        The cache key and the ETag are derived from the City table version and
+        the absolute request URL, so they change whenever any city is saved or
+        a different page or field selection is requested, and a page whose
+        next and previous links point at one host is never served to another.
+        Last-Modified only has whole seconds, so it is left out until the
+        second the version falls in is over; otherwise a city saved later in
+        that second would still match a client's If-Modified-Since.
+
+        Returns:
+            Response: The page of cities, or a 304 response for a matching conditional GET.
+        """
+        version = cities_version()
+        digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        etag = f'"{version}-{digest}"'
+        last_modified = math.floor(version) if time.time() >= math.floor(version) + 1 else None
+
+        if (not_modified := get_conditional_response(request, etag=etag, last_modified=last_modified)) is not None:
+            return not_modified
+
+        key = f'cities:response:{version}:{digest}'
+        if (data := cache.get(key)) is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, timeout=settings.CITY_LIST_CACHE_TTL)
+
+        headers = {'ETag': etag}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified)
+        return Response(data, headers=headers)
+
+
+class CityHistoryView(generics.GenericAPIView):
+    """
+    A view that retrieves the weather history of a city.
+
+    History is returned as stored observations (`resolution=raw`), or as
+    hourly or daily aggregates with averages, minimums and maximums, for
+    the range given by the `since` and `until` query parameters. Older
+    history only exists as aggregates, as the retention job downsamples it.
+    """
+    queryset = City.objects.only('id')
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handle GET requests.
+
+        Returns:
+            Response: The city id, the resolution and the history entries, oldest first.
+        """
+        city = self.get_object()
+        query = HistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        resolution, since, until = (query.validated_data[name] for name in ('resolution', 'since', 'until'))
+
+        entries = history(city.id, resolution, since, until)
+        serializer_class = ObservationSerializer if resolution == 'raw' else ObservationAggregateSerializer
+        return Response({
+            'city': city.id,
+            'resolution': resolution,
+            'results': serializer_class(entries, many=True).data,
+        })
 
 
 class SubscriptionListView(generics.ListAPIView):
@@ -26,43 +115,40 @@ class SubscriptionListView(generics.ListAPIView):
     This view allows authenticated users to access a list of their subscriptions.
     The subscriptions are retrieved based on the UserSubscriptions model, which
     stores a list of subscriptions associated with each user. The subscriptions
-    are filtered based on the current user and are serialized using the
-    SubscriptionSerializer.
+    are filtered based on the current user, serialized using the
+    SubscriptionSerializer and returned in pages addressed by a cursor.
     """
     serializer_class = SubscriptionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         """
         Retrieve the subscriptions for the authenticated user.
 
-        This method retrieves the subscriptions associated with the current
-        authenticated user from the UserSubscriptions model. It then filters
-        the Subscription objects based on the retrieved subscriptions and returns
-        the filtered queryset.
+        This method filters the Subscription objects by a join on the user's
+        UserSubscriptions entry and selects each subscription's city in the
+        same query, so serializing the city names costs no extra queries.
 
         Returns:
             QuerySet: A queryset containing the subscriptions of the current user.
         """
-        user_subscriptions = UserSubscriptions.objects.get(user=self.request.user)
-        subscriptions = Subscription.objects.filter(id__in=user_subscriptions.subscriptions.all())
-        return subscriptions
+        return Subscription.objects.filter(usersubscriptions=self.user_subscriptions).select_related('city')
 
     def get(self, request, *args, **kwargs):
         """
         Handle GET requests.
 
-        This method checks if the current user has an entry in the UserSubscriptions
-        model. If not, it creates an entry to store their subscriptions. Then, it
-        proceeds with the default list handling by calling the parent class's
-        `list` method to retrieve and return the user's subscription list.
+        This method fetches the current user's entry in the UserSubscriptions
+        model, creating it if the user has none yet. Then, it proceeds with the
+        default list handling by calling the parent class's `list` method to
+        retrieve and return the user's subscription list.
 
         Returns:
             Response: The response containing the list of subscriptions of the
                       authenticated user.
         """
-        if request.user not in [user.user for user in UserSubscriptions.objects.all()]:
-            UserSubscriptions.objects.create(user=request.user)
+        self.user_subscriptions, _ = UserSubscriptions.objects.get_or_create(user=request.user)
 
         return self.list(request, *args, **kwargs)
 
@@ -74,25 +160,57 @@ class SubscriptionRetrieveView(generics.RetrieveUpdateDestroyAPIView):
     This view allows authorized users to retrieve, update, or delete a specific
     subscription by providing its unique identifier (ID) in the URL. The view
     supports the HTTP methods GET, PUT, PATCH, and DELETE to perform these actions.
+    Subscriptions are shared by every user subscribed to the same schedule,
+    so users only ever change their own link to one: an update moves them to
+    the subscription of the new schedule and a delete unsubscribes them.
+    Staff users acting on a subscription they are not subscribed to change it
+    for all of its users.
     """
-    queryset = Subscription.objects.all()
+    queryset = Subscription.objects.select_related('city')
     serializer_class = SubscriptionSerializer
     permission_classes = [MyPermissionIsAdminOrOwner]
 
+    def own_link(self, instance):
+        return UserSubscriptions.objects.filter(user=self.request.user, subscriptions=instance).first()
+
     def update(self, request, *args, **kwargs):
         """
-        Update a specific subscription.
+        Move the subscribers of a subscription to the one of the updated schedule.
 
-        This method updates the specified subscription with the provided data.
         The subscription is retrieved using its unique identifier (ID) from
-        the URL, and the serializer is used to validate and save the updated data.
+        the URL, and the serializer is used to validate the changes and find
+        or create the subscription of the resulting schedule. The user is
+        moved over to it, or, for staff users not subscribed themselves,
+        every subscriber is and the old subscription is deleted.
+
+        Returns:
+            Response: The subscription the user is subscribed to now.
         """
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+
+        with transaction.atomic():
+            subscription = serializer.save()
+            if subscription.id != instance.id:
+                if (user_subscriptions := self.own_link(instance)) is not None:
+                    user_subscriptions.subscriptions.remove(instance)
+                    user_subscriptions.subscriptions.add(subscription)
+                else:
+                    through = UserSubscriptions.subscriptions.through
+                    through.objects.filter(subscription=instance).exclude(
+                        usersubscriptions__in=through.objects.filter(subscription=subscription)
+                        .values('usersubscriptions')
+                    ).update(subscription=subscription)
+                    instance.delete()
         return Response(serializer.data)
 
+    def perform_destroy(self, instance):
+        if (user_subscriptions := self.own_link(instance)) is not None:
+            user_subscriptions.subscriptions.remove(instance)
+        else:
+            instance.delete()
+
 
 class SubscriptionCreateView(generics.CreateAPIView):
     """
@@ -109,9 +227,10 @@ class SubscriptionCreateView(generics.CreateAPIView):
         """
         Create a new subscription for the authenticated user.
 
-        This method creates a new subscription with the data provided in the request.
-        The serializer is used to validate the data, and if valid, the subscription
-        is saved. The created subscription is then associated with the authenticated user
+        This method subscribes the user to the schedule given in the request.
+        The serializer is used to validate the data, and if valid, finds the
+        subscription other users of the same schedule share, or creates it.
+        The subscription is then associated with the authenticated user
         by adding it to the user's subscriptions in the UserSubscriptions model.
 
         Returns:
@@ -128,3 +247,155 @@ class SubscriptionCreateView(generics.CreateAPIView):
         user_subscriptions.subscriptions.add(subscription)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class SubscriptionBulkView(generics.GenericAPIView):
+    """
+    A view that creates, updates or deletes many subscriptions of the authenticated user at once.
+
+    Every method takes a list in the request body and handles it in a
+    single transaction with a constant number of queries, however long the
+    list is, up to SUBSCRIPTION_BULK_LIMIT items:
+
+    * POST: a list of schedules to subscribe to, like the body of /api/subscribe/.
+    * PATCH: a list of partial subscriptions, each carrying its `id`.
+    * DELETE: `{"ids": [...]}`, the ids of the subscriptions to unsubscribe from.
+
+    Subscriptions are shared, so only the user's own links to them change.
+    A request naming a subscription the user is not subscribed to, or any
+    unknown city, is rejected as a whole.
+    """
+    serializer_class = BulkSubscriptionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['user_subscriptions'], _ = UserSubscriptions.objects.get_or_create(user=self.request.user)
+        return context
+
+    def owned(self, ids, context):
+        return Subscription.objects.filter(
+            id__in=ids, usersubscriptions=context['user_subscriptions']
+        ).select_related('city')
+
+    def post(self, request, *args, **kwargs):
+        if not request.user.email:
+            return Response('Wrong email address')
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of subscriptions.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        ids = [item.get('id') for item in request.data if isinstance(item, dict)]
+        serializer = self.get_serializer_class()(
+            list(self.owned(ids, context)), data=request.data, many=True, partial=True, context=context
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    def delete(self, request, *args, **kwargs):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not ids or not all(isinstance(id_, int) for id_ in ids):
+            return Response({'ids': ['Expected a non-empty list of subscription ids.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        with transaction.atomic():
+            owned = self.owned(ids, context)
+            unknown = set(ids) - set(owned.values_list('id', flat=True))
+            if unknown:
+                return Response({'ids': [f'Unknown subscriptions: {", ".join(map(str, sorted(unknown)))}.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+            UserSubscriptions.subscriptions.through.objects.filter(
+                usersubscriptions=context['user_subscriptions'], subscription_id__in=ids
+            ).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UserSettingsView(generics.RetrieveUpdateAPIView):
+    """
+    A view that retrieves or updates the delivery settings of the authenticated user.
+
+    The settings live on the user's UserSubscriptions entry, which is
+    created with the defaults if the user has none yet. With `digest` set,
+    the bulletins of all the user's cities due in the same tick arrive as
+    one email instead of one email per city.
+    """
+    serializer_class = UserSettingsSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self):
+        user_subscriptions, _ = UserSubscriptions.objects.get_or_create(user=self.request.user)
+        return user_subscriptions
+
+
+class DispatchRunListView(generics.ListAPIView):
+    """
+    A view that retrieves the summaries of past dispatch ticks, newest first.
+
+    Each run reports how many notifications were sent, skipped and failed,
+    and how long the tick took. Only staff users have access.
+    """
+    queryset = DispatchRun.objects.all()
+    serializer_class = DispatchRunSerializer
+    permission_classes = [IsAdminUser]
+    pagination_class = RecentFirstCursorPagination
+
+
+def metrics_view(request):
+    """
+    Expose every registered metric in the Prometheus text format.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`;
+    staff users logged in to the admin can read the page as well. The
+    observations buffered by this process are flushed first, so they are
+    included.
+    """
+    token = settings.METRICS_TOKEN
+    if not (request.user.is_staff or token and request.headers.get('Authorization') == f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    metrics.flush()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def health_view(request):
+    """
+    Liveness probe: answers as long as the process can serve requests, without touching any backend.
+    """
+    return JsonResponse({'status': 'ok'})
+
+
+def ready_view(request):
+    """
+    Readiness probe: checks that the database and the cache answer.
+
+    Load balancers should only route traffic to a worker while this returns
+    200; any failing backend turns it into 503, with the failing checks
+    listed in the body. The probe needs no authentication, so the body only
+    says which check failed; the error itself is logged.
+    """
+    checks = {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        checks['database'] = 'ok'
+    except DatabaseError:
+        logger.exception('Readiness check of the database failed')
+        checks['database'] = 'unavailable'
+    try:
+        cache.set('health:ready', 1, timeout=10)
+        checks['cache'] = 'ok' if cache.get('health:ready') == 1 else 'unreadable'
+    except Exception:  # Cache backends raise their client library's own errors.
+        logger.exception('Readiness check of the cache failed')
+        checks['cache'] = 'unavailable'
+
+    ready = all(result == 'ok' for result in checks.values())
+    return JsonResponse(checks, status=200 if ready else 503)
@@ -0,0 +1,316 @@
+import logging
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from main.cache import ObservationCache, bump_cities_version
+from main.metrics import Histogram
+from main.models import City, Observation
+from main.upstream import CircuitBreaker, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_SECONDS = Histogram('weather_upstream_request_seconds', 'Latency of Weatherbit API requests, per attempt.')
+
+Location = namedtuple('Location', 'name lat lon', defaults=(None, None))
+
+
+class WeatherClient:
+    """
+    The one way to call the Weatherbit API, shared by the whole process.
+
+    Requests go through a pooled session, so concurrent fetches reuse
+    keep-alive connections, and every request has a connect and a read
+    timeout, so a hung connection cannot stall a tick. Requests take a
+    token from a rate limiter shared by all workers first. Connection
+    errors, timeouts, 429 and 5xx answers are retried with exponential
+    backoff and jitter. A request that still fails counts towards a circuit
+    breaker shared by all workers, and while the breaker is open no request
+    is sent at all, so callers fall back to cached observations right away.
+
+    Args:
+        connect_timeout (float): Seconds to wait for a connection, WEATHER_CONNECT_TIMEOUT by default.
+        read_timeout (float): Seconds to wait for an answer, WEATHER_READ_TIMEOUT by default.
+        retries (int): Retries after a failed attempt, WEATHER_RETRIES by default.
+        backoff (float): Seconds before the first retry, doubled for every
+                         retry after it, WEATHER_RETRY_BACKOFF by default.
+        rate_limit (float): Requests per second across all workers,
+                            WEATHER_RATE_LIMIT by default, 0 disables the limit.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, retries=None, backoff=None, rate_limit=None):
+        self.timeout = (
+            settings.WEATHER_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            settings.WEATHER_READ_TIMEOUT if read_timeout is None else read_timeout,
+        )
+        self.retries = settings.WEATHER_RETRIES if retries is None else retries
+        self.backoff = settings.WEATHER_RETRY_BACKOFF if backoff is None else backoff
+        self.limiter = RateLimiter('weatherbit', settings.WEATHER_RATE_LIMIT if rate_limit is None else rate_limit)
+        self.breaker = CircuitBreaker(
+            'weatherbit', settings.WEATHER_BREAKER_THRESHOLD, settings.WEATHER_BREAKER_RESET_TIMEOUT
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.WEATHER_FETCH_WORKERS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, params):
+        """
+        Query the current-weather endpoint.
+
+        Args:
+            params (dict): Query parameters besides the API key and language.
+
+        Returns:
+            dict: The decoded answer, or None if the request failed, was
+                  refused by the open breaker, or asked for something that
+                  does not exist.
+        """
+        if not self.breaker.allow():
+            return None
+
+        params = {**params, "key": settings.WEATHER_API_KEY, "lang": "UK"}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            self.limiter.acquire()
+            try:
+                with UPSTREAM_SECONDS.time():
+                    response = self.session.get(settings.WEATHER_API_URL, params=params, timeout=self.timeout)
+            except requests.RequestException as exc:
+                logger.warning("Weather API request failed (attempt %d): %s", attempt + 1, exc)
+                continue
+            if response.status_code == 200:
+                self.breaker.record_success()
+                return response.json()
+            if response.status_code != 429 and response.status_code < 500:
+                return None
+            logger.warning("Weather API answered %d (attempt %d)", response.status_code, attempt + 1)
+
+        self.breaker.record_failure()
+        return None
+
+
+client = WeatherClient()
+
+
+def fetch_weather(city):
+    """
+    Fetch the current weather for a city by name from the Weatherbit API.
+
+    Returns:
+        dict: The current observation, or None if the API request failed.
+    """
+    if (answer := client.get({"city": city})) is None:
+        return None
+    return answer['data'][0]
+
+
+def fetch_points(cities):
+    """
+    Fetch the current weather for many located cities with one bulk request.
+
+    The cities are requested by coordinates through the `points` parameter.
+    The answer is not guaranteed to keep the order of the request, so every
+    returned observation is matched to the nearest requested point.
+
+    Args:
+        cities (dict): Locations with coordinates, keyed by city id.
+
+    Returns:
+        dict: Observations keyed by city id. Cities missing from the answer,
+              or all of them if the request failed, are left out.
+    """
+    points = ','.join(f'({city.lat},{city.lon})' for city in cities.values())
+    if (answer := client.get({"points": points})) is None:
+        return {}
+    return match_points(cities, answer['data'])
+
+
+def match_points(cities, data):
+    """
+    Pair each observation of a bulk answer with the nearest requested city.
+    """
+    unmatched = dict(cities)
+    matched = {}
+    for weather in data:
+        if not unmatched:
+            break
+        city_id = min(
+            unmatched,
+            key=lambda key: (unmatched[key].lat - weather['lat']) ** 2 + (unmatched[key].lon - weather['lon']) ** 2,
+        )
+        matched[city_id] = weather
+        del unmatched[city_id]
+    return matched
+
+
+def fetch_one(cities):
+    (city_id, city), = cities.items()
+    weather = fetch_weather(city.name)
+    return {} if weather is None else {city_id: weather}
+
+
+def fetch_many(cities):
+    """
+    Fetch the current weather for many cities in as few upstream requests as possible.
+
+    Cities with known coordinates are fetched in bulk, WEATHER_BULK_SIZE per
+    request. Cities not located yet are fetched by name, one request each,
+    and their coordinates are stored by fetch_bulletins for the next time.
+    All requests run in parallel through a bounded pool of
+    WEATHER_FETCH_WORKERS threads.
+
+    Args:
+        cities (dict): Locations keyed by city id.
+
+    Returns:
+        dict: Observations keyed by city id, for the cities that could be fetched.
+    """
+    located = [(city_id, city) for city_id, city in cities.items() if city.lat is not None and city.lon is not None]
+    jobs = [
+        (fetch_points, dict(located[start:start + settings.WEATHER_BULK_SIZE]))
+        for start in range(0, len(located), settings.WEATHER_BULK_SIZE)
+    ]
+    jobs += [(fetch_one, {city_id: city}) for city_id, city in cities.items() if city.lat is None or city.lon is None]
+    if not jobs:
+        return {}
+
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=min(settings.WEATHER_FETCH_WORKERS, len(jobs))) as executor:
+        for result in executor.map(lambda job: job[0](job[1]), jobs):
+            fetched.update(result)
+    return fetched
+
+
+BULLETIN_TEMPLATES = {
+    'uk': "\nПогода в {city}:\n"
+          "Температура: {o.temp:g}°C\n"
+          "Відчувається як: {o.app_temp:g}°C\n"
+          "Тиск: {o.pres:g} mb.\n"
+          "Швидкість вітру: {o.wind_spd:g} м/с\n"
+          "Напрямок вітру: {o.wind_cdir_full}\n"
+          "Вологість повітря: {o.rh:g}%\n"
+          "Видимість: {o.vis:g}км\n"
+          "УФ-індекс: {o.uv:g}\n"
+          "Час останнього спостереження: {o.ob_time:%Y-%m-%d %H:%M}",
+    'en': "\nWeather in {city}:\n"
+          "Temperature: {o.temp:g}°C\n"
+          "Feels like: {o.app_temp:g}°C\n"
+          "Pressure: {o.pres:g} mb\n"
+          "Wind speed: {o.wind_spd:g} m/s\n"
+          "Wind direction: {o.wind_cdir_full}\n"
+          "Humidity: {o.rh:g}%\n"
+          "Visibility: {o.vis:g} km\n"
+          "UV index: {o.uv:g}\n"
+          "Observed at: {o.ob_time:%Y-%m-%d %H:%M}",
+}
+
+
+def render_weather(city, observation, lang=None):
+    """
+    Render an observation as a plain-text bulletin.
+
+    Args:
+        city (str): The city name to put in the bulletin.
+        observation (Observation): The observation to render.
+        lang (str): A key of BULLETIN_TEMPLATES, WEATHER_BULLETIN_LANGUAGE by default.
+    """
+    template = BULLETIN_TEMPLATES.get(lang or settings.WEATHER_BULLETIN_LANGUAGE, BULLETIN_TEMPLATES['uk'])
+    return template.format(city=city, o=observation)
+
+
+observations = ObservationCache(
+    fetch_many,
+    ttl=settings.WEATHER_CACHE_TTL,
+    stale_ttl=settings.WEATHER_CACHE_STALE_TTL,
+    local_size=settings.WEATHER_CACHE_LOCAL_SIZE,
+    fallback_ttl=settings.WEATHER_CACHE_FALLBACK_TTL,
+)
+
+
+def collect_weather(cities):
+    """
+    Look up the current weather for many cities at once.
+
+    Lookups go through the observation cache, so only cities without a
+    usable cached observation are fetched upstream, in bulk where possible.
+    Cities that cannot be fetched, e.g. while the upstream circuit breaker
+    is open, get their last cached observation if there is one.
+
+    Args:
+        cities (dict): Locations keyed by city id.
+
+    Returns:
+        dict: Weatherbit observation data keyed by city id. Cities whose
+              weather could not be fetched are left out.
+    """
+    if not cities:
+        return {}
+    return {city_id: weather for city_id, weather in observations.get_many(cities).items() if weather is not None}
+
+
+def collect_bulletins(cities):
+    """
+    Render the current weather bulletins for many cities at once.
+
+    Args:
+        cities (dict): Locations keyed by city id.
+
+    Returns:
+        dict: Rendered bulletins keyed by city id, for the cities
+              collect_weather could find weather for.
+    """
+    return {
+        city_id: render_weather(cities[city_id].name, Observation.from_weatherbit(city_id, weather))
+        for city_id, weather in collect_weather(cities).items()
+    }
+
+
+def fetch_bulletins(cities):
+    """
+    Collect the observations for many cities, store them and render the bulletins.
+
+    New observations are inserted in one bulk insert, where an observation
+    already stored for the same city and time is kept as is, and every
+    city's latest_observation is pointed at its row in one bulk update.
+    Cities fetched by name get the coordinates from the answer stored in the
+    same update, so they are fetched in bulk from then on. Bulk updates
+    bypass the save signals, so the city list version is bumped here.
+
+    Args:
+        cities (dict): Locations keyed by city id.
+
+    Returns:
+        dict: Rendered bulletins keyed by city id, as returned by collect_bulletins.
+    """
+    weather_by_city = collect_weather(cities)
+    if not weather_by_city:
+        return {}
+
+    fetched = {city_id: Observation.from_weatherbit(city_id, weather) for city_id, weather in weather_by_city.items()}
+    Observation.objects.bulk_create(fetched.values(), ignore_conflicts=True)
+    stored = {
+        (observation.city_id, observation.ob_time): observation.id
+        for observation in Observation.objects.filter(
+            city_id__in=fetched, ob_time__in={observation.ob_time for observation in fetched.values()}
+        ).only('id', 'city_id', 'ob_time')
+    }
+    City.objects.bulk_update(
+        [
+            City(
+                id=city_id,
+                latest_observation_id=stored[city_id, observation.ob_time],
+                lat=cities[city_id].lat if cities[city_id].lat is not None else weather_by_city[city_id].get('lat'),
+                lon=cities[city_id].lon if cities[city_id].lon is not None else weather_by_city[city_id].get('lon'),
+            )
+            for city_id, observation in fetched.items()
+        ],
+        ['latest_observation', 'lat', 'lon'],
+    )
+    bump_cities_version()
+
+    return {city_id: render_weather(cities[city_id].name, observation) for city_id, observation in fetched.items()}
@@ -90,7 +90,11 @@ DATABASES = {
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Keep each worker thread's connection open across requests instead
+        # of connecting for every request, checking it before reuse.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -171,12 +175,14 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'main.authentication.CachedJWTAuthentication',
+        'main.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
 }
+# Maximum number of subscriptions in one request to the bulk endpoint.
+SUBSCRIPTION_BULK_LIMIT = int(os.getenv('SUBSCRIPTION_BULK_LIMIT', 500))
 
 
 # SimpleJWT
@@ -232,6 +238,17 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_WORKER_SEND_TASK_EVENTS = True
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1',
+    }
+}
+CITY_LIST_CACHE_TTL = int(os.getenv('CITY_LIST_CACHE_TTL', 3600))
+# Seconds the users resolved by JWT and token authentication are cached; saving a user drops the entry at once.
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 300))
 
 
 # Email
@@ -241,7 +258,60 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = True
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 100))
+EMAIL_RATE_LIMIT = float(os.getenv('EMAIL_RATE_LIMIT', 0))
+EMAIL_BCC_SIZE = int(os.getenv('EMAIL_BCC_SIZE', 50))
 
 
 # Weather API
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY')
+WEATHER_BULLETIN_LANGUAGE = os.getenv('WEATHER_BULLETIN_LANGUAGE', 'uk')
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'https://api.weatherbit.io/v2.0/current')
+WEATHER_FETCH_WORKERS = int(os.getenv('WEATHER_FETCH_WORKERS', 16))
+WEATHER_BULK_SIZE = int(os.getenv('WEATHER_BULK_SIZE', 100))
+WEATHER_CONNECT_TIMEOUT = float(os.getenv('WEATHER_CONNECT_TIMEOUT', 3.05))
+WEATHER_READ_TIMEOUT = float(os.getenv('WEATHER_READ_TIMEOUT', 10))
+WEATHER_RETRIES = int(os.getenv('WEATHER_RETRIES', 2))
+WEATHER_RETRY_BACKOFF = float(os.getenv('WEATHER_RETRY_BACKOFF', 0.5))
+WEATHER_RATE_LIMIT = float(os.getenv('WEATHER_RATE_LIMIT', 0))
+WEATHER_BREAKER_THRESHOLD = int(os.getenv('WEATHER_BREAKER_THRESHOLD', 5))
+WEATHER_BREAKER_RESET_TIMEOUT = float(os.getenv('WEATHER_BREAKER_RESET_TIMEOUT', 60))
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 900))
+WEATHER_CACHE_STALE_TTL = int(os.getenv('WEATHER_CACHE_STALE_TTL', 900))
+WEATHER_CACHE_LOCAL_SIZE = int(os.getenv('WEATHER_CACHE_LOCAL_SIZE', 1024))
+WEATHER_CACHE_FALLBACK_TTL = int(os.getenv('WEATHER_CACHE_FALLBACK_TTL', 86400))
+# Days observations are kept as fetched, and days their hourly aggregates are kept before becoming daily ones.
+OBSERVATION_RAW_RETENTION_DAYS = int(os.getenv('OBSERVATION_RAW_RETENTION_DAYS', 7))
+OBSERVATION_HOURLY_RETENTION_DAYS = int(os.getenv('OBSERVATION_HOURLY_RETENTION_DAYS', 90))
+
+
+# Instrumentation
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Share of per-notification events that are logged.
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'main.instrumentation.StructuredFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'main': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+
+# Dispatch
+DISPATCH_CHUNK_SIZE = int(os.getenv('DISPATCH_CHUNK_SIZE', 500))
+DISPATCH_BLOCK_SIZE = int(os.getenv('DISPATCH_BLOCK_SIZE', 100))
+DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', 20))
+DISPATCH_SENDERS = int(os.getenv('DISPATCH_SENDERS', 4))
+# 0 runs one tick at the top of every hour. A positive value runs a tick every
+# minute and spreads schedules over that many minutes past the hour.
+DISPATCH_SPREAD_MINUTES = int(os.getenv('DISPATCH_SPREAD_MINUTES', 0))
+# Seconds after which a tick's dispatch lock expires if its chord callback never released it.
+DISPATCH_LOCK_TIMEOUT = int(os.getenv('DISPATCH_LOCK_TIMEOUT', 900))